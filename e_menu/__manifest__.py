@@ -18,11 +18,12 @@ Long description of module's purpose
     'version': '0.1.0',
 
     # any module necessary for this one to work correctly
-    'depends': ['web', 'sale_management', 'html_editor', "contacts", 'hr', 'stock'],
+    'depends': ['web', 'bus', 'sale_management', 'html_editor', "contacts", 'hr', 'stock'],
 
     # always loaded
     'data': [
         'security/ir.model.access.csv',
+        'data/ir_cron_data.xml',
         'views/views.xml',
         'views/res_partner_views.xml',
         'views/angkort_shop_bank_views.xml',
@@ -30,6 +31,7 @@ Long description of module's purpose
         'views/product_template_views.xml',
         "views/product_category_views.xml",
         "views/product_attribute_views.xml",
+        'views/angkort_promotion_views.xml',
 
         'views/menu_views.xml',
         'views/templates.xml',
@@ -12,15 +12,18 @@ import odoo
 from odoo import http, tools
 from odoo.api import call_kw
 from odoo.models import check_method_name
-from odoo.tools import config
-from odoo.exceptions import UserError
+from odoo.tools import config, json_default
+from odoo.exceptions import AccessError, UserError
 from odoo.http import request
 from odoo import fields, _
 
 from odoo.tools.mimetypes import guess_mimetype
 
+from .utils import idempotent, encode_cursor, decode_cursor, owned_shop_ids
+
 BASE_URL = '/angkort/api/v1'
 SAVE_IMAGE_URL = "/html_editor/attachment/add_data"
+SALE_EXPORT_BATCH_SIZE = 500
 SALE_STATE = {
     'draft': 'Draft',
     'sent': 'Quotation Sent',
@@ -244,6 +247,7 @@ class EMenu(http.Controller):
             return request.make_json_response({'error': str(e)}, status=400)
 
     @http.route(f"{BASE_URL}/shop/create", auth="angkit", type="json", cors="*")
+    @idempotent
     def create_shop(self):
         """
         Returns a list of products in JSON format.
@@ -468,17 +472,45 @@ class EMenu(http.Controller):
             }
         } for product in products]
 
-    @http.route(f"{BASE_URL}/sale/list", auth="public", type="json")
-    def sale_order(self):
+    def _sale_order_domain(self, params):
+        """Return the domain of the orders of a sale list request that the current user may see.
 
-        """
-        Returns a list of sales orders with details such as ID, name, state, order date,
-        customer information, salesman information, sales team information, order lines,
-        and total in JSON format.
+        Orders are limited to the shops the user manages, and to the user's own orders.
 
-        The route for this endpoint is `BASE_URL/sale/list`, and it is publicly accessible.
+        :raise ValueError: when a filter is malformed
+        :raise AccessError: when ``shop_id`` is a shop the user does not manage
         """
-        sale_orders = request.env['sale.order'].sudo().search([])
+        shop_ids = owned_shop_ids()
+        if params.get('shop_id'):
+            shop_id = int(params['shop_id'])
+            if shop_id not in shop_ids:
+                raise AccessError(_("You do not manage this shop."))
+            domain = [('shop_id', '=', shop_id)]
+        else:
+            domain = ['|', ('shop_id', 'in', shop_ids), ('partner_id', '=', request.env.user.partner_id.id)]
+        if params.get('date_from'):
+            domain.append(('date_order', '>=', fields.Datetime.to_datetime(params['date_from'])))
+        if params.get('date_to'):
+            domain.append(('date_order', '<=', fields.Datetime.to_datetime(params['date_to'])))
+        if params.get('state'):
+            if params['state'] not in SALE_STATE:
+                raise ValueError(f"Invalid state {params['state']}")
+            domain.append(('state', '=', params['state']))
+        return domain
+
+    def _sale_order_domain_error(self, error):
+        if isinstance(error, AccessError):
+            return request.make_json_response({'status': 'error', 'message': str(error)}, status=403)
+        return request.make_json_response({'status': 'error', 'message': 'Invalid filter'}, status=400)
+
+    def _sale_orders_to_dicts(self, sales):
+        """Serialize orders, with the lines of all of them loaded at once."""
+        lines = sales.env['sale.order.line'].search([('order_id', 'in', sales.ids)], order='order_id, sequence, id')
+        lines.fetch(['order_id', 'product_id', 'product_uom_qty', 'price_unit', 'price_subtotal'])
+        lines.product_id.fetch(['name'])
+        lines_by_order = lines.grouped('order_id')
+        sales.fetch(['name', 'state', 'date_order', 'partner_id', 'user_id', 'team_id', 'amount_untaxed',
+                     'amount_tax', 'amount_total'])
         return [{
             'id': sale.id,
             'name': sale.name,
@@ -495,11 +527,91 @@ class EMenu(http.Controller):
                 'qty': line.product_uom_qty,
                 'unit_price': line.price_unit,
                 'total': line.price_subtotal
-            } for line in sale.order_line],
-            'total': sale.tax_totals
-        } for sale in sale_orders]
+            } for line in lines_by_order.get(sale, [])],
+            'amount_untaxed': sale.amount_untaxed,
+            'amount_tax': sale.amount_tax,
+            'total': sale.amount_total
+        } for sale in sales]
+
+    @http.route(f"{BASE_URL}/sale/list", auth="angkit", type="json", cors="*")
+    def sale_order(self):
+        """
+        Returns a page of sales orders, newest first, with details such as ID, name, state, order date,
+        customer information, salesman information, sales team information, order lines and totals.
+
+        Only the orders of the shops the user manages, and the user's own orders, are listed.
+        A `shop_id` the user does not manage is refused with HTTP 403, malformed filters
+        with HTTP 400.
+
+        Request Body (all optional):
+            {
+                "shop_id": int,
+                "date_from": str,   # "YYYY-MM-DD HH:MM:SS", UTC
+                "date_to": str,
+                "state": str,       # draft, sent, sale or cancel
+                "limit": int,       # default 50, max 200
+                "cursor": str       # next_cursor of the previous page
+            }
+
+        Returns ``{'orders': [...], 'next_cursor': str|None}``. The lines of the whole
+        page are read with one query. Use `/sale/export` to download every matching order.
+        """
+        data = request.get_json_data()
+        params = data.get('params', data)
+        try:
+            limit = min(max(1, int(params.get('limit') or 50)), 200)
+            domain = self._sale_order_domain(params)
+        except (TypeError, ValueError, AccessError) as e:
+            return self._sale_order_domain_error(e)
+        cursor = decode_cursor(params.get('cursor'), 1)
+        if cursor:
+            domain.append(('id', '<', cursor[0]))
+        sales = request.env['sale.order'].sudo().search(domain, limit=limit, order='id desc')
+        return {
+            'orders': self._sale_orders_to_dicts(sales),
+            'next_cursor': encode_cursor(sales[-1].id) if len(sales) == limit else None
+        }
+
+    @http.route(f"{BASE_URL}/sale/export", auth="angkit", type="http", methods=["GET"], cors="*")
+    def sale_order_export(self, **params):
+        """
+        Stream every sales order matching the `/sale/list` filters (given as query parameters),
+        as newline-delimited JSON, one order per line.
+
+        Orders are read by batches of 500 on a cursor of their own, as the response is
+        sent after the request's transaction ends, and written out as soon as a batch
+        is serialized, so the worker never holds the whole export in memory.
+        """
+        try:
+            domain = self._sale_order_domain(params)
+        except (TypeError, ValueError, AccessError) as e:
+            return self._sale_order_domain_error(e)
+        registry = request.env.registry
+        uid = request.env.uid
+        context = dict(request.env.context)
+
+        def generate():
+            with registry.cursor() as cr:
+                env = odoo.api.Environment(cr, uid, context)
+                last_id = None
+                while True:
+                    batch_domain = domain + ([('id', '<', last_id)] if last_id else [])
+                    sales = env['sale.order'].sudo().search(batch_domain, limit=SALE_EXPORT_BATCH_SIZE,
+                                                            order='id desc')
+                    if not sales:
+                        break
+                    for order in self._sale_orders_to_dicts(sales):
+                        yield json.dumps(order, default=json_default) + '\n'
+                    last_id = sales[-1].id
+                    env.invalidate_all()
+
+        return request.make_response(generate(), headers=[
+            ('Content-Type', 'application/x-ndjson'),
+            ('Content-Disposition', 'attachment; filename="sale_orders.ndjson"'),
+        ])
 
     @http.route(f"{BASE_URL}/order/new", auth="public", type="json", methods=["POST"], cors=False)
+    @idempotent(scope=lambda: (request.get_json_data().get('params') or {}).get('customer_id'))
     def new_order(self):
         data = json.loads(request.httprequest.data.decode('utf-8'))
         partner_id = data['params'].get('customer_id', 0)
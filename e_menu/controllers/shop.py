@@ -1,16 +1,35 @@
 import base64
+import copy
 import json
 
-from odoo import http, Command
+import psycopg2
+
+from odoo import http, Command, fields
 from odoo.http import request
+from odoo.tools.lru import LRU
 from collections import defaultdict
 
+from ..models.product_popularity import POPULARITY_WINDOWS
+from ..models.product_template import PRICE_RULE_TYPES, PRICE_RULE_TARGETS
+from .utils import (
+    idempotent, encode_cursor, decode_cursor, seek_after, owned_shop_ids, shop_owner_required,
+)
+
 BASE_URL = '/angkort/api/v1'
 
 PARTNER_FIELDS = [
     'name', 'wifi_name', 'phone', 'customer_address', 'shop_latitude', 'shop_longitude', 'email'
 ]
 
+# sort orders of the menu, see the /shop/<id>/product endpoint
+POPULARITY_SORTS = {
+    'popular': '7d',
+    'popular_30d': '30d',
+}
+
+# {(dbname, lang, order_id, write_date, partner_write_date): response}, details of the orders that can no longer change
+_order_detail_cache = LRU(2048)
+
 ORDER_STATE = {
     'draft': 'Quotation',
     'sent': 'Quotation Sent',
@@ -110,17 +129,18 @@ class ShopController(http.Controller):
 
     @http.route(f"{BASE_URL}/my/order", auth="angkit", type="json", cors="*")
     def my_order(self):
-        """Retrieve orders for the authenticated user with pagination and performance optimizations.
+        """Retrieve orders for the authenticated user, newest first, with cursor pagination.
 
-        This endpoint fetches sale orders for the currently authenticated user, grouped by their state.
-        It implements pagination to handle large datasets efficiently and includes performance optimizations
-        such as field limiting and proper indexing.
+        This endpoint fetches sale orders for the currently authenticated user, grouped by their state,
+        together with the number of orders of the user in every state.
 
         Request:
             GET /angkort/api/v1/my/order
             Query Parameters:
-                page (int): Page number for pagination (default: 1)
+                cursor (str): `next_cursor` of the previous page, omit it for the first page
                 limit (int): Number of records per page (default: 20, max: 100)
+                state (str): Optional - Only return orders in this state (draft, sent, sale, cancel)
+                page (int): Page number, only used without cursor (default: 1)
 
         Returns:
             dict: A dictionary containing orders and pagination information:
@@ -140,78 +160,57 @@ class ShopController(http.Controller):
                         "sale": [...],
                         ...
                     },
+                    "state_counts": {   # Orders of the user per state, over all pages
+                        "draft": int,
+                        "sale": int,
+                        ...
+                    },
                     "pagination": {
-                        "total": int,    # Total number of records
-                        "page": int,     # Current page number
-                        "limit": int,    # Records per page
-                        "pages": int     # Total number of pages
+                        "total": int,       # Total number of records
+                        "page": int,        # Current page number (page-based requests only)
+                        "limit": int,       # Records per page
+                        "pages": int,       # Total number of pages
+                        "next_cursor": str  # Cursor of the next page, null on the last page
                     }
                 }
 
         Examples:
             # Get first page of orders
-            GET /angkort/api/v1/my/order?page=1&limit=20
+            GET /angkort/api/v1/my/order?limit=20
 
-            # Get second page with 50 records
-            GET /angkort/api/v1/my/order?page=2&limit=50
+            # Get the next page
+            GET /angkort/api/v1/my/order?limit=20&cursor=WyIyMDI0LTA1LTAxIDEwOjEyOjQ1IiwgMTIzXQ==
 
         Performance:
-            - Uses field limiting to minimize data transfer
-            - Implements pagination to handle large datasets
-            - Uses read() for efficient field access
-            - Includes proper indexing hints
-            - Limits maximum records per page to prevent overload
-
-        Security:
-            - Requires authentication (auth="angkit")
-            - Uses sudo() for proper access rights
-            - Validates and sanitizes input parameters
-            - Limits maximum records per page to prevent DoS
-
-        Notes:
-            - Orders are sorted by date_order in descending order
-            - Empty or null dates are handled gracefully
-            - State values are mapped using ORDER_STATE dictionary
-            - All monetary values are returned as floats
-            - Response includes pagination metadata for frontend implementation
-
-        Raises:
-            None: This endpoint handles errors gracefully and returns empty results
-                  rather than raising exceptions
-        """
-        # Get pagination parameters with defaults
-        page = int(request.httprequest.args.get('page', 1))
+            - Pages are read from the (partner_id, date_order desc, id desc) index, continuing
+              after the last order of the previous page instead of skipping an offset
+            - State counts come from one grouped count
+        """
         limit = min(int(request.httprequest.args.get('limit', 20)), 100)  # Cap at 100 records
+        cursor = self._decode_date_cursor(request.httprequest.args.get('cursor'))
+        state = request.httprequest.args.get('state')
 
-        # Calculate offset
-        offset = (page - 1) * limit
-
-        # Define fields to fetch to minimize data transfer
-        fields = ['id', 'name', 'date_order', 'amount_total', 'state']
-
-        # Search with proper indexing and field limiting
+        sale_order_sudo = request.env['sale.order'].sudo()
         domain = [('partner_id', '=', request.env.user.partner_id.id)]
-
-        # Get total count for pagination
-        total = request.env['sale.order'].sudo().search_count(domain)
-
-        # Calculate total pages
+        state_counts = dict(sale_order_sudo._read_group(domain, ['state'], ['__count']))
+        if state:
+            domain.append(('state', '=', state))
+            total = state_counts.get(state, 0)
+        else:
+            total = sum(state_counts.values())
         pages = (total + limit - 1) // limit
-        page = min(max(1, page), pages) if pages > 0 else 1
-
-        # Fetch orders with optimized query
-        sales = request.env['sale.order'].sudo().search(
-            domain,
-            fields=fields,
-            offset=offset,
-            limit=limit,
-            order='date_order desc'  # Add proper indexing hint
-        )
-
-        # Use read() to fetch all fields at once
-        sales_data = sales.read(fields)
 
-        # Group orders by state
+        if cursor:
+            page = None
+            sales = sale_order_sudo.browse(seek_after(
+                sale_order_sudo, domain, cursor, ('date_order', 'id'), limit))
+        else:
+            page = int(request.httprequest.args.get('page', 1))
+            page = min(max(1, page), pages) if pages > 0 else 1
+            sales = sale_order_sudo.search(domain, offset=(page - 1) * limit, limit=limit,
+                                           order='date_order desc, id desc')
+
+        sales_data = sales.read(['name', 'date_order', 'amount_total', 'state'])
         grouped_orders = defaultdict(list)
         for sale in sales_data:
             grouped_orders[sale['state']].append({
@@ -222,17 +221,67 @@ class ShopController(http.Controller):
                 'state': ORDER_STATE.get(sale['state'])
             })
 
-        # Prepare response with pagination info
-        response = {
-            'orders': {state: orders for state, orders in grouped_orders.items()},
+        next_cursor = None
+        if len(sales_data) == limit:
+            next_cursor = encode_cursor(sales_data[-1]['date_order'], sales_data[-1]['id'])
+        return {
+            'orders': dict(grouped_orders),
+            'state_counts': state_counts,
             'pagination': {
                 'total': total,
                 'page': page,
                 'limit': limit,
-                'pages': pages
+                'pages': pages,
+                'next_cursor': next_cursor
             }
         }
-        return response
+
+    @http.route(f"{BASE_URL}/my/order/subscribe", auth="angkit", type="json", cors="*")
+    def my_order_subscribe(self):
+        """
+        Get the websocket channel pushing the state changes of the orders of the authenticated user.
+
+        Open a websocket on `websocket_url` and send
+        ``{"event_name": "subscribe", "data": {"channels": [channel], "last": last}}``.
+        Every state change of an order of the user then arrives within a second as a
+        notification of type ``angkort/order_status``, so the app does not need to poll
+        `/my/order`. After a reconnection, subscribe again with the id of the last
+        notification received as ``last`` to get the ones missed meanwhile.
+
+        Endpoint: POST /angkort/api/v1/my/order/subscribe
+        Auth: Required (angkit)
+
+        Returns:
+            dict:
+                {
+                    'websocket_url': str,      # Path of the websocket, on the API host
+                    'channel': str,            # Signed channel of the user's orders
+                    'notification_type': str,  # 'angkort/order_status'
+                    'last': int                # Id of the last notification sent so far
+                }
+
+        Example Notification:
+            {
+                "id": 5012,
+                "message": {
+                    "type": "angkort/order_status",
+                    "payload": {
+                        "id": 321,
+                        "name": "CAFE1-0042",
+                        "ticket_number": 42,
+                        "state": "sale",
+                        "write_date": "2024-05-01 12:03:11"
+                    }
+                }
+            }
+        """
+        return {
+            'websocket_url': '/websocket',
+            'channel': request.env['ir.websocket']._angkort_channel_token(
+                'angkort_orders', request.env.user.partner_id),
+            'notification_type': 'angkort/order_status',
+            'last': request.env['bus.bus'].sudo()._bus_last_id()
+        }
 
     @http.route(f'{BASE_URL}/my/order/<int:order_id>', auth="angkit", type="json", cors="*")
     def my_order_detail(self, order_id):
@@ -296,26 +345,141 @@ class ShopController(http.Controller):
         ], limit=1)
 
         if not order:
+            archived = request.env['angkort.sale.order.archive'].sudo().search([
+                ('original_id', '=', order_id),
+                ('partner_id', '=', request.env.user.partner_id.id)
+            ], limit=1)
+            if archived:
+                return self._archived_order_to_dict(archived)
             return {
                 'error': 'Order not found'
             }
 
-        return {
+        # cancelled and locked orders never change, and any write would change the key anyway
+        terminal = order.state == 'cancel' or (order.state == 'sale' and order.locked)
+        # the address is formatted in the language of the request
+        cache_key = (request.env.cr.dbname, request.env.lang, order.id, order.write_date, order.partner_id.write_date)
+        cached = _order_detail_cache.get(cache_key) if terminal else None
+        if cached is not None:
+            return copy.deepcopy(cached)
+
+        order.order_line.fetch(['product_id', 'product_uom_qty', 'price_unit'])
+        order.order_line.product_id.fetch(['name', 'default_code'])
+        response = {
             'id': order.id,
             'partner_id': order.partner_id.id,
             'partner_name': order.partner_id.name,
             'delivery_address': order.partner_id._display_address() if order.partner_shipping_id else '',
             'name': order.name,
+            'ticket_number': order.ticket_number,
             'date_order': order.date_order.strftime('%d-%m-%Y'),
             'total': order.amount_total,
             'state': ORDER_STATE.get(order.state),
             'order_lines': [self._order_line_to_dict(line) for line in order.order_line]
         }
+        if terminal:
+            _order_detail_cache[cache_key] = copy.deepcopy(response)
+        return response
+
+    @staticmethod
+    def _decode_date_cursor(cursor):
+        """Return the ``(date_order, id)`` of a cursor of the order lists, or None when it is missing or malformed."""
+        cursor = decode_cursor(cursor, 2)
+        try:
+            return cursor and (fields.Datetime.to_datetime(cursor[0]), int(cursor[1]))
+        except (TypeError, ValueError):
+            return None
+
+    @classmethod
+    def _archived_order_to_dict(cls, archived):
+        return {
+            'id': archived.original_id,
+            'partner_id': archived.partner_id.id,
+            'partner_name': archived.partner_id.name,
+            'delivery_address': '',
+            'name': archived.name,
+            'ticket_number': archived.ticket_number,
+            'date_order': archived.date_order.strftime('%d-%m-%Y') if archived.date_order else '',
+            'total': archived.amount_total,
+            'state': ORDER_STATE.get(archived.state),
+            'archived': True,
+            'order_lines': [{
+                'id': line['id'],
+                'product_id': line['product_id'],
+                'name': line['name'],
+                'code': line['code'],
+                'quantity': line['quantity'],
+                'price_unit': line['price_unit'],
+            } for line in json.loads(archived.lines or '[]')]
+        }
+
+    @http.route(f"{BASE_URL}/my/order/history", auth="angkit", type="json", cors="*")
+    def my_order_history(self):
+        """
+        Retrieve the archived orders of the authenticated user, newest first, with cursor pagination.
+
+        Orders older than the archiving delay of the database (`e_menu.order_archive_months`)
+        leave `/my/order` and are listed here instead. Their details stay available
+        on `/my/order/{order_id}`, with the same id.
+
+        Endpoint: GET /angkort/api/v1/my/order/history
+        Auth: Required (angkit)
+
+        Query Parameters:
+            cursor (str): `next_cursor` of the previous page, omit it for the first page
+            limit (int): Number of records per page, greater than 0 (default: 20, max: 100)
+
+        Returns:
+            dict:
+                {
+                    'orders': [{'id': int, 'name': str, 'date_order': str, 'total': float, 'state': str}],
+                    'next_cursor': str  # Cursor of the next page, null on the last page
+                }
+
+        Example:
+            GET /angkort/api/v1/my/order/history?limit=20
+        """
+        try:
+            limit = int(request.httprequest.args.get('limit', 20))
+        except ValueError:
+            limit = 0
+        if limit < 1:
+            return request.make_json_response({
+                'error': 'Invalid limit'
+            }, status=400)
+        limit = min(limit, 100)
+        cursor = self._decode_date_cursor(request.httprequest.args.get('cursor'))
+        archive_sudo = request.env['angkort.sale.order.archive'].sudo()
+        domain = [('partner_id', '=', request.env.user.partner_id.id)]
+        if cursor:
+            archives = archive_sudo.browse(seek_after(archive_sudo, domain, cursor, ('date_order', 'id'), limit))
+        else:
+            archives = archive_sudo.search(domain, limit=limit, order='date_order desc, id desc')
+        archives = archives.read(['original_id', 'name', 'date_order', 'amount_total', 'state'])
+        next_cursor = None
+        if len(archives) == limit:
+            next_cursor = encode_cursor(archives[-1]['date_order'], archives[-1]['id'])
+        return {
+            'orders': [{
+                'id': archive['original_id'],
+                'name': archive['name'],
+                'date_order': archive['date_order'].strftime('%d-%m-%Y') if archive['date_order'] else '',
+                'total': archive['amount_total'],
+                'state': ORDER_STATE.get(archive['state'])
+            } for archive in archives],
+            'next_cursor': next_cursor
+        }
 
     @http.route(f"{BASE_URL}/cart/checkout", auth="angkit", type="json", cors="*")
+    @idempotent
     def cart_checkout(self):
         """
-        Check the availability of products in the cart and calculate total amount.
+        Check the availability of products in the cart, hold their stock and calculate total amount.
+
+        When every product is available, the cart quantities of storable products are
+        held for the customer for ``e_menu.stock_hold_ttl`` minutes (10 by default).
+        Pass the returned ``hold_token`` when placing the order, or to the next checkout
+        to replace the previous holds. Nothing is held when a product is short.
 
         Endpoint: POST /angkort/api/v1/cart/checkout
         Auth: Required (angkit)
@@ -326,9 +490,10 @@ class ShopController(http.Controller):
                 "cart": [
                     {
                         "product_id": int,  # Required - ID of the product
-                        "quantity": int     # Required - Quantity of the product
+                        "quantity": int     # Required - Quantity of the product, greater than 0
                     }
-                ]
+                ],
+                "hold_token": str       # Optional - Token of a previous checkout to release
             }
 
         Returns:
@@ -336,7 +501,9 @@ class ShopController(http.Controller):
                 {
                     'status': str,          # 'sufficient_stock' or 'insufficient_stock'
                     'details': list,        # List of product details
-                    'total_amount': float   # Total amount of all products
+                    'total_amount': float,  # Total amount of all products
+                    'hold_token': str,      # Only with sufficient stock
+                    'hold_expires_at': str  # Only with sufficient stock
                 }
 
         Status Codes:
@@ -355,7 +522,9 @@ class ShopController(http.Controller):
                         "sub_total": 199.98
                     }
                 ],
-                "total_amount": 199.98
+                "total_amount": 199.98,
+                "hold_token": "4f1c0e9a2b7d4c3e8f6a5b4c3d2e1f0a",
+                "hold_expires_at": "2024-05-01 10:22:45"
             }
 
         Example Response (Insufficient Stock):
@@ -393,25 +562,42 @@ class ShopController(http.Controller):
             return {
                 'error': "Cart contains no valid products"
             }
+        if any(not isinstance(item.get('quantity'), int) or item['quantity'] <= 0 for item in cart):
+            return {
+                'error': "Quantity must be greater than 0"
+            }
         product_sudo = request.env['product.template'].sudo()
         products = product_sudo.search([('id', 'in', product_ids)])
         product_mapped = {product.id: product for product in products}
+        quantities = defaultdict(int)
+        for item in cart:
+            product = product_mapped.get(item['product_id'])
+            if product and product.is_storable:
+                quantities[product.id] += item.get('quantity', 0)
+        hold_sudo = request.env['angkort.stock.hold'].sudo()
+        hold_sudo._sync_units(products)
+        hold_token, hold_expires_at, missing = hold_sudo._claim(quantities, cart_obj.get('hold_token'))
         response = {'sufficient_stock': [], 'insufficient_stock': []}
         total_amount = 0.00
+        shop_prices = {
+            shop_id: self._get_price_table(shop_id).templates
+            for shop_id in products.shop_id.ids
+        }
 
         for item in cart:
             product = product_mapped.get(item['product_id'])
             if not product:
                 continue
-            subtotal = item.get('quantity', 0) * product.list_price
+            prices = shop_prices.get(product.shop_id.id, {})
+            subtotal = item.get('quantity', 0) * prices.get(product.id, product.list_price)
             total_amount += subtotal
-            if product.qty_available < item.get('quantity', 0):
+            if product.id in missing:
                 response['insufficient_stock'].append({
                     'product_id': product.id,
                     'code': product.default_code,
                     'name': product.name,
                     'quantity': item['quantity'],
-                    'available': product.qty_available,
+                    'available': missing[product.id],
                     'sub_total': subtotal
                 })
             else:
@@ -432,7 +618,9 @@ class ShopController(http.Controller):
         return {
             'status': 'sufficient_stock',
             'details': response['sufficient_stock'],
-            'total_amount': total_amount
+            'total_amount': total_amount,
+            'hold_token': hold_token,
+            'hold_expires_at': fields.Datetime.to_string(hold_expires_at)
         }
 
     @http.route(f"{BASE_URL}/shop", auth="public", type="json", cors="*")
@@ -660,6 +848,7 @@ class ShopController(http.Controller):
             return request.make_json_response({'error': str(e)}, status=400)
 
     @http.route(f"{BASE_URL}/shop/create", auth="angkit", type="json", cors="*")
+    @idempotent
     def create_shop(self):
         """
         Create a new shop.
@@ -839,8 +1028,10 @@ class ShopController(http.Controller):
                     'price': float,         # Product price
                     'description': str,     # Product description
                     'image': str,           # Product image URL
+                    'sold_out': bool,       # Out of stock or marked sold out by the shop
                     'options': list,        # Radio-type product options
-                    'choices': list         # Multi-select product choices
+                    'choices': list,        # Multi-select product choices
+                    'frequently_bought_together': list  # Products most often ordered with this one, best first
                 }
 
         Status Codes:
@@ -854,6 +1045,7 @@ class ShopController(http.Controller):
                 "price": 99.99,
                 "description": "Product description",
                 "image": "http://example.com/image.jpg",
+                "sold_out": false,
                 "options": [
                     {
                         "id": 1,
@@ -885,6 +1077,15 @@ class ShopController(http.Controller):
                 'error': 'Product not found'
             }
         response = self._get_product_details(product)
+        sold_out_ids = request.env['angkort.product.availability'].sudo()._get_sold_out_ids(shop_id)
+        response['sold_out'] = product.id in sold_out_ids
+        recommended_ids = request.env['angkort.product.recommendation'].sudo()._get_recommended_ids(product.id)
+        recommended = request.env['product.template'].sudo().browse(recommended_ids).filtered(
+            lambda recommendation: recommendation.active and recommendation.shop_id.id == shop_id)
+        response['frequently_bought_together'] = [
+            dict(self._product_to_dict(recommendation), sold_out=recommendation.id in sold_out_ids)
+            for recommendation in recommended
+        ]
         return response
 
     @http.route(f"{BASE_URL}/shop/<int:shop_id>/product", auth="public", type="json", cors="*")
@@ -899,6 +1100,10 @@ class ShopController(http.Controller):
         Parameters:
             shop_id (int): The ID of the shop to get products from
 
+        Query Parameters:
+            sort (str): Optional - 'popular' to list the best sellers of the last 7 days first,
+                        'popular_30d' for the last 30 days
+
         Returns:
             list: List of product dictionaries containing:
                 {
@@ -907,6 +1112,7 @@ class ShopController(http.Controller):
                     'price': float,         # Product price
                     'description': str,     # Product description
                     'image': str,           # Product image URL
+                    'sold_out': bool,       # Out of stock or marked sold out by the shop
                     'options': list,        # Radio-type product options
                     'choices': list         # Multi-select product choices
                 }
@@ -923,6 +1129,7 @@ class ShopController(http.Controller):
                     "price": 99.99,
                     "description": "Product description",
                     "image": "http://example.com/image.jpg",
+                    "sold_out": false,
                     "options": [
                         {
                             "id": 1,
@@ -947,9 +1154,16 @@ class ShopController(http.Controller):
             ]
         """
         products = request.env['product.product'].sudo().search([('shop_id', '=', shop_id)])
+        sort = request.httprequest.args.get('sort')
+        if sort in POPULARITY_SORTS:
+            ranking = request.env['angkort.product.popularity'].sudo()._get_ranking(shop_id, POPULARITY_SORTS[sort])
+            rank = {product_tmpl_id: index for index, product_tmpl_id in enumerate(ranking)}
+            products = products.sorted(lambda product: rank.get(product.product_tmpl_id.id, len(rank)))
+        sold_out_ids = request.env['angkort.product.availability'].sudo()._get_sold_out_ids(shop_id)
         data = []
         for product in products:
             tmp_data = self._product_to_dict(product)
+            tmp_data['sold_out'] = product.product_tmpl_id.id in sold_out_ids
             tmp_data['options'] = [self._get_product_options(option) for option in
                                    product.attribute_line_ids.filtered(
                                        lambda x: x.attribute_id.display_type == 'radio')]
@@ -959,8 +1173,116 @@ class ShopController(http.Controller):
             data.append(tmp_data)
         return data
 
+    @http.route(f"{BASE_URL}/shop/<int:shop_id>/product/popular", auth="public", type="json", cors="*")
+    def popular_product(self, shop_id):
+        """
+        Get the best sellers of a shop, best first.
+
+        Rankings come from per-product counters kept up to date when orders are
+        confirmed and recomputed every night, not from the order lines.
+
+        Endpoint: GET /angkort/api/v1/shop/{shop_id}/product/popular
+        Auth: Public
+
+        Query Parameters:
+            window (str): '7d' (default) or '30d', the period the sold quantities are counted over
+            limit (int): Number of products (default: 10, max: 50)
+
+        Returns:
+            list: Products sold in the period, as in /shop/{shop_id}/product, plus:
+                {
+                    'sold_quantity': float  # Quantity sold in the period
+                }
+
+        Example:
+            GET /angkort/api/v1/shop/1/product/popular?window=30d&limit=5
+        """
+        window = request.httprequest.args.get('window', '7d')
+        if window not in POPULARITY_WINDOWS:
+            return request.make_json_response({
+                'error': 'Invalid window, expected one of: %s' % ', '.join(POPULARITY_WINDOWS)
+            }, status=400)
+        try:
+            limit = min(50, max(1, int(request.httprequest.args.get('limit', 10))))
+        except ValueError:
+            return request.make_json_response({
+                'error': 'Invalid limit'
+            }, status=400)
+        popularity_sudo = request.env['angkort.product.popularity'].sudo()
+        ranking = popularity_sudo._get_ranking(shop_id, window, limit)
+        sold = {
+            popularity.product_tmpl_id.id: popularity[POPULARITY_WINDOWS[window]]
+            for popularity in popularity_sudo.search([('product_tmpl_id', 'in', ranking)])
+        }
+        rank = {product_tmpl_id: index for index, product_tmpl_id in enumerate(ranking)}
+        products = request.env['product.product'].sudo().search([
+            ('product_tmpl_id', 'in', ranking), ('shop_id', '=', shop_id),
+        ]).sorted(lambda product: rank[product.product_tmpl_id.id])
+        sold_out_ids = request.env['angkort.product.availability'].sudo()._get_sold_out_ids(shop_id)
+        data = []
+        for product in products:
+            tmp_data = self._product_to_dict(product)
+            tmp_data['sold_out'] = product.product_tmpl_id.id in sold_out_ids
+            tmp_data['sold_quantity'] = sold[product.product_tmpl_id.id]
+            data.append(tmp_data)
+        return data
+
+    @http.route(f"{BASE_URL}/shop/<int:shop_id>/product/<int:product_id>/sold-out", auth="angkit", type="json",
+                cors="*")
+    @shop_owner_required
+    def set_product_sold_out(self, shop_id, product_id):
+        """
+        Mark a product as sold out ("86") or available again, regardless of its stock.
+
+        Endpoint: POST /angkort/api/v1/shop/{shop_id}/product/{product_id}/sold-out
+        Auth: Required (angkit), by a user managing the shop
+        Content-Type: application/json
+
+        Request Body:
+            {
+                "sold_out": bool    # Required - True to take the product off, False to offer it again
+            }
+
+        Returns:
+            dict:
+                {
+                    'status': str,      # 'success' or 'error'
+                    'sold_out': bool    # Resulting flag; stays True while the product is out of stock
+                }
+
+        Example Response:
+            {
+                "status": "success",
+                "sold_out": true
+            }
+        """
+        data = request.get_json_data()
+        if 'sold_out' not in data:
+            return {
+                'status': 'error',
+                'message': 'sold_out is required'
+            }
+        product = request.env['product.template'].sudo().browse(product_id).exists()
+        if not product:
+            return {
+                'status': 'error',
+                'message': 'Product not found'
+            }
+        if product.shop_id.id != shop_id:
+            return {
+                'status': 'error',
+                'message': 'Product does not belong to this shop'
+            }
+        availability_sudo = request.env['angkort.product.availability'].sudo()
+        availability_sudo._set_manual_sold_out(product, data['sold_out'])
+        return {
+            'status': 'success',
+            'sold_out': product.id in availability_sudo._get_sold_out_ids(shop_id)
+        }
+
     @http.route(f"{BASE_URL}/shop/<int:shop_id>/product/create", auth="angkit", type="http", methods=["POST"],
                 csrf=False, cors="*")
+    @idempotent
     def create_product(self, shop_id, **kwargs):
         """
         Create a new product in a shop.
@@ -1562,11 +1884,219 @@ class ShopController(http.Controller):
                 'message': f"Error deleting product: {str(e)}"
             }, status=500)
 
+    @http.route(f"{BASE_URL}/shop/<int:shop_id>/product/price/bulk", auth="angkit", type="json", cors="*",
+                methods=['POST'])
+    @shop_owner_required
+    def bulk_update_product_price(self, shop_id):
+        """
+        Preview or apply a price rule to all matching products of a shop.
+
+        Endpoint: POST /angkort/api/v1/shop/{shop_id}/product/price/bulk
+        Auth: Required (angkit)
+        Content-Type: application/json
+
+        Parameters:
+            shop_id (int): The ID of the shop whose catalog is updated
+
+        Request Body:
+            {
+                "rule": {
+                    "type": str,           # Required: "percentage" or "fixed"
+                    "value": float,        # Required: e.g. 10 (= +10%) or -0.5 (= -0.50)
+                    "rounding": float      # Optional: round to a multiple of this value (e.g. 0.05)
+                },
+                "target": str,             # Optional: "products" (default), "extras" or "all"
+                "category_ids": [int],     # Optional: only products of these categories
+                "attribute_value_ids": [int],  # Optional: only products/extras using these values
+                "apply": bool              # Optional: false (default) only returns the preview
+            }
+
+        Returns:
+            dict: Response containing the price changes
+                {
+                    'status': str,         # 'success' or 'error'
+                    'applied': bool,       # True when the changes were written
+                    'changes': {
+                        'products': list,                  # list_price changes
+                        'attribute_values': list,          # default extra price changes
+                        'product_attribute_values': list   # per-product extra price changes
+                    }
+                }
+
+        Example Response (Preview):
+            {
+                "status": "success",
+                "applied": false,
+                "changes": {
+                    "products": [
+                        {"id": 12, "name": "Iced Latte", "old_price": 2.5, "new_price": 2.75}
+                    ],
+                    "attribute_values": [],
+                    "product_attribute_values": []
+                }
+            }
+        """
+        data = request.get_json_data()
+        rule = data.get('rule') or {}
+        target = data.get('target', 'products')
+
+        if rule.get('type') not in PRICE_RULE_TYPES:
+            return {
+                'status': 'error',
+                'message': f'Invalid rule type. Must be one of: {", ".join(PRICE_RULE_TYPES)}',
+            }
+        if target not in PRICE_RULE_TARGETS:
+            return {
+                'status': 'error',
+                'message': f'Invalid target. Must be one of: {", ".join(PRICE_RULE_TARGETS)}',
+            }
+        try:
+            value = float(rule['value'])
+            rounding = float(rule.get('rounding') or 0.0)
+        except (KeyError, TypeError, ValueError):
+            return {
+                'status': 'error',
+                'message': 'Rule value and rounding must be numbers',
+            }
+        if rounding < 0:
+            return {
+                'status': 'error',
+                'message': 'Rounding must be positive',
+            }
+
+        try:
+            apply = bool(data.get('apply'))
+            changes = request.env['product.template'].sudo()._angkort_bulk_price_update(
+                shop_id, rule['type'], value,
+                rounding=rounding,
+                categ_ids=data.get('category_ids'),
+                attribute_value_ids=data.get('attribute_value_ids'),
+                target=target,
+                apply=apply,
+            )
+            return {
+                'status': 'success',
+                'applied': apply,
+                'changes': changes,
+            }
+        except Exception as e:
+            return {
+                'status': 'error',
+                'message': f'Error updating prices: {str(e)}',
+            }
+
+    @http.route(f"{BASE_URL}/shop/<int:shop_id>/menu/clone", auth="angkit", type="json", cors="*",
+                methods=['POST'])
+    @shop_owner_required
+    def clone_menu(self, shop_id):
+        """
+        Copy the whole menu of a shop to another shop.
+
+        Endpoint: POST /angkort/api/v1/shop/{shop_id}/menu/clone
+        Auth: Required (angkit)
+        Content-Type: application/json
+
+        Parameters:
+            shop_id (int): The ID of the shop to copy the menu from
+
+        Request Body:
+            {
+                "target_shop_id": int    # Required: ID of the shop receiving the copy
+            }
+
+        Returns:
+            dict: Response containing the number of copied records
+                {
+                    'status': str,       # 'success' or 'error'
+                    'message': str,      # Success or error message
+                    'copied': {          # Only present on success
+                        'categories': int,
+                        'attributes': int,
+                        'attribute_values': int,
+                        'products': int
+                    }
+                }
+
+        Notes:
+            - The user must manage both shops
+            - Categories, attributes, values, products and their attribute lines are copied
+            - Product images are shared with the source products, not duplicated
+            - Attributes and values whose name the target shop already uses are reused, not copied
+            - Nothing is copied if any part of the copy fails
+        """
+        data = request.get_json_data()
+        target_shop_id = data.get('target_shop_id')
+        if not target_shop_id or target_shop_id == shop_id:
+            return {
+                'status': 'error',
+                'message': 'A target shop different from the source shop is required',
+            }
+
+        if target_shop_id not in owned_shop_ids():
+            return request.make_json_response({
+                'status': 'error',
+                'message': 'You do not manage the target shop',
+            }, status=403)
+        shops = request.env['res.partner'].sudo().browse([shop_id, target_shop_id])
+        source_shop = shops.filtered(lambda shop: shop.id == shop_id)
+        target_shop = shops - source_shop
+
+        try:
+            with request.env.cr.savepoint():
+                copied = source_shop._angkort_clone_menu(target_shop)
+            return {
+                'status': 'success',
+                'message': 'Menu copied successfully',
+                'copied': copied,
+            }
+        except Exception as e:
+            return {
+                'status': 'error',
+                'message': f'Error copying menu: {str(e)}',
+            }
+
     @http.route(f"{BASE_URL}/shop/<int:shop_id>/product/category", auth="public", type="json", cors="*")
     def product_category(self, shop_id):
-        categories = request.env['product.category'].sudo().searh([('shop_id', '=', shop_id)])
+        categories = request.env['product.category'].sudo().search([('shop_id', '=', shop_id)])
         return [self._category_to_dict(cate) for cate in categories]
 
+    @http.route(f"{BASE_URL}/shop/<int:shop_id>/product/category/tree", auth="public", type="json", cors="*")
+    def product_category_tree(self, shop_id):
+        """
+        Get the category tree of a shop with the number of products in each category.
+
+        Endpoint: GET /angkort/api/v1/shop/{shop_id}/product/category/tree
+        Auth: Public
+        Content-Type: application/json
+
+        Parameters:
+            shop_id (int): The ID of the shop
+
+        Returns:
+            list: Root categories, each containing:
+                {
+                    'id': int,                   # Category ID
+                    'name': str,                 # Category name
+                    'product_count': int,        # Active products directly in this category
+                    'total_product_count': int,  # Active products in this category and its children
+                    'children': list             # Sub-categories (same structure)
+                }
+
+        Example Response:
+            [
+                {
+                    "id": 1,
+                    "name": "Drinks",
+                    "product_count": 2,
+                    "total_product_count": 12,
+                    "children": [
+                        {"id": 2, "name": "Coffee", "product_count": 10, "total_product_count": 10, "children": []}
+                    ]
+                }
+            ]
+        """
+        return request.env['product.category'].sudo()._angkort_category_tree(shop_id)
+
     @http.route(f"{BASE_URL}/shop/<int:shop_id>/product/category/create", auth="angkit", type="json", cors="*")
     def create_product_category(self, shop_id):
         """
@@ -1910,22 +2440,23 @@ class ShopController(http.Controller):
                     'message': f'Invalid display_type value. Must be one of: {", ".join(VALID_DISPLAY_TYPES)}',
                 }
 
-            # Use exists() for faster existence check
-            if request.env['product.attribute'].sudo().search_count([
-                ('name', '=', data['name']),
-                ('shop_id', '=', shop_id),
-            ], limit=1):
-                return {
-                    'status': 'error',
-                    'message': f'Attribute with name {data["name"]} already exists',
-                }
-
             # Create attribute in a single operation
             variant_create_data = self._build_product_variants_data(data, shop_id)
             # Ensure create_variant is 'no_variant' when display_type is 'multi'
             if variant_create_data.get('display_type') == 'multi':
                 variant_create_data['create_variant'] = 'no_variant'
-            attribute = request.env['product.attribute'].sudo().create(variant_create_data)
+            attribute_sudo = request.env['product.attribute'].sudo()
+            try:
+                # Duplicate names are rejected by the (shop_id, name) unique index
+                with request.env.cr.savepoint():
+                    attribute = attribute_sudo.create(variant_create_data)
+            except psycopg2.IntegrityError as e:
+                if not attribute_sudo._angkort_is_duplicate_name_error(e):
+                    raise
+                return {
+                    'status': 'error',
+                    'message': f'Attribute with name {data["name"]} already exists',
+                }
 
             return {
                 'status': 'success',
@@ -2051,23 +2582,21 @@ class ShopController(http.Controller):
                     'message': f'Invalid display_type value. Must be one of: {", ".join(VALID_DISPLAY_TYPES)}'
                 }
 
-            # Check for duplicate name if name is being updated
-            if 'name' in data and data['name'] != attribute.name:
-                if request.env['product.attribute'].sudo().search_count([
-                    ('shop_id', '=', shop_id),
-                    ('name', '=', data['name'])
-                ], limit=1):
-                    return {
-                        'status': 'error',
-                        'message': f'Attribute with name {data["name"]} already exists'
-                    }
-
             # Ensure create_variant is 'no_variant' when display_type is 'multi'
             if data.get('display_type') == 'multi':
                 data['create_variant'] = 'no_variant'
 
-            # Update the attribute
-            attribute.write(data)
+            # Update the attribute, duplicate names are rejected by the (shop_id, name) unique index
+            try:
+                with request.env.cr.savepoint():
+                    attribute.write(data)
+            except psycopg2.IntegrityError as e:
+                if not attribute._angkort_is_duplicate_name_error(e):
+                    raise
+                return {
+                    'status': 'error',
+                    'message': f'Attribute with name {data["name"]} already exists'
+                }
 
             return {
                 'status': 'success',
@@ -2201,27 +2730,18 @@ class ShopController(http.Controller):
                     'message': 'Shop not found'
                 }
 
-            # Find the attribute
-            attribute = request.env['product.attribute'].sudo().search([
-                ('id', '=', variant_id),
-                ('shop_id', '=', shop_id)
-            ], limit=1)
+            # Find the attribute in the cached catalog of the shop
+            attribute = request.env['product.attribute'].sudo()._angkort_attribute_catalog(shop_id).get(variant_id)
             if not attribute:
                 return {
                     'status': 'error',
                     'message': 'Attribute not found'
                 }
 
-            value_list = [{
-                'id': value.id,
-                'name': value.name,
-                'extra_price': value.price_extra
-            } for value in attribute.value_ids]
-
             return {
                 'status': 'success',
                 'message': 'Values retrieved successfully',
-                'values': value_list
+                'values': attribute['values']
             }
 
         except Exception as e:
@@ -2396,11 +2916,13 @@ class ShopController(http.Controller):
 
     def _product_variant_list(self, shop_id):
         try:
-            attributes = request.env['product.attribute'].sudo().search([
-                ('create_uid', '=', request.env.user.id),
-                ('shop_id', '=', shop_id)
-            ])
-            return [self._attribute_to_dict(attribute) for attribute in attributes]
+            catalog = request.env['product.attribute'].sudo()._angkort_attribute_catalog(shop_id)
+            return [{
+                'id': attribute['id'],
+                'name': attribute['name'],
+                'create_variant': attribute['create_variant'],
+                'display_type': attribute['display_type'],
+            } for attribute in catalog.values() if attribute['create_uid'] == request.env.user.id]
         except Exception as e:
             return {
                 'status': 'error',
@@ -2450,7 +2972,9 @@ class ShopController(http.Controller):
                         'total_variant_price': float,  # Sum of all variant prices
                         'quantity': int,               # Requested quantity
                         'subtotal': float,            # Base price * quantity
-                        'total': float                # Final total with variants
+                        'discount': float,            # Discount of the best running promotion
+                        'promotion': dict|false,      # {'id', 'name'} of the applied promotion
+                        'total': float                # Final total with variants, after discount
                     }
                 }
 
@@ -2495,6 +3019,8 @@ class ShopController(http.Controller):
                     "total_variant_price": 7.50,
                     "quantity": 2,
                     "subtotal": 199.98,
+                    "discount": 0.0,
+                    "promotion": false,
                     "total": 214.98
                 }
             }
@@ -2515,71 +3041,601 @@ class ShopController(http.Controller):
                     'message': 'Quantity is required'
                 }
 
-            # Validate quantity is positive
-            quantity = int(data['quantity'])
-            if quantity <= 0:
+            line = self._price_cart_lines(shop_id, [{
+                'product_id': product_id,
+                'quantity': data['quantity'],
+                'variants': data.get('variants'),
+            }])[0]
+            if 'error' in line:
                 return {
                     'status': 'error',
-                    'message': 'Quantity must be greater than 0'
+                    'message': line['error']
                 }
 
-            # Get product
-            product = request.env['product.product'].sudo().search([
-                ('id', '=', product_id),
-                ('shop_id', '=', shop_id)
-            ], limit=1)
+            return {
+                'status': 'success',
+                'price_details': {
+                    'base_price': line['base_price'],
+                    'variant_prices': line['variant_prices'],
+                    'total_variant_price': line['total_variant_price'],
+                    'quantity': line['quantity'],
+                    'subtotal': line['base_price'] * line['quantity'],
+                    'discount': line['discount'],
+                    'promotion': line['promotion'],
+                    'total': line['total']
+                }
+            }
 
-            if not product:
-                return {
-                    'status': 'error',
-                    'message': 'Product not found'
+        except Exception as e:
+            return {
+                'status': 'error',
+                'message': f'Error calculating price: {str(e)}'
+            }
+
+    @http.route(f"{BASE_URL}/shop/<int:shop_id>/cart/price", auth="public", type="json", cors="*")
+    def calculate_cart_price(self, shop_id):
+        """
+        Calculate the price of every line of a cart, and the cart total, in one call.
+
+        Endpoint: POST /angkort/api/v1/shop/{shop_id}/cart/price
+        Auth: Public
+        Content-Type: application/json
+
+        Parameters:
+            shop_id (int): The ID of the shop the cart belongs to
+
+        Request Body:
+            {
+                "lines": [
+                    {
+                        "product_id": int,         # Required: ID of the product
+                        "quantity": int,           # Required: Quantity of the product
+                        "variants": [              # Optional: Selected variants
+                            {
+                                "attribute_id": int,
+                                "value_id": int
+                            }
+                        ]
+                    }
+                ]
+            }
+
+        Returns:
+            dict: Response containing the priced lines
+                {
+                    'status': str,       # 'success' or 'error'
+                    'lines': list,       # One entry per request line, in the same order
+                    'combo_discounts': list, # Combo promotions completed by the cart
+                    'discount_total': float, # Line and combo discounts
+                    'total': float,      # Sum of the totals of the valid lines, minus combo discounts
+                    'price_version': str # Changes whenever a price of the shop changes
                 }
 
-            # Initialize price details
-            base_price = product.list_price
-            variant_prices = []
-            total_variant_price = 0.0
+                Each line contains product_id, product_tmpl_id, name, quantity, base_price,
+                variant_prices, total_variant_price, unit_price, discount, promotion and total
+                (after discount), or an 'error' message when the line could not be priced.
+                Promotions are evaluated at the current time in the shop's timezone.
+
+        Example Response:
+            {
+                "status": "success",
+                "lines": [
+                    {
+                        "product_id": 123,
+                        "product_tmpl_id": 45,
+                        "name": "Iced Latte",
+                        "quantity": 2,
+                        "base_price": 2.5,
+                        "variant_prices": [
+                            {"attribute_name": "Size", "value_name": "Large", "price": 0.5}
+                        ],
+                        "total_variant_price": 0.5,
+                        "unit_price": 3.0,
+                        "discount": 1.2,
+                        "promotion": {"id": 3, "name": "Happy Hour"},
+                        "total": 4.8
+                    },
+                    {
+                        "product_id": 999,
+                        "error": "Product not found"
+                    }
+                ],
+                "combo_discounts": [],
+                "discount_total": 1.2,
+                "total": 4.8,
+                "price_version": "1842"
+            }
+        """
+        data = request.get_json_data()
+        lines = data.get('lines')
+        if not lines or not isinstance(lines, list):
+            return {
+                'status': 'error',
+                'message': 'Cart contains no lines'
+            }
+        try:
+            return dict(self._price_cart(shop_id, lines), status='success')
+        except Exception as e:
+            return {
+                'status': 'error',
+                'message': f'Error calculating price: {str(e)}'
+            }
+
+    @http.route(f"{BASE_URL}/shop/<int:shop_id>/order/place", auth="angkit", type="json", cors="*")
+    @idempotent
+    def place_order(self, shop_id):
+        """
+        Validate the stock of a cart, price it and place the order, in one call and one transaction.
 
-            # Calculate variant prices if provided
-            if 'variants' in data and isinstance(data['variants'], list):
-                for variant in data['variants']:
-                    if not all(k in variant for k in ['attribute_id', 'value_id']):
-                        continue
+        Prices are computed by the server exactly as `/shop/{shop_id}/cart/price` does,
+        including the running promotions; the client never sends prices. The stock of
+        storable products is held for the order until it is confirmed or cancelled. The
+        holds of a previous checkout are reused when its ``hold_token`` is passed.
 
-                    # Get attribute and value
-                    attribute = request.env['product.attribute'].sudo().browse(variant['attribute_id'])
-                    value = request.env['product.attribute.value'].sudo().browse(variant['value_id'])
+        Endpoint: POST /angkort/api/v1/shop/{shop_id}/order/place
+        Auth: Required (angkit)
+        Content-Type: application/json
+        Headers: Idempotency-Key (recommended, so a retried request does not place a second order)
 
-                    if not attribute.exists() or not value.exists():
-                        continue
+        Parameters:
+            shop_id (int): The ID of the shop the order is placed with
 
-                    # Add variant price
-                    variant_price = value.price_extra
-                    variant_prices.append({
-                        'attribute_name': attribute.name,
-                        'value_name': value.name,
-                        'price': variant_price
-                    })
-                    total_variant_price += variant_price
+        Request Body:
+            {
+                "lines": [
+                    {
+                        "product_id": int,         # Required: ID of the product
+                        "quantity": int,           # Required: Quantity of the product
+                        "variants": [              # Optional: Selected variants
+                            {
+                                "attribute_id": int,
+                                "value_id": int
+                            }
+                        ]
+                    }
+                ],
+                "hold_token": str,             # Optional: Token returned by /cart/checkout
+                "note": str                    # Optional: Note for the shop
+            }
 
-            # Calculate totals
-            subtotal = base_price * quantity
-            total = (base_price + total_variant_price) * quantity
+        Returns:
+            dict: Response containing the placed order
+                {
+                    'status': str,           # 'success', 'insufficient_stock' or 'error'
+                    'order_id': int,
+                    'name': str,             # Order reference, numbered per shop
+                    'ticket_number': int,    # Number of the order in its shop
+                    'lines': list,           # Priced lines, as returned by /cart/price
+                    'combo_discounts': list,
+                    'discount_total': float,
+                    'total': float,          # Amount untaxed of the order
+                    'amount_total': float    # Amount of the order, taxes included
+                }
 
+        Example Response (Insufficient Stock):
+            {
+                "status": "insufficient_stock",
+                "details": [
+                    {"product_id": 123, "name": "Iced Latte", "quantity": 5, "available": 3}
+                ]
+            }
+
+        Example Response (Error):
+            {
+                "status": "error",
+                "message": "Product not found"
+            }
+        """
+        data = request.get_json_data()
+        lines = data.get('lines')
+        if not lines or not isinstance(lines, list):
             return {
-                'status': 'success',
-                'price_details': {
-                    'base_price': base_price,
-                    'variant_prices': variant_prices,
-                    'total_variant_price': total_variant_price,
-                    'quantity': quantity,
-                    'subtotal': subtotal,
-                    'total': total
+                'status': 'error',
+                'message': 'Cart contains no lines'
+            }
+        shop = request.env['res.partner'].sudo().search([('id', '=', shop_id), ('type', '=', 'store')])
+        if not shop:
+            return {
+                'status': 'error',
+                'message': 'Shop not found'
+            }
+
+        cart = self._price_cart(shop_id, lines)
+        invalid_line = next((line for line in cart['lines'] if 'error' in line), None)
+        if invalid_line:
+            return {
+                'status': 'error',
+                'message': invalid_line['error'],
+                'product_id': invalid_line['product_id']
+            }
+
+        order, missing = request.env['sale.order'].sudo()._angkort_create_from_cart(
+            shop_id, request.env.user.partner_id, cart, hold_token=data.get('hold_token'), note=data.get('note'))
+        if missing:
+            return {
+                'status': 'insufficient_stock',
+                'details': missing
+            }
+        return {
+            'status': 'success',
+            'order_id': order.id,
+            'name': order.name,
+            'ticket_number': order.ticket_number,
+            'lines': cart['lines'],
+            'combo_discounts': cart['combo_discounts'],
+            'discount_total': cart['discount_total'],
+            'total': order.amount_untaxed,
+            'amount_total': order.amount_total
+        }
+
+    @http.route(f"{BASE_URL}/shop/<int:shop_id>/order/intake", auth="angkit", type="json", cors="*")
+    @idempotent
+    def order_intake(self, shop_id):
+        """
+        Accept an order and acknowledge it immediately, the order is created in the background.
+
+        Takes the same request body as `/shop/{shop_id}/order/place`. The cart is priced
+        and its stock held right away; the `sale.order` is created by a background job
+        within seconds. Poll `/order/intake/{intake_id}` for the outcome.
+
+        Endpoint: POST /angkort/api/v1/shop/{shop_id}/order/intake
+        Auth: Required (angkit)
+        Content-Type: application/json
+        Headers: Idempotency-Key (recommended)
+
+        Returns:
+            dict: Response containing the accepted intake
+                {
+                    'status': str,          # 'accepted', 'insufficient_stock' or 'error'
+                    'intake_id': int,
+                    'total': float,         # Total of the priced cart
+                    'hold_token': str,
+                    'hold_expires_at': str
                 }
+
+        Example Response:
+            {
+                "status": "accepted",
+                "intake_id": 812,
+                "total": 6.0,
+                "hold_token": "4f1c0e9a2b7d4c3e8f6a5b4c3d2e1f0a",
+                "hold_expires_at": "2024-05-01 12:10:02"
+            }
+        """
+        data = request.get_json_data()
+        lines = data.get('lines')
+        if not lines or not isinstance(lines, list):
+            return {
+                'status': 'error',
+                'message': 'Cart contains no lines'
+            }
+        shop = request.env['res.partner'].sudo().search([('id', '=', shop_id), ('type', '=', 'store')])
+        if not shop:
+            return {
+                'status': 'error',
+                'message': 'Shop not found'
             }
 
-        except Exception as e:
+        cart = self._price_cart(shop_id, lines)
+        invalid_line = next((line for line in cart['lines'] if 'error' in line), None)
+        if invalid_line:
             return {
                 'status': 'error',
-                'message': f'Error calculating price: {str(e)}'
+                'message': invalid_line['error'],
+                'product_id': invalid_line['product_id']
+            }
+        hold_token, hold_expires_at, missing = request.env['angkort.stock.hold'].sudo()._hold_cart(
+            cart, data.get('hold_token'))
+        if missing:
+            return {
+                'status': 'insufficient_stock',
+                'details': missing
+            }
+
+        intake = request.env['angkort.order.intake'].sudo()._enqueue(
+            shop_id, request.env.user.partner_id, cart, hold_token=hold_token, note=data.get('note'))
+        return {
+            'status': 'accepted',
+            'intake_id': intake.id,
+            'total': cart['total'],
+            'hold_token': hold_token,
+            'hold_expires_at': fields.Datetime.to_string(hold_expires_at)
+        }
+
+    @http.route(f"{BASE_URL}/order/intake/<int:intake_id>", auth="angkit", type="json", cors="*")
+    def order_intake_status(self, intake_id):
+        """
+        Get the processing status of an order accepted by `/shop/{shop_id}/order/intake`.
+
+        Endpoint: POST /angkort/api/v1/order/intake/{intake_id}
+        Auth: Required (angkit)
+
+        Returns:
+            dict:
+                {
+                    'status': str,      # 'pending', 'done' or 'failed'
+                    'order_id': int,    # Only when done
+                    'name': str,        # Only when done
+                    'ticket_number': int, # Only when done
+                    'error': str        # Only when failed
+                }
+        """
+        intake = request.env['angkort.order.intake'].sudo().search([
+            ('id', '=', intake_id),
+            ('partner_id', '=', request.env.user.partner_id.id),
+        ])
+        if not intake:
+            return {
+                'error': 'Order not found'
+            }
+        result = {'status': intake.state}
+        if intake.state == 'done':
+            result.update(order_id=intake.order_id.id, name=intake.order_id.name,
+                          ticket_number=intake.order_id.ticket_number)
+        elif intake.state == 'failed':
+            result['error'] = intake.error
+        return result
+
+    @http.route(f"{BASE_URL}/shop/<int:shop_id>/kitchen/subscribe", auth="angkit", type="json", cors="*")
+    @shop_owner_required
+    def kitchen_subscribe(self, shop_id):
+        """
+        Get the websocket channel of the kitchen display feed of a shop.
+
+        Kitchen screens open a websocket on `websocket_url` and subscribe to `channel`
+        (see `/my/order/subscribe`). New orders of the shop, and every change of an
+        order or of its lines, arrive as ``angkort/kitchen_order`` notifications
+        holding the whole ticket. Websockets are served by Odoo's long-lived
+        connection worker, and nothing is queried while no order changes.
+
+        Endpoint: POST /angkort/api/v1/shop/{shop_id}/kitchen/subscribe
+        Auth: Required (angkit)
+
+        Returns:
+            dict:
+                {
+                    'websocket_url': str,
+                    'channel': str,            # Signed channel of the shop's kitchen
+                    'notification_type': str,  # 'angkort/kitchen_order'
+                    'last': int,               # Id of the last notification sent so far
+                    'cursor': str              # Cursor for /shop/{shop_id}/kitchen/orders
+                }
+        """
+        shop = request.env['res.partner'].sudo().browse(shop_id)
+        return {
+            'websocket_url': '/websocket',
+            'channel': request.env['ir.websocket']._angkort_channel_token('angkort_kitchen', shop),
+            'notification_type': 'angkort/kitchen_order',
+            'last': request.env['bus.bus'].sudo()._bus_last_id(),
+            'cursor': encode_cursor(request.env['sale.order'].sudo()._angkort_kitchen_last_sequence(shop.id))
+        }
+
+    @http.route(f"{BASE_URL}/shop/<int:shop_id>/kitchen/orders", auth="angkit", type="json", cors="*")
+    @shop_owner_required
+    def kitchen_orders(self, shop_id):
+        """
+        Get the orders of a shop changed after a cursor, oldest change first.
+
+        Used by kitchen screens to load their tickets on start, and to catch up after
+        losing their websocket for longer than the bus keeps notifications.
+
+        Endpoint: POST /angkort/api/v1/shop/{shop_id}/kitchen/orders
+        Auth: Required (angkit)
+
+        Request Body:
+            {
+                "cursor": str,      # Optional - cursor of the previous call; omit it to get
+                                    #            the draft and confirmed orders of the day
+                "limit": int        # Optional - default 100, max 500
+            }
+
+        Returns:
+            dict:
+                {
+                    'orders': list,      # Same payload as the angkort/kitchen_order notifications
+                    'cursor': str,       # Pass it to the next call
+                    'has_more': bool     # True when more changes are waiting
+                }
+        """
+        data = request.get_json_data()
+        try:
+            limit = min(500, max(1, int(data.get('limit', 100))))
+        except (TypeError, ValueError):
+            return request.make_json_response({
+                'error': 'Invalid limit'
+            }, status=400)
+        sale_order_sudo = request.env['sale.order'].sudo()
+        domain = [('shop_id', '=', shop_id)]
+        cursor = decode_cursor(data.get('cursor'), 1)
+        if cursor:
+            # positions are assigned at commit, in commit order per shop: nothing can appear before the cursor later
+            try:
+                sequence = int(cursor[0])
+            except (TypeError, ValueError):
+                return {
+                    'status': 'error',
+                    'message': 'Invalid cursor'
+                }
+            domain += [('angkort_kitchen_sequence', '>', sequence)]
+        else:
+            sequence = sale_order_sudo._angkort_kitchen_last_sequence(shop_id)
+            domain += [('state', 'in', ('draft', 'sent', 'sale')),
+                       ('date_order', '>=', fields.Datetime.to_string(fields.Datetime.today()))]
+        orders = sale_order_sudo.search(domain, limit=limit, order='angkort_kitchen_sequence, id')
+        orders.order_line.fetch(['product_id', 'name', 'product_uom_qty', 'display_type'])
+        has_more = len(orders) == limit
+        if has_more or (cursor and orders):
+            sequence = orders[-1].angkort_kitchen_sequence or 0
+        return {
+            'orders': [order._angkort_kitchen_dict() for order in orders],
+            'cursor': encode_cursor(sequence),
+            'has_more': has_more
+        }
+
+    @http.route(f"{BASE_URL}/shop/<int:shop_id>/sales/dashboard", auth="angkit", type="json", cors="*")
+    @shop_owner_required
+    def sales_dashboard(self, shop_id):
+        """
+        Get the revenue, order count and average ticket of a shop per day and per hour.
+
+        Read from the sales aggregates maintained when orders are confirmed or cancelled,
+        so the cost depends on the length of the period, not on the number of orders.
+        Days and hours are in the timezone of the shop.
+
+        Endpoint: POST /angkort/api/v1/shop/{shop_id}/sales/dashboard
+        Auth: Required (angkit)
+
+        Request Body:
+            {
+                "date_from": str,       # Optional - 'YYYY-MM-DD', default 6 days before date_to
+                "date_to": str,         # Optional - 'YYYY-MM-DD', default today
+                "top_products": int     # Optional - number of best sellers, default 10, max 50
             }
+
+        Returns:
+            dict:
+                {
+                    'status': 'success',
+                    'totals': {'revenue': float, 'revenue_untaxed': float, 'orders': int, 'average_ticket': float},
+                    'days': [{'date': str, 'revenue': float, 'revenue_untaxed': float,
+                              'orders': int, 'average_ticket': float}],
+                    'hours': [{'hour': int, 'revenue': float, 'orders': int, 'average_ticket': float}],
+                    'top_products': [{'product_id': int, 'name': str, 'quantity': float, 'revenue_untaxed': float}]
+                }
+
+        Example:
+            POST /angkort/api/v1/shop/1/sales/dashboard
+            {"date_from": "2024-05-01", "date_to": "2024-05-31"}
+        """
+        shop = request.env['res.partner'].sudo().browse(shop_id)
+        data = request.get_json_data()
+        try:
+            date_to = fields.Date.to_date(data.get('date_to')) or fields.Date.context_today(shop.with_context(tz=shop.tz))
+            date_from = fields.Date.to_date(data.get('date_from')) or fields.Date.subtract(date_to, days=6)
+        except ValueError:
+            return {
+                'status': 'error',
+                'message': 'Invalid date, expected YYYY-MM-DD'
+            }
+        if date_from > date_to or (date_to - date_from).days > 366:
+            return {
+                'status': 'error',
+                'message': 'The period must be at most one year long'
+            }
+        try:
+            top_products = min(50, max(1, int(data.get('top_products', 10))))
+        except (TypeError, ValueError):
+            return {
+                'status': 'error',
+                'message': 'Invalid top_products, expected a number'
+            }
+
+        rows = request.env['angkort.sales.daily'].sudo().search_read(
+            [('shop_id', '=', shop.id), ('date', '>=', date_from), ('date', '<=', date_to)],
+            ['date', 'hour', 'order_count', 'amount_untaxed', 'amount_total'], order='date, hour')
+        days = defaultdict(lambda: {'revenue': 0.0, 'revenue_untaxed': 0.0, 'orders': 0})
+        hours = defaultdict(lambda: {'revenue': 0.0, 'revenue_untaxed': 0.0, 'orders': 0})
+        totals = {'revenue': 0.0, 'revenue_untaxed': 0.0, 'orders': 0}
+        for row in rows:
+            for bucket in (days[row['date']], hours[row['hour']], totals):
+                bucket['revenue'] += row['amount_total']
+                bucket['revenue_untaxed'] += row['amount_untaxed']
+                bucket['orders'] += row['order_count']
+
+        def with_average(bucket):
+            bucket['average_ticket'] = bucket['revenue'] / bucket['orders'] if bucket['orders'] else 0.0
+            return bucket
+
+        best_sellers = request.env['angkort.sales.product.daily'].sudo()._read_group(
+            [('shop_id', '=', shop.id), ('date', '>=', date_from), ('date', '<=', date_to)],
+            ['product_tmpl_id'], ['quantity:sum', 'amount_untaxed:sum'],
+            order='quantity:sum DESC', limit=top_products)
+        return {
+            'status': 'success',
+            'totals': with_average(totals),
+            'days': [dict(with_average(bucket), date=fields.Date.to_string(day)) for day, bucket in days.items()],
+            'hours': [dict(with_average(hours[hour]), hour=hour) for hour in sorted(hours)],
+            'top_products': [{
+                'product_id': product.id,
+                'name': product.name,
+                'quantity': quantity,
+                'revenue_untaxed': revenue,
+            } for product, quantity, revenue in best_sellers],
+        }
+
+    @http.route(f"{BASE_URL}/shop/<int:shop_id>/forecast", auth="angkit", type="json", cors="*")
+    @shop_owner_required
+    def forecast(self, shop_id):
+        """
+        Get the expected quantity of every product of a shop sold on the coming days.
+
+        Forecasts are computed every night for the next 7 days from the sales of the last
+        8 weeks, weekday by weekday, so owners know how many portions to prep.
+
+        Endpoint: POST /angkort/api/v1/shop/{shop_id}/forecast
+        Auth: Required (angkit)
+
+        Request Body:
+            {
+                "date": str     # Optional - 'YYYY-MM-DD', only return the forecasts of this day
+            }
+
+        Returns:
+            dict:
+                {
+                    'status': 'success',
+                    'days': [{
+                        'date': str,
+                        'products': [{'product_id': int, 'name': str, 'quantity': float}]  # Largest first
+                    }]
+                }
+
+        Example:
+            POST /angkort/api/v1/shop/1/forecast
+            {"date": "2024-05-02"}
+        """
+        shop = request.env['res.partner'].sudo().browse(shop_id)
+        data = request.get_json_data()
+        domain = [('shop_id', '=', shop.id)]
+        if data.get('date'):
+            try:
+                domain.append(('date', '=', fields.Date.to_date(data['date'])))
+            except ValueError:
+                return {
+                    'status': 'error',
+                    'message': 'Invalid date, expected YYYY-MM-DD'
+                }
+        forecasts = request.env['angkort.product.forecast'].sudo().search(domain, order='date, quantity desc')
+        days = defaultdict(list)
+        for forecast in forecasts:
+            days[forecast.date].append({
+                'product_id': forecast.product_tmpl_id.id,
+                'name': forecast.product_tmpl_id.name,
+                'quantity': forecast.quantity,
+            })
+        return {
+            'status': 'success',
+            'days': [{'date': fields.Date.to_string(day), 'products': products} for day, products in days.items()],
+        }
+
+    def _price_cart(self, shop_id, lines):
+        """
+        Price a cart of a shop, with its line and combo promotions.
+        """
+        return request.env['angkort.price.table'].sudo()._price_cart(shop_id, lines)
+
+    def _price_cart_lines(self, shop_id, lines):
+        """
+        Price cart lines of a shop from its compiled price table, with the running line promotions applied.
+
+        :param shop_id: ID of the shop
+        :param lines: list of {'product_id', 'quantity', 'variants': [{'attribute_id', 'value_id'}]}
+        :return: list of priced lines, in the same order as ``lines``
+        """
+        price_table = self._get_price_table(shop_id)
+        priced_lines = price_table.price_lines(lines)
+        request.env['angkort.promotion'].sudo()._angkort_apply_promotions(shop_id, price_table, priced_lines)
+        return priced_lines
+
+    def _get_price_table(self, shop_id):
+        return request.env['angkort.price.table'].sudo()._get_table(shop_id)
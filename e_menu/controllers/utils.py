@@ -0,0 +1,149 @@
+import base64
+import functools
+import hashlib
+import json
+
+from psycopg2.extensions import TRANSACTION_STATUS_INERROR
+from werkzeug.wrappers import Response
+
+from odoo.http import request
+from odoo.tools import json_default, SQL
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+
+
+def _request_fingerprint():
+    """Hash the request payload so a reused key with a different body can be rejected.
+
+    Multipart bodies are hashed from their parsed fields because clients pick a
+    new boundary on every retry.
+    """
+    httprequest = request.httprequest
+    if httprequest.mimetype == 'multipart/form-data':
+        payload = json.dumps({
+            'form': sorted(httprequest.form.items(multi=True)),
+            'files': sorted((name, file.filename or '') for name, file in httprequest.files.items(multi=True)),
+        })
+        return hashlib.sha256(payload.encode()).hexdigest()
+    return hashlib.sha256(httprequest.get_data()).hexdigest()
+
+
+def idempotent(func=None, *, scope=None):
+    """Replay the stored result of a route when the client resends an ``Idempotency-Key``.
+
+    Requests without the header run as usual. Keys are scoped to the calling
+    user and the request path, and expire after ``e_menu.idempotency_key_ttl``
+    hours. Server errors (HTTP 5xx) are not stored so the client can retry them.
+
+    Public routes all run as the same user: pass ``scope``, a function
+    returning the client the request is made for (e.g. the customer of the
+    order), so clients can't replay each other's keys.
+
+    The route runs in a savepoint. When it catches a database error and
+    answers anyway, its work is rolled back, as the end of the request would,
+    and its answer is still stored.
+    """
+    if func is None:
+        return functools.partial(idempotent, scope=scope)
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        key = request.httprequest.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return func(self, *args, **kwargs)
+
+        idempotency_sudo = request.env['angkort.idempotency.key'].sudo()
+        key_parts = [request.env.uid, request.httprequest.path, key]
+        if scope:
+            key_parts.insert(1, scope())
+        key_hash = idempotency_sudo._hash_key(*key_parts)
+        request_hash = _request_fingerprint()
+        record, is_new = idempotency_sudo._claim(key_hash, request_hash)
+
+        if not is_new:
+            if record.request_hash != request_hash:
+                return request.make_json_response({
+                    'status': False,
+                    'message': f'{IDEMPOTENCY_HEADER} was already used with a different request',
+                }, status=422)
+            if record.status_code:
+                return request.make_json_response(json.loads(record.response), status=record.status_code)
+            return json.loads(record.response)
+
+        savepoint = request.env.cr.savepoint()
+        result = func(self, *args, **kwargs)
+        savepoint.close(rollback=request.env.cr._cnx.info.transaction_status == TRANSACTION_STATUS_INERROR)
+        if isinstance(result, Response):
+            if result.status_code >= 500:
+                record.unlink()
+            else:
+                record._store_response(result.get_data(as_text=True), result.status_code)
+        else:
+            record._store_response(json.dumps(result, default=json_default))
+        return result
+
+    return wrapper
+
+
+def owned_shop_ids():
+    """Return the ids of the shops managed by the current user: the shop their partner belongs to, and the shops
+    they created."""
+    return request.env['res.partner'].sudo().search([
+        ('type', '=', 'store'),
+        '|', ('id', '=', request.env.user.partner_id.parent_id.id), ('create_uid', '=', request.env.uid),
+    ]).ids
+
+
+def shop_owner_required(func):
+    """Refuse the calls of a shop route (with a ``shop_id`` argument) by users who don't manage the shop.
+
+    Answers HTTP 404 when the shop does not exist and HTTP 403 when the user
+    does not manage it, see :func:`owned_shop_ids`.
+    """
+
+    @functools.wraps(func)
+    def wrapper(self, shop_id, *args, **kwargs):
+        if shop_id not in owned_shop_ids():
+            if not request.env['res.partner'].sudo().search_count([('id', '=', shop_id), ('type', '=', 'store')]):
+                return request.make_json_response({'status': 'error', 'message': 'Shop not found'}, status=404)
+            return request.make_json_response({'status': 'error', 'message': 'You do not manage this shop'},
+                                              status=403)
+        return func(self, shop_id, *args, **kwargs)
+
+    return wrapper
+
+
+def encode_cursor(*values):
+    """Return an opaque pagination cursor holding the sort key of the last returned record."""
+    return base64.urlsafe_b64encode(json.dumps(values, default=json_default).encode()).decode()
+
+
+def decode_cursor(cursor, size):
+    """Return the values of a cursor made by :func:`encode_cursor`, or None when it is missing or malformed."""
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or len(values) != size:
+        return None
+    return values
+
+
+def seek_after(model, domain, cursor, columns, limit, descending=True):
+    """Return the query of the ``limit`` records of ``domain`` that follow a cursor, in ``columns`` order.
+
+    The records are found with a row comparison such as ``(date_order, id) < (%s, %s)``,
+    which PostgreSQL resolves with one seek in an index on these columns, unlike the
+    equivalent ``OR`` of comparisons.
+    """
+    direction = 'desc' if descending else 'asc'
+    query = model._search(domain, limit=limit, order=', '.join(f'{column} {direction}' for column in columns))
+    query.add_where(SQL(
+        "(%s) %s (%s)",
+        SQL(', ').join(SQL.identifier(query.table, column) for column in columns),
+        SQL('<' if descending else '>'),
+        SQL(', ').join(SQL('%s', value) for value in cursor),
+    ))
+    return query
@@ -7,3 +7,18 @@ from . import shop_bank
 from . import ir_http
 from . import res_user_token
 from . import product_attribute
+from . import idempotency_key
+from . import price_table
+from . import promotion
+from . import stock_availability
+from . import stock_hold
+from . import sale_order
+from . import order_intake
+from . import product_availability
+from . import stock
+from . import ir_websocket
+from . import sales_aggregate
+from . import sale_order_archive
+from . import product_popularity
+from . import product_recommendation
+from . import product_forecast
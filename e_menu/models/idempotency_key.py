@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+import hashlib
+from datetime import timedelta
+
+from odoo import fields, models, api
+
+DEFAULT_TTL_HOURS = 24
+GC_BATCH_SIZE = 1000
+
+
+class IdempotencyKey(models.Model):
+    _name = "angkort.idempotency.key"
+    _description = "Idempotency key"
+    _log_access = False
+
+    key_hash = fields.Char(string="Key Hash", required=True, readonly=True)
+    request_hash = fields.Char(string="Request Hash", readonly=True)
+    status_code = fields.Integer(string="HTTP Status", readonly=True)
+    response = fields.Text(string="Response", readonly=True)
+    expires_at = fields.Datetime(string="Expires At", required=True, index=True, readonly=True)
+
+    _sql_constraints = [
+        ('key_hash_uniq', 'unique(key_hash)', 'Idempotency key must be unique.'),
+    ]
+
+    @api.model
+    def _hash_key(self, *parts):
+        return hashlib.sha256(':'.join(str(part) for part in parts).encode()).hexdigest()
+
+    @api.model
+    def _get_ttl(self):
+        ttl = self.env['ir.config_parameter'].sudo().get_param('e_menu.idempotency_key_ttl', DEFAULT_TTL_HOURS)
+        return timedelta(hours=int(ttl))
+
+    @api.model
+    def _claim(self, key_hash, request_hash):
+        """Reserve ``key_hash`` for the current transaction.
+
+        Returns a ``(record, is_new)`` tuple. When ``is_new`` is False the
+        record holds the response stored by a previous request with the same
+        key. A concurrent request using the same key blocks on the unique index
+        until the first one commits, then gets a serialization failure and is
+        retried by the HTTP layer, at which point it replays the stored result.
+        """
+        now = fields.Datetime.now()
+        self.env.cr.execute("""
+            DELETE FROM angkort_idempotency_key WHERE key_hash = %s AND expires_at < %s
+        """, [key_hash, now])
+        self.env.cr.execute("""
+            INSERT INTO angkort_idempotency_key (key_hash, request_hash, expires_at)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (key_hash) DO NOTHING
+            RETURNING id
+        """, [key_hash, request_hash, now + self._get_ttl()])
+        row = self.env.cr.fetchone()
+        if row:
+            return self.browse(row[0]), True
+        return self.search([('key_hash', '=', key_hash)], limit=1), False
+
+    def _store_response(self, response, status_code=0):
+        self.ensure_one()
+        self.write({
+            'response': response,
+            'status_code': status_code,
+        })
+
+    @api.autovacuum
+    def _gc_expired_keys(self):
+        while True:
+            self.env.cr.execute("""
+                DELETE FROM angkort_idempotency_key
+                WHERE id IN (
+                    SELECT id FROM angkort_idempotency_key
+                    WHERE expires_at < %s
+                    LIMIT %s
+                )
+            """, [fields.Datetime.now(), GC_BATCH_SIZE])
+            if self.env.cr.rowcount < GC_BATCH_SIZE:
+                break
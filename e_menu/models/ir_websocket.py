@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from odoo import models
+from odoo.tools import consteq
+from odoo.tools.misc import hmac
+
+# Bus sub-channels the app can listen to with a signed token, and the model of the record they belong to
+SIGNED_CHANNELS = {
+    'angkort_orders': 'res.partner',
+    'angkort_kitchen': 'res.partner',
+}
+
+
+class IrWebsocket(models.AbstractModel):
+    _inherit = 'ir.websocket'
+
+    def _angkort_channel_token(self, subchannel, record):
+        """Return the string the app subscribes with to listen to ``subchannel`` of ``record``.
+
+        The bus only lets a websocket listen to the channels of its session
+        user; the app authenticates with API keys, so it subscribes with a
+        channel signed by the server instead, as ``<subchannel>:<id>:<signature>``.
+        """
+        signature = hmac(self.env(su=True), subchannel, record.id)
+        return f'{subchannel}:{record.id}:{signature}'
+
+    def _angkort_verify_channel(self, channel):
+        """Return the ``(record, subchannel)`` bus channel of a signed channel string, or None."""
+        subchannel, _sep, rest = channel.partition(':')
+        record_id, _sep, signature = rest.partition(':')
+        if subchannel not in SIGNED_CHANNELS or not record_id.isdigit():
+            return None
+        record = self.env[SIGNED_CHANNELS[subchannel]].browse(int(record_id))
+        if not consteq(signature, hmac(self.env(su=True), subchannel, record.id)):
+            return None
+        return record, subchannel
+
+    def _build_bus_channel_list(self, channels):
+        bus_channels = []
+        for channel in channels:
+            if isinstance(channel, str) and channel.partition(':')[0] in SIGNED_CHANNELS:
+                channel = self._angkort_verify_channel(channel)
+                if not channel:
+                    continue
+            bus_channels.append(channel)
+        return super()._build_bus_channel_list(bus_channels)
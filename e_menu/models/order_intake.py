@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+
+from psycopg2.errors import SerializationFailure
+
+from odoo import fields, models, api
+
+_logger = logging.getLogger(__name__)
+
+INTAKE_BATCH_SIZE = 50
+
+
+class OrderIntake(models.Model):
+    """Order accepted from a customer and waiting to be turned into a ``sale.order``.
+
+    Accepting an order only validates and prices the cart, holds its stock
+    and inserts one row here; the order itself is created by a cron, woken
+    up when an intake arrives in an empty queue, that processes the pending
+    rows in batches. The
+    order keeps the prices and discounts the customer accepted, even when
+    the menu changed in between.
+    """
+    _name = "angkort.order.intake"
+    _description = "Order intake"
+    _order = "id"
+
+    shop_id = fields.Many2one('res.partner', string="Shop", required=True, ondelete='cascade', readonly=True)
+    partner_id = fields.Many2one('res.partner', string="Customer", required=True, ondelete='cascade', readonly=True)
+    payload = fields.Text(string="Cart", required=True, readonly=True,
+                          help="Cart priced by the price table when the order was accepted, as JSON.")
+    hold_token = fields.Char(string="Hold Token", readonly=True)
+    note = fields.Text(string="Note", readonly=True)
+    state = fields.Selection([
+        ('pending', 'Pending'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ], string="Status", required=True, default='pending', index=True, readonly=True)
+    order_id = fields.Many2one('sale.order', string="Order", ondelete='set null', readonly=True)
+    error = fields.Char(string="Error", readonly=True)
+
+    @api.model
+    def _enqueue(self, shop_id, partner, cart, hold_token=None, note=None):
+        """Store a cart priced by ``angkort.price.table._price_cart``, without invalid lines, and wake up
+        the consumer when the queue was empty.
+
+        A consumer already due or running takes the new intake with its next
+        batch, and the cron interval covers the rest, so the hot path does
+        not add a cron trigger per intake.
+        """
+        self.flush_model(['state'])
+        self.env.cr.execute("SELECT 1 FROM angkort_order_intake WHERE state = 'pending' LIMIT 1")
+        queue_was_empty = not self.env.cr.fetchone()
+        intake = self.create({
+            'shop_id': shop_id,
+            'partner_id': partner.id,
+            'payload': json.dumps(cart),
+            'hold_token': hold_token,
+            'note': note,
+        })
+        if queue_was_empty:
+            self.env.ref('e_menu.ir_cron_process_order_intake')._trigger()
+        return intake
+
+    @api.model
+    def _process_pending(self, batch_size=INTAKE_BATCH_SIZE, auto_commit=True):
+        """Create the orders of pending intakes, one batch per transaction.
+
+        Rows are claimed with ``FOR UPDATE SKIP LOCKED`` so several cron
+        workers can consume the queue at once. Every intake is created in its
+        own savepoint: a failing cart is marked as failed without affecting
+        the rest of the batch, while an intake whose stock claim conflicted
+        with a concurrent checkout stays pending for the next batch. The new
+        orders are published on the kitchen feed once per batch, right before
+        it commits, so the kitchen locks of their shops are not held while
+        the rest of the batch is processed.
+        """
+        while True:
+            self.env.cr.execute("""
+                SELECT id FROM angkort_order_intake
+                WHERE state = 'pending'
+                ORDER BY id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            """, [batch_size])
+            intakes = self.browse([row[0] for row in self.env.cr.fetchall()])
+            for intake in intakes.with_context(angkort_kitchen_batch=True):
+                intake._process()
+            self.env['sale.order'].sudo()._angkort_publish_kitchen(intakes.order_id.ids)
+            if auto_commit:
+                self.env.cr.commit()
+            if len(intakes) < batch_size:
+                break
+
+    def _process(self):
+        self.ensure_one()
+        sale_order_sudo = self.env['sale.order'].sudo()
+        try:
+            with self.env.cr.savepoint():
+                cart = json.loads(self.payload)
+                # the accepted prices stand, only products taken off the menu since then fail the order
+                menu = self.env['angkort.price.table']._get_table(self.shop_id.id).products
+                unsellable = [line['name'] for line in cart['lines'] if line['product_id'] not in menu]
+                if unsellable:
+                    self.write({'state': 'failed', 'error': 'No longer sold: %s' % ', '.join(unsellable)})
+                    return
+                order, missing = sale_order_sudo._angkort_create_from_cart(
+                    self.shop_id.id, self.partner_id, cart, hold_token=self.hold_token, note=self.note)
+        except SerializationFailure:
+            _logger.info("Stock claim of intake %s conflicted with a checkout, retried with the next batch", self.id)
+            return
+        except Exception as e:
+            _logger.exception("Could not create the order of intake %s", self.id)
+            self.write({'state': 'failed', 'error': str(e)})
+            return
+        if missing:
+            self.write({
+                'state': 'failed',
+                'error': 'Insufficient stock: %s' % ', '.join(line['name'] for line in missing),
+            })
+        else:
+            self.write({'state': 'done', 'order_id': order.id})
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, api, tools
+
+
+class ShopPriceTable:
+    """Prices of a shop's menu compiled into plain dicts.
+
+    ``version`` is the menu version of the shop the table was built for, so
+    clients can tell whether prices changed since their last call.
+    """
+
+    def __init__(self, shop_id, version, products, templates, categories, values, extras):
+        self.shop_id = shop_id
+        self.version = version
+        # {product_id: (product_tmpl_id, name, list_price)}
+        self.products = products
+        # {product_tmpl_id: list_price}
+        self.templates = templates
+        # {product_tmpl_id: categ_id}
+        self.categories = categories
+        # {value_id: (attribute_id, attribute_name, value_name, default_extra_price)}
+        self.values = values
+        # {(product_tmpl_id, value_id): price_extra}
+        self.extras = extras
+
+    def price_line(self, product_id, quantity, variants=None):
+        """Price one cart line.
+
+        The extra price of a selected value is the one set on the product,
+        falling back to the default extra price of the value. Variants whose
+        value does not belong to the given attribute are ignored.
+        """
+        product = self.products.get(product_id)
+        if not product:
+            return {'product_id': product_id, 'error': 'Product not found'}
+        try:
+            quantity = int(quantity)
+        except (TypeError, ValueError):
+            quantity = 0
+        if quantity <= 0:
+            return {'product_id': product_id, 'error': 'Quantity must be greater than 0'}
+
+        product_tmpl_id, name, base_price = product
+        variant_prices = []
+        for variant in variants or []:
+            value = self.values.get(variant.get('value_id'))
+            if not value or value[0] != variant.get('attribute_id'):
+                continue
+            variant_prices.append({
+                'attribute_name': value[1],
+                'value_name': value[2],
+                'price': self.extras.get((product_tmpl_id, variant['value_id']), value[3]),
+            })
+        total_variant_price = sum(variant['price'] for variant in variant_prices)
+        unit_price = base_price + total_variant_price
+        return {
+            'product_id': product_id,
+            'product_tmpl_id': product_tmpl_id,
+            'name': name,
+            'quantity': quantity,
+            'base_price': base_price,
+            'variant_prices': variant_prices,
+            'total_variant_price': total_variant_price,
+            'unit_price': unit_price,
+            'total': unit_price * quantity,
+        }
+
+    def price_lines(self, lines):
+        return [
+            self.price_line(line.get('product_id'), line.get('quantity', 0), line.get('variants'))
+            for line in lines
+        ]
+
+
+class AngkortPriceTable(models.AbstractModel):
+    _name = "angkort.price.table"
+    _description = "Shop price table"
+
+    @api.model
+    @tools.ormcache('shop_id', 'self.env["res.partner"]._angkort_menu_version(shop_id)')
+    def _get_table(self, shop_id):
+        """Return the compiled :class:`ShopPriceTable` of a shop.
+
+        The table is built on first use with one read per model and kept in
+        the registry cache per menu version of the shop, which changes with
+        its prices, products and attribute values. Callers must not modify it.
+        """
+        self = self.sudo()
+
+        products = {}
+        templates = {}
+        categories = {}
+        for product in self.env['product.product'].search_read(
+                [('shop_id', '=', shop_id)], ['name', 'list_price', 'product_tmpl_id', 'categ_id']):
+            products[product['id']] = (product['product_tmpl_id'][0], product['name'], product['list_price'])
+            templates[product['product_tmpl_id'][0]] = product['list_price']
+            categories[product['product_tmpl_id'][0]] = product['categ_id'] and product['categ_id'][0]
+
+        extras = {}
+        value_ids = set()
+        for ptav in self.env['product.template.attribute.value'].search_read(
+                [('product_tmpl_id', 'in', list(templates))],
+                ['product_tmpl_id', 'product_attribute_value_id', 'price_extra']):
+            extras[(ptav['product_tmpl_id'][0], ptav['product_attribute_value_id'][0])] = ptav['price_extra']
+            value_ids.add(ptav['product_attribute_value_id'][0])
+
+        values = {}
+        for value in self.env['product.attribute.value'].search_read(
+                ['|', ('id', 'in', list(value_ids)), ('attribute_id.shop_id', '=', shop_id)],
+                ['name', 'attribute_id', 'default_extra_price']):
+            values[value['id']] = (
+                value['attribute_id'][0], value['attribute_id'][1], value['name'], value['default_extra_price'],
+            )
+
+        # list prices live on the templates, extra prices on two other models: the menu version follows them all
+        version = str(self.env['res.partner']._angkort_menu_version(shop_id) or 0)
+        return ShopPriceTable(shop_id, version, products, templates, categories, values, extras)
+
+    @api.model
+    def _price_cart(self, shop_id, lines):
+        """Price a cart of a shop, with its line and combo promotions.
+
+        :return: dict with the priced ``lines``, ``combo_discounts``, ``discount_total``,
+                 the net ``total`` and the ``price_version`` of the shop's price table
+        """
+        price_table = self._get_table(shop_id)
+        priced_lines = price_table.price_lines(lines)
+        combo_discounts = self.env['angkort.promotion'].sudo()._angkort_apply_promotions(
+            shop_id, price_table, priced_lines)
+        valid_lines = [line for line in priced_lines if 'error' not in line]
+        combo_total = sum(combo['discount'] for combo in combo_discounts)
+        return {
+            'lines': priced_lines,
+            'combo_discounts': combo_discounts,
+            'discount_total': sum(line['discount'] for line in valid_lines) + combo_total,
+            'total': max(sum(line['total'] for line in valid_lines) - combo_total, 0.0),
+            'price_version': price_table.version,
+        }
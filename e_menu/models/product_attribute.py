@@ -1,7 +1,160 @@
-from odoo import fields, models, api, _
+import logging
+
+import psycopg2
+
+from odoo import fields, models, api, tools, _
+
+from .product_template import menu_changed_records
+
+_logger = logging.getLogger(__name__)
+
+# Fields read by the cached attribute catalog and price table
+ATTRIBUTE_CACHE_FIELDS = {'name', 'create_variant', 'display_type', 'shop_id'}
+ATTRIBUTE_VALUE_CACHE_FIELDS = {'name', 'default_extra_price', 'attribute_id'}
 
 
 class ProductAttribute(models.Model):
     _inherit = "product.attribute"
 
     shop_id = fields.Many2one('res.partner', domain="[('type', '=', 'store')]")
+
+    def init(self):
+        # attributes created before the index may share a name: rename all but the first one of each name,
+        # e.g. "Size (42)", so the upgrade does not fail on them
+        self._cr.execute("""
+            WITH duplicates AS (
+                SELECT id, ROW_NUMBER() OVER (PARTITION BY shop_id, name->>'en_US' ORDER BY id) AS rank
+                FROM product_attribute
+                WHERE shop_id IS NOT NULL
+            )
+            UPDATE product_attribute attribute
+            SET name = jsonb_set(attribute.name, '{en_US}',
+                                 to_jsonb(CONCAT(attribute.name->>'en_US', ' (', attribute.id, ')')))
+            FROM duplicates
+            WHERE duplicates.id = attribute.id AND duplicates.rank > 1
+            RETURNING attribute.id, attribute.shop_id, attribute.name->>'en_US'
+        """)
+        for attribute_id, shop_id, name in self._cr.fetchall():
+            _logger.warning("Renamed the attribute %s of shop %s to %r, its name was already used in the shop",
+                            attribute_id, shop_id, name)
+        # Attribute names are translated (jsonb): compare the source name per shop
+        tools.create_unique_index(self._cr, 'product_attribute_shop_name_uniq', self._table,
+                                  ['shop_id', "(name->>'en_US')"])
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        attributes = super().create(vals_list)
+        self.env['res.partner']._angkort_bump_menu_version(attributes._angkort_menu_shop_ids())
+        return attributes
+
+    def write(self, vals):
+        changed = menu_changed_records(self, vals, ATTRIBUTE_CACHE_FIELDS)
+        shop_ids = changed._angkort_menu_shop_ids()
+        res = super().write(vals)
+        self.env['res.partner']._angkort_bump_menu_version(shop_ids | changed._angkort_menu_shop_ids())
+        return res
+
+    def unlink(self):
+        shop_ids = self._angkort_menu_shop_ids()
+        res = super().unlink()
+        self.env['res.partner']._angkort_bump_menu_version(shop_ids)
+        return res
+
+    def _angkort_menu_shop_ids(self):
+        """Return the ids of the shops whose menu uses these attributes."""
+        return set(self.sudo().shop_id.ids)
+
+    @api.model
+    def _angkort_is_duplicate_name_error(self, error):
+        return (isinstance(error, psycopg2.errors.UniqueViolation)
+                and error.diag.constraint_name == 'product_attribute_shop_name_uniq')
+
+    @api.model
+    @tools.ormcache('shop_id', 'self.env["res.partner"]._angkort_menu_version(shop_id)')
+    def _angkort_attribute_catalog(self, shop_id):
+        """Return the attributes of a shop with their values, keyed by attribute id.
+
+        The catalog is cached per shop and menu version, which changes with the
+        attributes and their values, so callers must not modify it.
+
+        :return: dict ``{attribute_id: {'id', 'name', 'create_variant',
+                 'display_type', 'create_uid', 'values': [{'id', 'name', 'extra_price'}]}}``
+        """
+        self = self.sudo()
+        attributes = self.search_read([('shop_id', '=', shop_id)],
+                                      ['name', 'create_variant', 'display_type', 'create_uid'])
+        catalog = {
+            attribute['id']: {
+                'id': attribute['id'],
+                'name': attribute['name'],
+                'create_variant': attribute['create_variant'],
+                'display_type': attribute['display_type'],
+                'create_uid': attribute['create_uid'] and attribute['create_uid'][0],
+                'values': [],
+            } for attribute in attributes
+        }
+        for value in self.env['product.attribute.value'].search_read(
+                [('attribute_id', 'in', list(catalog))], ['name', 'default_extra_price', 'attribute_id']):
+            catalog[value['attribute_id'][0]]['values'].append({
+                'id': value['id'],
+                'name': value['name'],
+                'extra_price': value['default_extra_price'],
+            })
+        return catalog
+
+
+class ProductAttributeValue(models.Model):
+    _inherit = "product.attribute.value"
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        values = super().create(vals_list)
+        self.env['res.partner']._angkort_bump_menu_version(values._angkort_menu_shop_ids())
+        return values
+
+    def write(self, vals):
+        changed = menu_changed_records(self, vals, ATTRIBUTE_VALUE_CACHE_FIELDS)
+        shop_ids = changed._angkort_menu_shop_ids()
+        res = super().write(vals)
+        self.env['res.partner']._angkort_bump_menu_version(shop_ids | changed._angkort_menu_shop_ids())
+        return res
+
+    def unlink(self):
+        shop_ids = self._angkort_menu_shop_ids()
+        res = super().unlink()
+        self.env['res.partner']._angkort_bump_menu_version(shop_ids)
+        return res
+
+    def _angkort_menu_shop_ids(self):
+        """Return the ids of the shops whose menu uses these values: the shop of their attribute, and the shops
+        of the products they are set on (shared attributes have no shop)."""
+        self = self.sudo()
+        template_values = self.env['product.template.attribute.value'].search(
+            [('product_attribute_value_id', 'in', self.ids)])
+        return set(self.attribute_id.shop_id.ids) | template_values._angkort_menu_shop_ids()
+
+
+class ProductTemplateAttributeValue(models.Model):
+    _inherit = "product.template.attribute.value"
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        values = super().create(vals_list)
+        self.env['res.partner']._angkort_bump_menu_version(values._angkort_menu_shop_ids())
+        return values
+
+    def write(self, vals):
+        changed = menu_changed_records(self, vals, {'price_extra'})
+        res = super().write(vals)
+        self.env['res.partner']._angkort_bump_menu_version(changed._angkort_menu_shop_ids())
+        return res
+
+    def unlink(self):
+        shop_ids = self._angkort_menu_shop_ids()
+        res = super().unlink()
+        self.env['res.partner']._angkort_bump_menu_version(shop_ids)
+        return res
+
+    def _angkort_menu_shop_ids(self):
+        """Return the ids of the shops whose menu shows the products of these values."""
+        return set(self.sudo().product_tmpl_id.shop_id.ids)
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+from odoo import fields, models, api
+
+PRECOMMIT_KEY = 'angkort.product.availability'
+
+
+class ProductAvailability(models.Model):
+    """Availability of the menu products, read by the menu endpoints.
+
+    Rows are refreshed from the free quantity of the quants of a product
+    right before a transaction that changed its quants or moves commits, so
+    reading the menu costs one query however many products it shows.
+    ``manual_sold_out`` is the "86" flag set by the kitchen.
+    """
+    _name = "angkort.product.availability"
+    _description = "Product availability"
+    _log_access = False
+
+    product_tmpl_id = fields.Many2one('product.template', string="Product", required=True, ondelete='cascade',
+                                      readonly=True)
+    shop_id = fields.Many2one('res.partner', string="Shop", index=True, readonly=True)
+    qty_free = fields.Float(string="Free Quantity", readonly=True)
+    manual_sold_out = fields.Boolean(string="Sold Out (Manual)", readonly=True)
+    sold_out = fields.Boolean(string="Sold Out", readonly=True)
+
+    _sql_constraints = [
+        ('product_tmpl_id_uniq', 'unique(product_tmpl_id)', 'A product has a single availability.'),
+    ]
+
+    def init(self):
+        self._rebuild()
+
+    @api.model
+    def _refresh_later(self, product_tmpl_ids):
+        """Refresh the availability of the given products right before the transaction commits."""
+        product_tmpl_ids = set(product_tmpl_ids)
+        if not product_tmpl_ids:
+            return
+        pending = self.env.cr.precommit.data.get(PRECOMMIT_KEY)
+        if pending is None:
+            pending = self.env.cr.precommit.data[PRECOMMIT_KEY] = set()
+            env = self.env
+
+            def refresh():
+                env['angkort.product.availability']._refresh(env.cr.precommit.data.pop(PRECOMMIT_KEY, ()))
+
+            self.env.cr.precommit.add(refresh)
+        pending.update(product_tmpl_ids)
+
+    @api.model
+    def _refresh(self, product_tmpl_ids):
+        """Upsert the availability of the given products from their quants, in one statement."""
+        if not product_tmpl_ids:
+            return
+        self.env['stock.quant'].flush_model(['product_id', 'location_id', 'quantity', 'reserved_quantity'])
+        self.env.cr.execute("""
+            INSERT INTO angkort_product_availability (product_tmpl_id, shop_id, qty_free, manual_sold_out, sold_out)
+            SELECT pt.id, pt.shop_id, COALESCE(q.qty_free, 0), FALSE, pt.is_storable AND COALESCE(q.qty_free, 0) <= 0
+            FROM product_template pt
+            LEFT JOIN (
+                SELECT pp.product_tmpl_id, SUM(sq.quantity - sq.reserved_quantity) AS qty_free
+                FROM stock_quant sq
+                JOIN stock_location sl ON sl.id = sq.location_id
+                JOIN product_product pp ON pp.id = sq.product_id
+                WHERE sl.usage = 'internal' AND pp.product_tmpl_id = ANY(%(ids)s)
+                GROUP BY pp.product_tmpl_id
+            ) q ON q.product_tmpl_id = pt.id
+            WHERE pt.id = ANY(%(ids)s) AND pt.shop_id IS NOT NULL
+            ON CONFLICT (product_tmpl_id) DO UPDATE
+            SET shop_id = EXCLUDED.shop_id,
+                qty_free = EXCLUDED.qty_free,
+                sold_out = angkort_product_availability.manual_sold_out OR EXCLUDED.sold_out
+        """, {'ids': list(product_tmpl_ids)})
+        self.invalidate_model()
+
+    @api.model
+    def _set_manual_sold_out(self, product, sold_out):
+        """Flag a product as sold out (or available again) regardless of its stock."""
+        self._refresh(product.ids)
+        self.env.cr.execute("""
+            UPDATE angkort_product_availability
+            SET manual_sold_out = %(sold_out)s,
+                sold_out = %(sold_out)s OR (%(storable)s AND qty_free <= 0)
+            WHERE product_tmpl_id = %(id)s
+        """, {'sold_out': bool(sold_out), 'storable': product.is_storable, 'id': product.id})
+        self.invalidate_model()
+
+    @api.model
+    def _get_sold_out_ids(self, shop_id):
+        """Return the ids of the sold out product templates of a shop."""
+        self.env.cr.execute("""
+            SELECT product_tmpl_id FROM angkort_product_availability
+            WHERE shop_id = %s AND sold_out
+        """, [shop_id])
+        return {row[0] for row in self.env.cr.fetchall()}
+
+    @api.model
+    def _rebuild(self, shop_id=None):
+        """Recompute the availability of every menu product, or of the products of one shop."""
+        domain = [('shop_id', '=', shop_id)] if shop_id else [('shop_id', '!=', False)]
+        self._refresh(self.env['product.template'].with_context(active_test=False).search(domain).ids)
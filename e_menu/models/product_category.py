@@ -1,8 +1,80 @@
 
-from odoo import fields, models, api, _
+from odoo import fields, models, api, tools, _
+
+from .product_template import menu_changed_records
+
+# Fields read by the cached category tree
+CATEGORY_CACHE_FIELDS = {'name', 'parent_id', 'shop_id'}
 
 
 class ProductCategory(models.Model):
     _inherit = "product.category"
 
     shop_id = fields.Many2one('res.partner', domain="[('type', '=', 'store')]", string="Shop")
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        categories = super().create(vals_list)
+        self.env['res.partner']._angkort_bump_menu_version(categories._angkort_menu_shop_ids())
+        return categories
+
+    def write(self, vals):
+        changed = menu_changed_records(self, vals, CATEGORY_CACHE_FIELDS)
+        shop_ids = changed._angkort_menu_shop_ids()
+        res = super().write(vals)
+        self.env['res.partner']._angkort_bump_menu_version(shop_ids | changed._angkort_menu_shop_ids())
+        return res
+
+    def unlink(self):
+        shop_ids = self._angkort_menu_shop_ids()
+        res = super().unlink()
+        self.env['res.partner']._angkort_bump_menu_version(shop_ids)
+        return res
+
+    def _angkort_menu_shop_ids(self):
+        """Return the ids of the shops whose menu shows these categories."""
+        return set(self.sudo().shop_id.ids)
+
+    @api.model
+    @tools.ormcache('shop_id', 'self.env["res.partner"]._angkort_menu_version(shop_id)')
+    def _angkort_category_tree(self, shop_id):
+        """Return the category tree of a shop with the number of active products per category.
+
+        Product counts come from a single grouped query on ``product.template``.
+        The result is cached per shop and menu version, which changes with the
+        categories and products of the menu, so callers must not modify it.
+
+        :return: list of root nodes ``{'id', 'name', 'product_count',
+                 'total_product_count', 'children'}``
+        """
+        self = self.sudo()
+        counts = {
+            category.id: count
+            for category, count in self.env['product.template']._read_group(
+                [('shop_id', '=', shop_id)], ['categ_id'], ['__count'])
+        }
+        categories = self.search_read([('shop_id', '=', shop_id)], ['name', 'parent_id'], order='complete_name')
+        nodes = {
+            category['id']: {
+                'id': category['id'],
+                'name': category['name'],
+                'product_count': counts.get(category['id'], 0),
+                'total_product_count': counts.get(category['id'], 0),
+                'children': [],
+            } for category in categories
+        }
+        roots = []
+        for category in categories:
+            parent_id = category['parent_id'] and category['parent_id'][0]
+            if parent_id in nodes:
+                nodes[parent_id]['children'].append(nodes[category['id']])
+            else:
+                roots.append(nodes[category['id']])
+
+        def _sum_totals(node):
+            node['total_product_count'] += sum(_sum_totals(child) for child in node['children'])
+            return node['total_product_count']
+
+        for root in roots:
+            _sum_totals(root)
+        return roots
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+import logging
+from datetime import timedelta
+
+from odoo import fields, models, api, tools
+
+_logger = logging.getLogger(__name__)
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+FORECAST_WEEKS = 8
+FORECAST_HORIZON = 7
+# weight of a week relative to the week after it
+FORECAST_DECAY = 0.7
+
+
+class ProductForecast(models.Model):
+    """Expected quantity of a menu product sold on a day, to plan the kitchen prep and the stock.
+
+    Computed every night for the next ``FORECAST_HORIZON`` days and for all
+    the products of all the shops at once, from the daily product sales of
+    the last ``FORECAST_WEEKS`` weeks: the forecast of a day is the average
+    of the sales of the same weekday, recent weeks weighing more. Days before
+    the first sale of a product in the period are ignored, so new dishes are
+    not dragged down by the weeks they did not exist.
+    """
+    _name = "angkort.product.forecast"
+    _description = "Product demand forecast"
+    _order = "date, product_tmpl_id"
+    _log_access = False
+
+    shop_id = fields.Many2one('res.partner', string="Shop", required=True, ondelete='cascade', readonly=True)
+    product_tmpl_id = fields.Many2one('product.template', string="Product", required=True, ondelete='cascade',
+                                      readonly=True)
+    date = fields.Date(string="Date", required=True, readonly=True)
+    quantity = fields.Float(string="Forecast Quantity", readonly=True)
+
+    _sql_constraints = [
+        ('product_date_uniq', 'unique(product_tmpl_id, date)', 'A product has a single forecast per day.'),
+    ]
+
+    def init(self):
+        # forecasts of a shop, see the /shop/<id>/forecast endpoint
+        tools.create_index(self._cr, 'angkort_product_forecast_shop_id_date_index', self._table, ['shop_id', 'date'])
+
+    @api.model
+    def _compute_forecasts(self, weeks=FORECAST_WEEKS, horizon=FORECAST_HORIZON, decay=FORECAST_DECAY):
+        """Replace the forecasts of every product with the ones of the ``horizon`` days starting today."""
+        if np is None:
+            _logger.warning("numpy is required to compute the product forecasts")
+            return
+        self.env['angkort.sales.product.daily'].flush_model()
+        today = fields.Date.context_today(self)
+        days = weeks * 7
+        date_from = today - timedelta(days=days)
+        self.env.cr.execute("""
+            SELECT d.product_tmpl_id, pt.shop_id, d.date - %(date_from)s, d.quantity
+            FROM angkort_sales_product_daily d
+            JOIN product_template pt ON pt.id = d.product_tmpl_id
+            WHERE d.date >= %(date_from)s AND d.date < %(today)s AND pt.shop_id IS NOT NULL
+        """, {'date_from': date_from, 'today': today})
+        rows = self.env.cr.fetchall()
+        self.env.cr.execute("DELETE FROM angkort_product_forecast")
+        self.invalidate_model()
+        if not rows:
+            return
+
+        product_column, shop_column, day_column, quantity_column = zip(*rows)
+        product_ids, product_index = np.unique(np.array(product_column, dtype=np.int64), return_inverse=True)
+        shop_ids = np.zeros(len(product_ids), dtype=np.int64)
+        shop_ids[product_index] = shop_column
+        # sales[p, d]: quantity of product p sold on day date_from + d, zero on the days it did not sell
+        sales = np.zeros((len(product_ids), days))
+        np.add.at(sales, (product_index, np.array(day_column, dtype=np.int64)),
+                  np.array(quantity_column, dtype=np.float64))
+
+        first_sale = np.argmax(sales > 0, axis=1)
+        week_weights = decay ** np.arange(weeks - 1, -1, -1)
+        weights = np.repeat(week_weights, 7)[np.newaxis, :] * (np.arange(days) >= first_sale[:, np.newaxis])
+        # days is a whole number of weeks: column w of the (products, weeks, 7) view falls on the weekday of today + w
+        weighted = (sales * weights).reshape(len(product_ids), weeks, 7).sum(axis=1)
+        total_weights = weights.reshape(len(product_ids), weeks, 7).sum(axis=1)
+        weekday_forecast = np.divide(weighted, total_weights, out=np.zeros_like(weighted), where=total_weights > 0)
+
+        offsets = np.arange(horizon)
+        quantities = np.round(weekday_forecast[:, offsets % 7], 2)
+        self.env.cr.execute("""
+            INSERT INTO angkort_product_forecast (shop_id, product_tmpl_id, date, quantity)
+            SELECT shop_id, product_tmpl_id, %s::date + day_offset, quantity
+            FROM unnest(%s::int[], %s::int[], %s::int[], %s::float8[]) AS t(shop_id, product_tmpl_id, day_offset, quantity)
+        """, [
+            today,
+            np.repeat(shop_ids, horizon).tolist(),
+            np.repeat(product_ids, horizon).tolist(),
+            np.tile(offsets, len(product_ids)).tolist(),
+            quantities.ravel().tolist(),
+        ])
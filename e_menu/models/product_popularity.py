@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+from datetime import timedelta
+
+from odoo import fields, models, api, tools
+
+POPULARITY_WINDOWS = {'7d': 'qty_7d', '30d': 'qty_30d'}
+
+
+class ProductPopularity(models.Model):
+    """Quantities of a menu product sold over the last 7 and 30 days.
+
+    Counters follow the confirmed and cancelled orders along with the daily
+    sales aggregates (see ``angkort.sales.daily._fold_deltas``), and are
+    recomputed every night from the daily product sales aggregates, which
+    drops the days that left the windows. Ranking the best sellers of a
+    shop reads a few index rows.
+    """
+    _name = "angkort.product.popularity"
+    _description = "Product popularity"
+    _log_access = False
+
+    product_tmpl_id = fields.Many2one('product.template', string="Product", required=True, ondelete='cascade',
+                                      readonly=True)
+    shop_id = fields.Many2one('res.partner', string="Shop", required=True, ondelete='cascade', readonly=True)
+    qty_7d = fields.Float(string="Sold (7 days)", readonly=True)
+    qty_30d = fields.Float(string="Sold (30 days)", readonly=True)
+
+    _sql_constraints = [
+        ('product_tmpl_id_uniq', 'unique(product_tmpl_id)', 'A product has a single popularity.'),
+    ]
+
+    def init(self):
+        # best sellers of a shop, see _get_ranking
+        for column in POPULARITY_WINDOWS.values():
+            tools.create_index(self._cr, f'angkort_product_popularity_shop_{column}_index', self._table,
+                               ['shop_id', f'{column} DESC'])
+
+    @api.model
+    def _recompute(self):
+        """Recompute the counters of every product from the daily sales aggregates of the last 30 days."""
+        self.env['angkort.sales.daily']._fold_deltas(auto_commit=False)
+        self.env['angkort.sales.product.daily'].flush_model()
+        today = fields.Date.context_today(self)
+        self.env.cr.execute("""
+            WITH sold AS (
+                SELECT d.product_tmpl_id, pt.shop_id,
+                       SUM(d.quantity) FILTER (WHERE d.date > %(date_7d)s) AS qty_7d,
+                       SUM(d.quantity) AS qty_30d
+                FROM angkort_sales_product_daily d
+                JOIN product_template pt ON pt.id = d.product_tmpl_id
+                WHERE d.date > %(date_30d)s AND pt.shop_id IS NOT NULL
+                GROUP BY d.product_tmpl_id, pt.shop_id
+            ), upserted AS (
+                INSERT INTO angkort_product_popularity (product_tmpl_id, shop_id, qty_7d, qty_30d)
+                SELECT product_tmpl_id, shop_id, COALESCE(qty_7d, 0), qty_30d FROM sold
+                ON CONFLICT (product_tmpl_id) DO UPDATE
+                SET shop_id = EXCLUDED.shop_id, qty_7d = EXCLUDED.qty_7d, qty_30d = EXCLUDED.qty_30d
+            )
+            DELETE FROM angkort_product_popularity
+            WHERE product_tmpl_id NOT IN (SELECT product_tmpl_id FROM sold)
+        """, {'date_7d': today - timedelta(days=7), 'date_30d': today - timedelta(days=30)})
+        self.invalidate_model()
+
+    @api.model
+    def _get_ranking(self, shop_id, window='7d', limit=None):
+        """Return the ids of the product templates of a shop sold in the window, best seller first."""
+        column = POPULARITY_WINDOWS[window]
+        self.env.cr.execute(f"""
+            SELECT product_tmpl_id FROM angkort_product_popularity
+            WHERE shop_id = %s AND {column} > 0
+            ORDER BY {column} DESC, product_tmpl_id
+            LIMIT %s
+        """, [shop_id, limit])
+        return [row[0] for row in self.env.cr.fetchall()]
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+import logging
+from datetime import timedelta
+
+from odoo import fields, models, api, tools
+
+_logger = logging.getLogger(__name__)
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    np = sparse = None
+
+RECOMMENDATION_DAYS = 90
+RECOMMENDATION_TOP_K = 5
+# pairs bought together less often than this are noise, not a habit
+RECOMMENDATION_MIN_SUPPORT = 2
+
+
+class ProductRecommendation(models.Model):
+    """Product frequently bought together with another product of the same shop.
+
+    Computed every night from the confirmed orders of the last
+    ``RECOMMENDATION_DAYS`` days: the orders of a shop are turned into a
+    sparse order x product matrix whose product with its transpose counts,
+    for every pair of products, the orders containing both. The
+    ``RECOMMENDATION_TOP_K`` products most often ordered with each product are
+    kept, so reading them is one index lookup.
+    """
+    _name = "angkort.product.recommendation"
+    _description = "Product recommendation"
+    _order = "product_tmpl_id, rank"
+    _log_access = False
+
+    shop_id = fields.Many2one('res.partner', string="Shop", required=True, index=True, ondelete='cascade',
+                              readonly=True)
+    product_tmpl_id = fields.Many2one('product.template', string="Product", required=True, ondelete='cascade',
+                                      readonly=True)
+    recommended_tmpl_id = fields.Many2one('product.template', string="Recommended Product", required=True,
+                                          ondelete='cascade', readonly=True)
+    rank = fields.Integer(string="Rank", readonly=True)
+    order_count = fields.Integer(string="Orders Together", readonly=True)
+    confidence = fields.Float(string="Confidence", readonly=True,
+                              help="Share of the orders of the product that also contain the recommended product.")
+
+    def init(self):
+        # recommendations of a product, see _get_recommended_ids
+        tools.create_index(self._cr, 'angkort_product_recommendation_product_tmpl_id_rank_index', self._table,
+                           ['product_tmpl_id', 'rank'])
+
+    @api.model
+    def _compute_recommendations(self, days=RECOMMENDATION_DAYS, top_k=RECOMMENDATION_TOP_K, auto_commit=True):
+        """Recompute the recommendations of every shop that sold something in the period, one shop per transaction.
+
+        Shops that sold nothing in the period lose their recommendations.
+        """
+        if np is None:
+            _logger.warning("numpy and scipy are required to compute the product recommendations")
+            return
+        self.env['angkort.sales.product.daily'].flush_model()
+        date_from = fields.Date.context_today(self) - timedelta(days=days)
+        self.env.cr.execute("""
+            SELECT DISTINCT shop_id FROM angkort_sales_product_daily WHERE date >= %s
+        """, [date_from])
+        shop_ids = [row[0] for row in self.env.cr.fetchall()]
+        self.env.cr.execute("DELETE FROM angkort_product_recommendation WHERE shop_id != ALL(%s)", [shop_ids])
+        self.invalidate_model()
+        if auto_commit:
+            self.env.cr.commit()
+        for shop_id in shop_ids:
+            self._compute_shop_recommendations(shop_id, date_from, top_k)
+            if auto_commit:
+                self.env.cr.commit()
+
+    @api.model
+    def _compute_shop_recommendations(self, shop_id, date_from, top_k=RECOMMENDATION_TOP_K):
+        self.env.cr.execute("""
+            SELECT DISTINCT sol.order_id, pp.product_tmpl_id
+            FROM sale_order_line sol
+            JOIN sale_order so ON so.id = sol.order_id
+            JOIN product_product pp ON pp.id = sol.product_id
+            WHERE so.shop_id = %s AND so.state = 'sale' AND so.date_order >= %s
+              AND sol.display_type IS NULL
+        """, [shop_id, date_from])
+        pairs = np.array(self.env.cr.fetchall(), dtype=np.int64).reshape(-1, 2)
+        self.env.cr.execute("DELETE FROM angkort_product_recommendation WHERE shop_id = %s", [shop_id])
+        self.invalidate_model()
+        if not len(pairs):
+            return
+
+        order_ids, order_index = np.unique(pairs[:, 0], return_inverse=True)
+        product_ids, product_index = np.unique(pairs[:, 1], return_inverse=True)
+        baskets = sparse.csr_matrix(
+            (np.ones(len(pairs), dtype=np.int32), (order_index, product_index)),
+            shape=(len(order_ids), len(product_ids)),
+        )
+        # co_orders[i, j]: number of orders containing both products, the diagonal holds the orders of each product
+        co_orders = (baskets.T @ baskets).tocsr()
+        product_orders = co_orders.diagonal()
+        co_orders.setdiag(0)
+        co_orders.data[co_orders.data < RECOMMENDATION_MIN_SUPPORT] = 0
+        co_orders.eliminate_zeros()
+        if not co_orders.nnz:
+            return
+
+        # rank the neighbours of every product at once: sort by product, then by decreasing count
+        rows = np.repeat(np.arange(co_orders.shape[0]), np.diff(co_orders.indptr))
+        ordering = np.lexsort((co_orders.indices, -co_orders.data, rows))
+        rows, cols, counts = rows[ordering], co_orders.indices[ordering], co_orders.data[ordering]
+        ranks = np.arange(len(rows)) - co_orders.indptr[rows]
+        keep = ranks < top_k
+        rows, cols, counts, ranks = rows[keep], cols[keep], counts[keep], ranks[keep]
+
+        self.env.cr.execute("""
+            INSERT INTO angkort_product_recommendation
+                (shop_id, product_tmpl_id, recommended_tmpl_id, rank, order_count, confidence)
+            SELECT %s, * FROM unnest(%s::int[], %s::int[], %s::int[], %s::int[], %s::float8[])
+        """, [
+            shop_id,
+            product_ids[rows].tolist(),
+            product_ids[cols].tolist(),
+            ranks.tolist(),
+            counts.tolist(),
+            (counts / product_orders[rows]).tolist(),
+        ])
+
+    @api.model
+    def _get_recommended_ids(self, product_tmpl_id, limit=RECOMMENDATION_TOP_K):
+        """Return the ids of the product templates most often ordered with a product, best first."""
+        self.env.cr.execute("""
+            SELECT recommended_tmpl_id FROM angkort_product_recommendation
+            WHERE product_tmpl_id = %s
+            ORDER BY rank
+            LIMIT %s
+        """, [product_tmpl_id, limit])
+        return [row[0] for row in self.env.cr.fetchall()]
@@ -1,8 +1,158 @@
 
 from odoo import fields, models, api, _
+from odoo.tools import float_round
+
+# Fields read by the cached menu data (category tree, price table, ...); changing one of them gives the shop
+# a new menu version
+MENU_CACHE_FIELDS = {'shop_id', 'categ_id', 'active', 'name', 'list_price', 'taxes_id', 'uom_id', 'description_sale'}
+
+PRICE_RULE_TYPES = ('percentage', 'fixed')
+PRICE_RULE_TARGETS = ('products', 'extras', 'all')
+
+
+def menu_changed_records(records, vals, fnames):
+    """Return the records on which writing ``vals`` would change the value of one of the fields ``fnames``."""
+    fnames = [fname for fname in fnames if fname in vals and fname in records._fields]
+    if not fnames:
+        return records.browse()
+
+    def changed(record):
+        for fname in fnames:
+            field = record._fields[fname]
+            new_value = field.convert_to_record(field.convert_to_cache(vals[fname], record), record)
+            if record[fname] != new_value:
+                return True
+        return False
+
+    return records.filtered(changed)
 
 
 class ProductTemplate(models.Model):
     _inherit = "product.template"
 
     shop_id = fields.Many2one('res.partner', domain="[('type', '=', 'store')]")
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        products = super().create(vals_list)
+        self.env['res.partner']._angkort_bump_menu_version(products._angkort_menu_shop_ids())
+        self.env['angkort.product.availability'].sudo()._refresh_later(products.filtered('shop_id').ids)
+        return products
+
+    def write(self, vals):
+        changed = menu_changed_records(self, vals, MENU_CACHE_FIELDS)
+        shop_ids = changed._angkort_menu_shop_ids()
+        res = super().write(vals)
+        self.env['res.partner']._angkort_bump_menu_version(shop_ids | changed._angkort_menu_shop_ids())
+        if 'shop_id' in vals or 'is_storable' in vals:
+            self.env['angkort.product.availability'].sudo()._refresh_later(self.ids)
+        return res
+
+    def unlink(self):
+        shop_ids = self._angkort_menu_shop_ids()
+        res = super().unlink()
+        self.env['res.partner']._angkort_bump_menu_version(shop_ids)
+        return res
+
+    def _angkort_menu_shop_ids(self):
+        """Return the ids of the shops whose menu shows these products."""
+        return set(self.sudo().shop_id.ids)
+
+    @api.model
+    def _angkort_apply_price_rule(self, price, rule_type, value, rounding=0.0):
+        """Return ``price`` changed by a percentage or fixed amount, never below zero."""
+        if rule_type == 'percentage':
+            new_price = price * (1 + value / 100.0)
+        else:
+            new_price = price + value
+        new_price = max(new_price, 0.0)
+        if rounding:
+            return float_round(new_price, precision_rounding=rounding)
+        return float_round(new_price, precision_digits=self.env['decimal.precision'].precision_get('Product Price'))
+
+    @api.model
+    def _angkort_bulk_price_update(self, shop_id, rule_type, value, rounding=0.0, categ_ids=None,
+                                   attribute_value_ids=None, target='products', apply=False):
+        """Compute (and optionally apply) a price rule over a shop's catalog.
+
+        Product prices (``list_price``) and option prices (the shop attribute
+        values' ``default_extra_price`` and the per-product
+        ``product.template.attribute.value.price_extra``) are selected with one
+        read each, and each table is updated with a single ``UPDATE`` statement.
+
+        :return: dict with the list of changes per table, as
+                 ``{'id', 'name', 'old_price', 'new_price'}`` entries
+        """
+        changes = {'products': [], 'attribute_values': [], 'product_attribute_values': []}
+
+        if target in ('products', 'all'):
+            domain = [('shop_id', '=', shop_id)]
+            if categ_ids:
+                domain.append(('categ_id', 'in', categ_ids))
+            if attribute_value_ids:
+                domain.append(('attribute_line_ids.value_ids', 'in', attribute_value_ids))
+            for product in self.search_read(domain, ['name', 'list_price']):
+                new_price = self._angkort_apply_price_rule(product['list_price'], rule_type, value, rounding)
+                if new_price != product['list_price']:
+                    changes['products'].append({
+                        'id': product['id'],
+                        'name': product['name'],
+                        'old_price': product['list_price'],
+                        'new_price': new_price,
+                    })
+
+        if target in ('extras', 'all'):
+            domain = [('attribute_id.shop_id', '=', shop_id)]
+            if attribute_value_ids:
+                domain.append(('id', 'in', attribute_value_ids))
+            for value_data in self.env['product.attribute.value'].search_read(domain, ['name', 'default_extra_price']):
+                new_price = self._angkort_apply_price_rule(value_data['default_extra_price'], rule_type, value, rounding)
+                if new_price != value_data['default_extra_price']:
+                    changes['attribute_values'].append({
+                        'id': value_data['id'],
+                        'name': value_data['name'],
+                        'old_price': value_data['default_extra_price'],
+                        'new_price': new_price,
+                    })
+
+            domain = [('product_tmpl_id.shop_id', '=', shop_id)]
+            if categ_ids:
+                domain.append(('product_tmpl_id.categ_id', 'in', categ_ids))
+            if attribute_value_ids:
+                domain.append(('product_attribute_value_id', 'in', attribute_value_ids))
+            ptav_data = self.env['product.template.attribute.value'].search_read(
+                domain, ['name', 'product_tmpl_id', 'price_extra'])
+            for value_data in ptav_data:
+                new_price = self._angkort_apply_price_rule(value_data['price_extra'], rule_type, value, rounding)
+                if new_price != value_data['price_extra']:
+                    changes['product_attribute_values'].append({
+                        'id': value_data['id'],
+                        'name': value_data['name'],
+                        'product_id': value_data['product_tmpl_id'][0],
+                        'old_price': value_data['price_extra'],
+                        'new_price': new_price,
+                    })
+
+        if apply:
+            self._angkort_write_prices('product.template', 'list_price', changes['products'])
+            self._angkort_write_prices('product.attribute.value', 'default_extra_price', changes['attribute_values'])
+            self._angkort_write_prices('product.template.attribute.value', 'price_extra',
+                                       changes['product_attribute_values'])
+        return changes
+
+    @api.model
+    def _angkort_write_prices(self, model_name, column, changes):
+        """Write the ``new_price`` of every change in one set-based ``UPDATE``."""
+        if not changes:
+            return
+        model = self.env[model_name]
+        model.flush_model([column])
+        self.env.cr.execute(f"""
+            UPDATE {model._table} AS t
+            SET {column} = v.price, write_date = now() at time zone 'UTC', write_uid = %s
+            FROM unnest(%s::int[], %s::numeric[]) AS v(id, price)
+            WHERE t.id = v.id
+        """, [self.env.uid, [change['id'] for change in changes], [change['new_price'] for change in changes]])
+        model.invalidate_model([column, 'write_date', 'write_uid'])
+        self.env['res.partner']._angkort_bump_menu_version(
+            model.browse([change['id'] for change in changes])._angkort_menu_shop_ids())
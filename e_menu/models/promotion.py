@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+from collections import defaultdict, namedtuple
+from datetime import datetime
+
+import pytz
+
+from odoo import fields, models, api, tools, _
+from odoo.exceptions import ValidationError
+
+from .product_template import menu_changed_records
+
+WEEKDAY_FIELDS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+HOURS_PER_WEEK = 7 * 24
+
+PromotionRule = namedtuple('PromotionRule', [
+    'id', 'name', 'promotion_type', 'discount', 'minute_from', 'minute_to', 'date_from', 'date_to', 'components',
+])
+
+
+class PromotionSlot:
+    """Rules of a shop that can apply during one hour of the week, indexed for lookups per cart line."""
+
+    __slots__ = ('by_product', 'by_category', 'shop_wide', 'combos_by_product')
+
+    def __init__(self):
+        self.by_product = defaultdict(list)
+        self.by_category = defaultdict(list)
+        self.shop_wide = []
+        self.combos_by_product = defaultdict(list)
+
+
+class CompiledPromotions:
+    """Active promotions of a shop compiled into one :class:`PromotionSlot` per hour of the week.
+
+    Evaluating a cart only looks at the rules indexed under its products and
+    categories for the current hour, so the cost grows with the number of
+    lines, not with the number of rules of the shop.
+    """
+
+    def __init__(self, tz, slots):
+        self.tz = tz
+        self.slots = slots
+
+    @staticmethod
+    def _is_active(rule, now):
+        minute = now.hour * 60 + now.minute
+        if rule.minute_from < rule.minute_to:
+            in_window = rule.minute_from <= minute < rule.minute_to
+        else:
+            # window over midnight, e.g. 22:00 - 02:00
+            in_window = minute >= rule.minute_from or minute < rule.minute_to
+        today = now.date()
+        return (in_window
+                and (not rule.date_from or rule.date_from <= today)
+                and (not rule.date_to or today <= rule.date_to))
+
+    @staticmethod
+    def _line_discount(rule, line):
+        if rule.promotion_type == 'percentage':
+            return line['total'] * rule.discount / 100.0
+        return min(rule.discount * line['quantity'], line['total'])
+
+    def apply(self, priced_lines, categories, now=None):
+        """Apply the best matching promotion to every priced line, then the combos of the cart.
+
+        Line discounts are subtracted from each line ``total``. Lines with an
+        ``error`` are left untouched.
+
+        :param priced_lines: lines priced by :class:`ShopPriceTable`
+        :param categories: ``{product_tmpl_id: categ_id}``
+        :param now: naive UTC datetime, defaults to the current time
+        :return: list of combo discounts ``{'promotion_id', 'name', 'product_tmpl_ids', 'count', 'discount'}``
+        """
+        now = pytz.utc.localize(now or datetime.utcnow()).astimezone(self.tz)
+        slot = self.slots[now.weekday() * 24 + now.hour]
+        if slot is None:
+            for line in priced_lines:
+                if 'error' not in line:
+                    line.update(discount=0.0, promotion=False)
+            return []
+
+        quantities = defaultdict(int)
+        combos = {}
+        for line in priced_lines:
+            if 'error' in line:
+                continue
+            product_tmpl_id = line['product_tmpl_id']
+            quantities[product_tmpl_id] += line['quantity']
+            for rule in slot.combos_by_product.get(product_tmpl_id, ()):
+                combos[rule.id] = rule
+
+            best_rule, best_discount = None, 0.0
+            candidates = (slot.by_product.get(product_tmpl_id, []) + slot.by_category.get(
+                categories.get(product_tmpl_id), []) + slot.shop_wide)
+            for rule in candidates:
+                if not self._is_active(rule, now):
+                    continue
+                discount = self._line_discount(rule, line)
+                if discount > best_discount:
+                    best_rule, best_discount = rule, discount
+            line['discount'] = best_discount
+            line['promotion'] = best_rule and {'id': best_rule.id, 'name': best_rule.name}
+            line['total'] -= best_discount
+
+        combo_discounts = []
+        for rule in combos.values():
+            if not self._is_active(rule, now):
+                continue
+            count = min(quantities.get(product_tmpl_id, 0) for product_tmpl_id in rule.components)
+            if count:
+                combo_discounts.append({
+                    'promotion_id': rule.id,
+                    'name': rule.name,
+                    'product_tmpl_ids': sorted(rule.components),
+                    'count': count,
+                    'discount': rule.discount * count,
+                })
+        return combo_discounts
+
+
+class Promotion(models.Model):
+    _name = "angkort.promotion"
+    _description = "Shop promotion"
+    _order = "shop_id, sequence, id"
+
+    name = fields.Char(string="Name", required=True, translate=True)
+    sequence = fields.Integer(default=10)
+    active = fields.Boolean(string="Active", default=True)
+    shop_id = fields.Many2one('res.partner', string="Shop", required=True, index=True, ondelete='cascade',
+                              domain="[('type', '=', 'store')]")
+    promotion_type = fields.Selection([
+        ('percentage', 'Percentage discount'),
+        ('fixed', 'Fixed discount per unit'),
+        ('combo', 'Combo discount'),
+    ], string="Type", required=True, default='percentage')
+    discount = fields.Float(string="Discount", required=True,
+                            help="Percentage for percentage discounts, amount per unit for fixed discounts and "
+                                 "amount per complete combo for combo discounts.")
+    product_ids = fields.Many2many('product.template', string="Products",
+                                   help="Discounted products, or the products making up the combo. "
+                                        "Leave empty with no category to discount the whole menu.")
+    categ_ids = fields.Many2many('product.category', string="Categories",
+                                 help="Discount the products of these categories and their sub-categories.")
+    mon = fields.Boolean(string="Monday", default=True)
+    tue = fields.Boolean(string="Tuesday", default=True)
+    wed = fields.Boolean(string="Wednesday", default=True)
+    thu = fields.Boolean(string="Thursday", default=True)
+    fri = fields.Boolean(string="Friday", default=True)
+    sat = fields.Boolean(string="Saturday", default=True)
+    sun = fields.Boolean(string="Sunday", default=True)
+    hour_from = fields.Float(string="From", default=0.0)
+    hour_to = fields.Float(string="To", default=24.0)
+    date_from = fields.Date(string="Start Date")
+    date_to = fields.Date(string="End Date")
+
+    @api.constrains('hour_from', 'hour_to')
+    def _check_hours(self):
+        for promotion in self:
+            if not (0 <= promotion.hour_from <= 24 and 0 <= promotion.hour_to <= 24):
+                raise ValidationError(_("Promotion hours must be between 0 and 24."))
+
+    @api.constrains('promotion_type', 'discount')
+    def _check_discount(self):
+        for promotion in self:
+            if promotion.promotion_type == 'percentage' and not 0 <= promotion.discount <= 100:
+                raise ValidationError(_("A percentage discount must be between 0 and 100."))
+            if promotion.discount < 0:
+                raise ValidationError(_("A discount can't be negative."))
+
+    @api.constrains('promotion_type', 'product_ids')
+    def _check_combo_products(self):
+        for promotion in self:
+            if promotion.promotion_type == 'combo' and len(promotion.product_ids) < 2:
+                raise ValidationError(_("A combo needs at least two products."))
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        promotions = super().create(vals_list)
+        self.env['res.partner']._angkort_bump_menu_version(promotions.shop_id.ids)
+        return promotions
+
+    def write(self, vals):
+        changed = menu_changed_records(self, vals, set(vals))
+        shop_ids = changed.shop_id.ids
+        res = super().write(vals)
+        self.env['res.partner']._angkort_bump_menu_version(shop_ids + changed.shop_id.ids)
+        return res
+
+    def unlink(self):
+        shop_ids = self.shop_id.ids
+        res = super().unlink()
+        self.env['res.partner']._angkort_bump_menu_version(shop_ids)
+        return res
+
+    def _get_hours_of_week(self):
+        """Return the hours of the week (0 = Monday 00:00) during which the promotion can apply."""
+        self.ensure_one()
+        first_hour = int(self.hour_from)
+        last_hour = int(self.hour_to - 1e-6) if self.hour_to > self.hour_from else int(self.hour_from) + 23
+        hours = set()
+        for weekday, field_name in enumerate(WEEKDAY_FIELDS):
+            if self[field_name]:
+                hours.update((weekday * 24 + hour) % HOURS_PER_WEEK for hour in range(first_hour, last_hour + 1))
+        return hours
+
+    @api.model
+    @tools.ormcache('shop_id', 'self.env["res.partner"]._angkort_menu_version(shop_id)')
+    def _angkort_compiled_promotions(self, shop_id):
+        """Return the :class:`CompiledPromotions` of a shop.
+
+        Cached per shop and menu version, which changes with the promotions
+        and the products of the shop; callers must not modify it.
+        """
+        self = self.sudo()
+        shop = self.env['res.partner'].browse(shop_id)
+        slots = [None] * HOURS_PER_WEEK
+        for promotion in self.search([('shop_id', '=', shop_id)]):
+            rule = PromotionRule(
+                id=promotion.id,
+                name=promotion.name,
+                promotion_type=promotion.promotion_type,
+                discount=promotion.discount,
+                minute_from=round(promotion.hour_from * 60),
+                minute_to=round(promotion.hour_to * 60),
+                date_from=promotion.date_from,
+                date_to=promotion.date_to,
+                components=frozenset(promotion.product_ids.ids),
+            )
+            category_ids = promotion.categ_ids and self.env['product.category'].search(
+                [('id', 'child_of', promotion.categ_ids.ids)]).ids
+            for hour in promotion._get_hours_of_week():
+                slot = slots[hour] = slots[hour] or PromotionSlot()
+                if rule.promotion_type == 'combo':
+                    for product_tmpl_id in rule.components:
+                        slot.combos_by_product[product_tmpl_id].append(rule)
+                    continue
+                for product_tmpl_id in rule.components:
+                    slot.by_product[product_tmpl_id].append(rule)
+                for category_id in category_ids or []:
+                    slot.by_category[category_id].append(rule)
+                if not rule.components and not category_ids:
+                    slot.shop_wide.append(rule)
+        tz = pytz.timezone(shop.tz or self.env.user.tz or 'UTC')
+        return CompiledPromotions(tz, slots)
+
+    @api.model
+    def _angkort_apply_promotions(self, shop_id, price_table, priced_lines, now=None):
+        """Apply the promotions of a shop to lines priced with ``price_table``.
+
+        :return: list of combo discounts of the cart
+        """
+        return self._angkort_compiled_promotions(shop_id).apply(priced_lines, price_table.categories, now=now)
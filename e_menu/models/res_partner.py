@@ -1,7 +1,14 @@
 # -*- codig: utf-8 -*-
 import uuid
+from collections import defaultdict
 
-from odoo import fields, models, api, _
+from odoo import fields, models, api, _, Command
+
+MENU_CLONE_PRODUCT_FIELDS = [
+    'name', 'description', 'description_sale', 'list_price', 'categ_id', 'type', 'is_storable',
+    'sale_ok', 'purchase_ok', 'uom_id', 'uom_po_id', 'taxes_id',
+]
+MENU_CLONE_IMAGE_FIELDS = ('image_1920', 'image_1024', 'image_512', 'image_256', 'image_128')
 
 
 class Partner(models.Model):
@@ -18,6 +25,37 @@ class Partner(models.Model):
     customer_address = fields.Char()
     shop_latitude = fields.Char()
     shop_longitude = fields.Char()
+    angkort_menu_version = fields.Integer(
+        string="Menu Version", readonly=True, copy=False,
+        help="Changed whenever the menu of the shop changes; part of the key of the cached menu data.")
+
+    def init(self):
+        super().init()
+        # versions are never reused, even by rolled back transactions, so a cached menu can't be served again
+        self.env.cr.execute("CREATE SEQUENCE IF NOT EXISTS angkort_menu_version_seq")
+
+    @api.model
+    def _angkort_menu_version(self, shop_id):
+        """Return the current menu version of a shop, read from the database so every worker agrees on it."""
+        self.env.cr.execute("SELECT angkort_menu_version FROM res_partner WHERE id = %s", [shop_id])
+        row = self.env.cr.fetchone()
+        return row and row[0]
+
+    @api.model
+    def _angkort_bump_menu_version(self, shop_ids):
+        """Give the given shops a new menu version, so their cached menu data is rebuilt on next use.
+
+        Only the cache entries of these shops become unused; the registry
+        caches of the other shops and of the rest of Odoo are left alone.
+        """
+        shop_ids = [shop_id for shop_id in set(shop_ids) if shop_id]
+        if not shop_ids:
+            return
+        self.env.cr.execute("""
+            UPDATE res_partner SET angkort_menu_version = nextval('angkort_menu_version_seq')
+            WHERE id = ANY(%s)
+        """, [shop_ids])
+        self.invalidate_model(['angkort_menu_version'])
 
     def generate_telegram_token(self):
         for partner in self:
@@ -31,3 +69,173 @@ class Partner(models.Model):
                 val['type'] = 'store'
         res = super().create(vals)
         return res
+
+    def _angkort_clone_menu(self, target_shop):
+        """Copy the whole menu of this shop to ``target_shop``.
+
+        Categories, attributes (with their values), products and their
+        attribute lines are created with one batched ``create`` per model and
+        linked through in-memory id maps instead of ``copy()`` per record.
+        Product images are not re-encoded: the new products reference the same
+        filestore files as the source products.
+
+        :return: dict with the number of records created per model
+        """
+        self.ensure_one()
+        target_shop.ensure_one()
+        env = self.with_context(tracking_disable=True, mail_create_nolog=True, mail_notrack=True).env
+
+        # Categories, parents first so that children can be linked to their new parent
+        categories = env['product.category'].search_read(
+            [('shop_id', '=', self.id)], ['name', 'parent_id', 'parent_path'])
+        categories_by_depth = defaultdict(list)
+        for category in categories:
+            categories_by_depth[category['parent_path'].count('/')].append(category)
+        category_map = {}
+        for depth in sorted(categories_by_depth):
+            level = categories_by_depth[depth]
+            vals_list = []
+            for category in level:
+                parent_id = category['parent_id'] and category['parent_id'][0]
+                vals_list.append({
+                    'name': category['name'],
+                    'parent_id': category_map.get(parent_id, parent_id),
+                    'shop_id': target_shop.id,
+                })
+            new_categories = env['product.category'].create(vals_list)
+            category_map.update(zip([category['id'] for category in level], new_categories.ids))
+
+        # Attributes with their values; names are unique per shop, so the attributes (and values)
+        # the target shop already has are reused. Names are compared in en_US, as the unique index does.
+        attribute_env = env['product.attribute'].with_context(lang='en_US')
+        value_env = env['product.attribute.value'].with_context(lang='en_US')
+        attributes = attribute_env.search_read(
+            [('shop_id', '=', self.id)], ['name', 'display_type', 'create_variant', 'sequence'])
+        values_by_attribute = defaultdict(list)
+        for value in value_env.search_read(
+                [('attribute_id', 'in', [attribute['id'] for attribute in attributes])],
+                ['name', 'sequence', 'default_extra_price', 'html_color', 'is_custom', 'attribute_id']):
+            values_by_attribute[value['attribute_id'][0]].append(value)
+
+        def value_vals(value):
+            return {
+                'name': value['name'],
+                'sequence': value['sequence'],
+                'default_extra_price': value['default_extra_price'],
+                'html_color': value['html_color'],
+                'is_custom': value['is_custom'],
+            }
+
+        target_attributes = {
+            attribute.name: attribute for attribute in attribute_env.search([('shop_id', '=', target_shop.id)])
+        }
+        missing_attributes = []
+        value_vals_list = []
+        for attribute in attributes:
+            target_attribute = target_attributes.get(attribute['name'])
+            if not target_attribute:
+                missing_attributes.append(attribute)
+                continue
+            target_value_names = set(target_attribute.value_ids.mapped('name'))
+            value_vals_list += [
+                dict(value_vals(value), attribute_id=target_attribute.id)
+                for value in values_by_attribute[attribute['id']] if value['name'] not in target_value_names
+            ]
+        new_attributes = attribute_env.create([{
+            'name': attribute['name'],
+            'display_type': attribute['display_type'],
+            'create_variant': attribute['create_variant'],
+            'sequence': attribute['sequence'],
+            'shop_id': target_shop.id,
+            'value_ids': [Command.create(value_vals(value)) for value in values_by_attribute[attribute['id']]],
+        } for attribute in missing_attributes])
+        new_values = value_env.create(value_vals_list)
+        target_attributes.update(zip([attribute['name'] for attribute in missing_attributes], new_attributes))
+        attribute_map = {attribute['id']: target_attributes[attribute['name']].id for attribute in attributes}
+        target_value_ids = {
+            (value['attribute_id'][0], value['name']): value['id']
+            for value in value_env.search_read([('attribute_id', 'in', list(attribute_map.values()))],
+                                               ['name', 'attribute_id'])
+        }
+        value_map = {
+            value['id']: target_value_ids[(attribute_map[attribute_id], value['name'])]
+            for attribute_id, values in values_by_attribute.items()
+            for value in values
+        }
+
+        # Products with their attribute lines
+        products = env['product.template'].search_read([('shop_id', '=', self.id)], MENU_CLONE_PRODUCT_FIELDS)
+        product_ids = [product['id'] for product in products]
+        lines_by_product = defaultdict(list)
+        for line in env['product.template.attribute.line'].search_read(
+                [('product_tmpl_id', 'in', product_ids)], ['product_tmpl_id', 'attribute_id', 'value_ids']):
+            lines_by_product[line['product_tmpl_id'][0]].append(line)
+        product_vals_list = []
+        for product in products:
+            vals = {
+                field_name: value[0] if isinstance(value, tuple) else value
+                for field_name, value in product.items() if field_name != 'id'
+            }
+            vals.update({
+                'categ_id': category_map.get(vals['categ_id'], vals['categ_id']),
+                'taxes_id': [Command.set(product['taxes_id'])],
+                'shop_id': target_shop.id,
+                'attribute_line_ids': [Command.create({
+                    'attribute_id': attribute_map.get(line['attribute_id'][0], line['attribute_id'][0]),
+                    'value_ids': [Command.set([value_map.get(value_id, value_id) for value_id in line['value_ids']])],
+                }) for line in lines_by_product[product['id']]],
+            })
+            product_vals_list.append(vals)
+        new_products = env['product.template'].create(product_vals_list)
+        product_map = dict(zip(product_ids, new_products.ids))
+
+        # Per-product extra prices, when they differ from the value default
+        source_extras = {
+            (ptav['product_tmpl_id'][0], ptav['product_attribute_value_id'][0]): ptav['price_extra']
+            for ptav in env['product.template.attribute.value'].search_read(
+                [('product_tmpl_id', 'in', product_ids)],
+                ['product_tmpl_id', 'product_attribute_value_id', 'price_extra'])
+        }
+        reverse_product_map = {new_id: old_id for old_id, new_id in product_map.items()}
+        reverse_value_map = {new_id: old_id for old_id, new_id in value_map.items()}
+        extra_changes = []
+        for ptav in env['product.template.attribute.value'].search_read(
+                [('product_tmpl_id', 'in', new_products.ids)],
+                ['product_tmpl_id', 'product_attribute_value_id', 'price_extra']):
+            source_key = (
+                reverse_product_map[ptav['product_tmpl_id'][0]],
+                reverse_value_map.get(ptav['product_attribute_value_id'][0], ptav['product_attribute_value_id'][0]),
+            )
+            price_extra = source_extras.get(source_key, ptav['price_extra'])
+            if price_extra != ptav['price_extra']:
+                extra_changes.append({'id': ptav['id'], 'new_price': price_extra})
+        env['product.template']._angkort_write_prices('product.template.attribute.value', 'price_extra', extra_changes)
+
+        # Images: share the stored files of the source products
+        if product_map:
+            env['ir.attachment'].flush_model()
+            self.env.cr.execute("""
+                INSERT INTO ir_attachment (
+                    name, res_model, res_field, res_id, company_id, type, store_fname, db_datas,
+                    file_size, checksum, mimetype, public, create_uid, create_date, write_uid, write_date
+                )
+                SELECT a.name, a.res_model, a.res_field, m.new_id, a.company_id, a.type, a.store_fname, a.db_datas,
+                       a.file_size, a.checksum, a.mimetype, a.public,
+                       %(uid)s, now() at time zone 'UTC', %(uid)s, now() at time zone 'UTC'
+                FROM ir_attachment a
+                JOIN unnest(%(old_ids)s::int[], %(new_ids)s::int[]) AS m(old_id, new_id) ON a.res_id = m.old_id
+                WHERE a.res_model = 'product.template' AND a.res_field IN %(fields)s
+            """, {
+                'uid': self.env.uid,
+                'old_ids': list(product_map),
+                'new_ids': list(product_map.values()),
+                'fields': MENU_CLONE_IMAGE_FIELDS,
+            })
+            new_products.invalidate_recordset(list(MENU_CLONE_IMAGE_FIELDS))
+
+        return {
+            'categories': len(category_map),
+            'attributes': len(new_attributes),
+            'attribute_values': len(new_attributes.value_ids) + len(new_values),
+            'products': len(product_map),
+        }
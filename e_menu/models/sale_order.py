@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+import threading
+from collections import defaultdict
+
+import psycopg2
+
+from odoo import fields, models, api, tools, Command
+from odoo.tools import SQL
+
+DEFAULT_ORDER_SEQUENCE_BLOCK = 50
+
+# {(dbname, shop_id): [next_number, block_end]}, ticket numbers preallocated by this worker process
+_ticket_blocks = {}
+_ticket_blocks_lock = threading.Lock()
+
+KITCHEN_PRECOMMIT_KEY = 'angkort.kitchen'
+# Fields shown on the kitchen tickets; changing another field does not publish the order again
+KITCHEN_ORDER_FIELDS = {'name', 'ticket_number', 'state', 'partner_id', 'note', 'date_order', 'shop_id'}
+KITCHEN_LINE_FIELDS = {'order_id', 'product_id', 'name', 'product_uom_qty', 'display_type'}
+
+# Context of the fast-path order creation: no chatter message, follower or tracking values
+FAST_CREATE_CONTEXT = {
+    'tracking_disable': True,
+    'mail_create_nolog': True,
+    'mail_create_nosubscribe': True,
+    'mail_notrack': True,
+}
+
+
+class SaleOrder(models.Model):
+    _inherit = "sale.order"
+
+    shop_id = fields.Many2one('res.partner', string="Shop", index='btree_not_null', domain="[('type', '=', 'store')]")
+    ticket_number = fields.Integer(string="Ticket Number", readonly=True, copy=False,
+                                   help="Number of the order in its shop, as shown to the customer.")
+    angkort_deferred_pending = fields.Boolean(
+        string="Deferred Processing Pending", index='btree_not_null', copy=False,
+        help="Created through the fast path; followers and analytic distribution are set by a background job.")
+    angkort_kitchen_sequence = fields.Integer(
+        string="Kitchen Sequence", readonly=True, copy=False,
+        help="Position of the last change of the ticket in the kitchen feed of the shop, assigned at commit.")
+
+    def init(self):
+        super().init()
+        # order history of a customer, see the /my/order endpoint
+        tools.create_index(self._cr, 'sale_order_partner_date_order_id_index', self._table,
+                           ['partner_id', 'date_order DESC', 'id DESC'])
+        # changes of the orders of a shop, see the kitchen feed
+        tools.create_index(self._cr, 'sale_order_shop_kitchen_sequence_index', self._table,
+                           ['shop_id', 'angkort_kitchen_sequence'], where='shop_id IS NOT NULL')
+        self._cr.execute("CREATE SEQUENCE IF NOT EXISTS angkort_kitchen_sequence_seq")
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        orders = super().create(vals_list)
+        orders._angkort_kitchen_changed()
+        return orders
+
+    def write(self, vals):
+        res = super().write(vals)
+        if 'state' in vals:
+            self._angkort_notify_status()
+        if KITCHEN_ORDER_FIELDS.intersection(vals):
+            self._angkort_kitchen_changed()
+        return res
+
+    def _angkort_kitchen_changed(self):
+        """Publish the orders on the kitchen feed of their shop right before the transaction commits.
+
+        Orders changed several times in a transaction are published once.
+        Precommit hooks also run when a savepoint opens or closes, so callers
+        processing a batch in savepoints set ``angkort_kitchen_batch`` in the
+        context and publish the orders of the batch themselves, right before
+        committing it.
+        """
+        if self._context.get('angkort_kitchen_batch'):
+            return
+        orders = self.filtered('shop_id')
+        if not orders:
+            return
+        data = self.env.cr.precommit.data
+        if KITCHEN_PRECOMMIT_KEY not in data:
+            data[KITCHEN_PRECOMMIT_KEY] = set()
+            env = self.env
+
+            def publish():
+                env['sale.order'].sudo()._angkort_publish_kitchen(env.cr.precommit.data.pop(KITCHEN_PRECOMMIT_KEY))
+
+            self.env.cr.precommit.add(publish)
+        data[KITCHEN_PRECOMMIT_KEY].update(orders.ids)
+
+    @api.model
+    def _angkort_publish_kitchen(self, order_ids):
+        """Give the orders the next positions of the kitchen feed and push them to the kitchen screens.
+
+        Positions come from a sequence, taken while holding a lock per shop
+        until the commit: the changes of a shop commit in the order of their
+        positions, so the catch-up cursor never passes a change that is not
+        committed yet. Callers run it right before committing, so the lock
+        only covers the end of the transactions.
+        """
+        orders = self.browse(order_ids).exists().filtered('shop_id')
+        if not orders:
+            return
+        for shop_id in sorted(set(orders.shop_id.ids)):
+            self.env.cr.execute("SELECT pg_advisory_xact_lock(hashtext('angkort_kitchen'), %s)", [shop_id])
+        self.flush_model(['angkort_kitchen_sequence'])
+        self.env.cr.execute("""
+            UPDATE sale_order SET angkort_kitchen_sequence = nextval('angkort_kitchen_sequence_seq')
+            WHERE id = ANY(%s)
+        """, [orders.ids])
+        self.invalidate_model(['angkort_kitchen_sequence'])
+        self.env['bus.bus']._sendmany([
+            ((order.shop_id, 'angkort_kitchen'), 'angkort/kitchen_order', order._angkort_kitchen_dict())
+            for order in orders
+        ])
+
+    @api.model
+    def _angkort_kitchen_last_sequence(self, shop_id):
+        """Return the position of the last change of the kitchen feed of a shop seen by this transaction."""
+        self.flush_model(['shop_id', 'angkort_kitchen_sequence'])
+        self.env.cr.execute("""
+            SELECT COALESCE(MAX(angkort_kitchen_sequence), 0) FROM sale_order WHERE shop_id = %s
+        """, [shop_id])
+        return self.env.cr.fetchone()[0]
+
+    def _angkort_kitchen_dict(self):
+        self.ensure_one()
+        return {
+            'id': self.id,
+            'name': self.name,
+            'ticket_number': self.ticket_number,
+            'sequence': self.angkort_kitchen_sequence,
+            'state': self.state,
+            'customer': self.partner_id.name,
+            'note': self.note and tools.html2plaintext(self.note) or '',
+            'date_order': fields.Datetime.to_string(self.date_order),
+            'write_date': fields.Datetime.to_string(self.write_date),
+            'lines': [{
+                'id': line.id,
+                'product_id': line.product_id.id,
+                'name': line.name,
+                'quantity': line.product_uom_qty,
+            } for line in self.order_line if not line.display_type],
+        }
+
+    def _angkort_notify_status(self):
+        """Push the new state of the orders to their customers on the bus."""
+        self.env['bus.bus'].sudo()._sendmany([
+            ((order.partner_id, 'angkort_orders'), 'angkort/order_status', {
+                'id': order.id,
+                'name': order.name,
+                'ticket_number': order.ticket_number,
+                'state': order.state,
+                'write_date': fields.Datetime.to_string(order.write_date),
+            })
+            for order in self
+        ])
+
+    def action_confirm(self):
+        to_confirm = self.filtered(lambda order: order.state != 'sale')
+        res = super().action_confirm()
+        confirmed = to_confirm.filtered(lambda order: order.state == 'sale')
+        self.env['angkort.sales.daily'].sudo()._add_orders(confirmed)
+        # the deliveries now reserve the stock the held units stood for
+        self.env['angkort.stock.hold'].sudo().search([('order_id', 'in', self.ids)]).unlink()
+        return res
+
+    def _action_cancel(self):
+        confirmed = self.filtered(lambda order: order.state == 'sale')
+        res = super()._action_cancel()
+        self.env['angkort.sales.daily'].sudo()._add_orders(confirmed, sign=-1)
+        self.env['angkort.stock.hold'].sudo().search([('order_id', 'in', self.ids)]).write({
+            'order_id': False,
+            'holder': False,
+            'user_id': False,
+            'expires_at': False,
+        })
+        return res
+
+    @api.model
+    def _angkort_prepare_order_lines(self, cart):
+        """Return the ``order_line`` commands of a priced cart.
+
+        Combo discounts are spread over the lines of their products, in
+        proportion to their amount, as line discounts.
+        """
+        combo_shares = defaultdict(float)
+        for combo in cart['combo_discounts']:
+            combo_lines = [line for line in cart['lines'] if line['product_tmpl_id'] in combo['product_tmpl_ids']]
+            combo_amount = sum(line['total'] for line in combo_lines)
+            for line in combo_lines:
+                if combo_amount:
+                    combo_shares[id(line)] += combo['discount'] * line['total'] / combo_amount
+
+        order_lines = []
+        for line in cart['lines']:
+            gross = line['unit_price'] * line['quantity']
+            discount = line['discount'] + combo_shares[id(line)]
+            line_values = {
+                'product_id': line['product_id'],
+                'product_uom_qty': line['quantity'],
+                'price_unit': line['unit_price'],
+                'discount': min(discount / gross * 100, 100.0) if gross else 0.0,
+            }
+            if line['variant_prices']:
+                line_values['name'] = '\n'.join([line['name']] + [
+                    f"{variant['attribute_name']}: {variant['value_name']}" for variant in line['variant_prices']])
+            order_lines.append(Command.create(line_values))
+        return order_lines
+
+    @api.model
+    def _angkort_create_from_cart(self, shop_id, partner, cart, hold_token=None, note=None):
+        """Hold the stock of a priced cart and create its order with all lines at once.
+
+        :param cart: cart priced by ``angkort.price.table._price_cart``, without invalid lines
+        :param hold_token: token of the customer's checkout, whose holds are reused
+        :return: ``(order, missing)``; when stock is short no order is created
+                 and ``missing`` lists the short lines with the available quantity
+        """
+        hold_sudo = self.env['angkort.stock.hold'].sudo()
+        hold_token, _expires_at, missing = hold_sudo._hold_cart(cart, hold_token)
+        if missing:
+            return self.browse(), missing
+
+        order = self._angkort_fast_create(shop_id, partner, self._angkort_prepare_order_lines(cart), note=note)
+        hold_sudo._attach_to_order(hold_token, order)
+        return order, []
+
+    @api.model
+    @tools.ormcache('shop_id', 'self.env.uid', 'self.env["res.partner"]._angkort_menu_version(shop_id)')
+    def _angkort_order_defaults(self, shop_id):
+        """Return the values of the orders of a shop that only depend on the shop, its menu and the user.
+
+        Cached per shop, user (the default sales team is the user's) and menu
+        version, which changes with the products of the shop; callers must not
+        modify it.
+
+        :return: dict with the order ``company_id`` and ``team_id``, and
+                 ``lines`` mapping each product to its line ``name``,
+                 ``product_uom`` and ``tax_id`` (taxes of the company)
+        """
+        self = self.sudo()
+        shop = self.env['res.partner'].browse(shop_id)
+        company = shop.company_id or self.env.company
+        self = self.with_company(company)
+        products = self.env['product.product'].search([('shop_id', '=', shop_id)])
+        lines = {}
+        for product in products:
+            lines[product.id] = {
+                'name': product.get_product_multiline_description_sale(),
+                'product_uom': product.uom_id.id,
+                'tax_id': tuple(product.taxes_id.filtered(lambda tax: tax.company_id == company).ids),
+            }
+        return {
+            'company_id': company.id,
+            'team_id': self.env['crm.team']._get_default_team_id(domain=[('company_id', 'in', (company.id, False))]).id,
+            'lines': lines,
+        }
+
+    @api.model
+    def _angkort_next_ticket_number(self, shop_id):
+        """Return the next ticket number of a shop.
+
+        Every shop has its own PostgreSQL sequence, incremented by
+        ``e_menu.order_sequence_block`` (50 by default, read when the sequence
+        is created). Each call to ``nextval`` reserves a whole block of numbers
+        for this worker, which then hands them out from memory, so shops do
+        not wait on each other nor on the ``sale.order`` sequence. Numbers are
+        unique and increase within a worker, but workers interleave blocks and
+        numbers left in a block when a worker stops are skipped.
+        """
+        key = (self.env.cr.dbname, shop_id)
+        with _ticket_blocks_lock:
+            block = _ticket_blocks.get(key)
+            if block and block[0] < block[1]:
+                block[0] += 1
+                return block[0] - 1
+
+        sequence_name = f'angkort_shop_order_seq_{int(shop_id)}'
+        self.env.cr.execute("SELECT to_regclass(%s)", [sequence_name])
+        if not self.env.cr.fetchone()[0]:
+            self._angkort_create_ticket_sequence(sequence_name)
+        # the increment is read from the catalog cache, the sequence may be newer than the transaction snapshot
+        self.env.cr.execute("SELECT nextval(%s::regclass), (pg_sequence_parameters(%s::regclass)).increment",
+                            [sequence_name, sequence_name])
+        start, block_size = self.env.cr.fetchone()
+        with _ticket_blocks_lock:
+            _ticket_blocks[key] = [start + 1, start + block_size]
+        return start
+
+    @api.model
+    def _angkort_create_ticket_sequence(self, sequence_name):
+        """Create a shop sequence in its own committed transaction.
+
+        Blocks handed out from the sequence are kept in memory, they must not
+        be reissued because the transaction of the first order rolled back.
+        """
+        block_size = int(self.env['ir.config_parameter'].sudo().get_param(
+            'e_menu.order_sequence_block', DEFAULT_ORDER_SEQUENCE_BLOCK))
+        try:
+            with self.env.registry.cursor() as cr:
+                cr.execute(SQL("CREATE SEQUENCE IF NOT EXISTS %s INCREMENT BY %s START WITH 1",
+                               SQL.identifier(sequence_name), max(block_size, 1)))
+        except psycopg2.IntegrityError:
+            # created at the same time by another worker
+            pass
+
+    @api.model
+    def _angkort_fast_create(self, shop_id, partner, order_lines, note=None):
+        """Create a menu order with the values that are constant per shop read from cache.
+
+        Line names, units and taxes come from :meth:`_angkort_order_defaults`
+        instead of being computed per line, and the order is created without
+        chatter message, follower or tracking, and numbered from the shop's
+        own sequence instead of the ``sale.order`` one (see
+        :meth:`_angkort_next_ticket_number`). Following the order and its
+        analytic distribution are done later by the
+        ``_angkort_process_deferred`` cron, on its next run: nothing waits
+        for them, so the order does not trigger it. Customers with a fiscal position,
+        set on them or detected from their address, fall back to the regular
+        computation of taxes.
+        """
+        defaults = self._angkort_order_defaults(shop_id)
+        partner = partner.with_company(defaults['company_id'])
+        fiscal_position = self.env['account.fiscal.position'].with_company(
+            defaults['company_id'])._get_fiscal_position(partner)
+        for command in order_lines:
+            line_values = command[2]
+            line_defaults = defaults['lines'].get(line_values['product_id'])
+            if not line_defaults:
+                continue
+            line_values.setdefault('name', line_defaults['name'])
+            line_values['product_uom'] = line_defaults['product_uom']
+            if not fiscal_position:
+                line_values['tax_id'] = [Command.set(line_defaults['tax_id'])]
+            line_values['analytic_distribution'] = False
+        shop = self.env['res.partner'].browse(shop_id)
+        ticket_number = self._angkort_next_ticket_number(shop_id)
+        order = self.with_context(**FAST_CREATE_CONTEXT).create({
+            'name': f"{shop.ref or shop_id}-{ticket_number:04d}",
+            'ticket_number': ticket_number,
+            'partner_id': partner.id,
+            'partner_invoice_id': partner.id,
+            'partner_shipping_id': partner.id,
+            'company_id': defaults['company_id'],
+            'team_id': defaults['team_id'],
+            'pricelist_id': partner.property_product_pricelist.id,
+            'payment_term_id': partner.property_payment_term_id.id,
+            'fiscal_position_id': fiscal_position.id,
+            'shop_id': shop_id,
+            'note': note or False,
+            'angkort_deferred_pending': True,
+            'order_line': order_lines,
+        })
+        return order
+
+    @api.model
+    def _angkort_process_deferred(self, batch_size=200, auto_commit=True):
+        """Subscribe the customers of fast-path orders and compute their analytic distribution, in batches."""
+        while True:
+            orders = self.search([('angkort_deferred_pending', '=', True)], limit=batch_size)
+            for order in orders:
+                order.message_subscribe(partner_ids=order.partner_id.ids)
+            orders.order_line._compute_analytic_distribution()
+            orders.angkort_deferred_pending = False
+            if auto_commit:
+                self.env.cr.commit()
+            if len(orders) < batch_size:
+                break
+
+
+class SaleOrderLine(models.Model):
+    _inherit = "sale.order.line"
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        lines = super().create(vals_list)
+        lines.order_id._angkort_kitchen_changed()
+        return lines
+
+    def write(self, vals):
+        orders = self.order_id
+        res = super().write(vals)
+        if KITCHEN_LINE_FIELDS.intersection(vals):
+            (orders | self.order_id)._angkort_kitchen_changed()
+        return res
+
+    def unlink(self):
+        orders = self.order_id
+        res = super().unlink()
+        orders._angkort_kitchen_changed()
+        return res
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+
+from dateutil.relativedelta import relativedelta
+
+from odoo import fields, models, api, tools
+from odoo.tools import SQL
+
+_logger = logging.getLogger(__name__)
+
+ARCHIVE_BATCH_SIZE = 200
+
+
+class SaleOrderArchive(models.Model):
+    """Compact copy of an old sale order, moved out of ``sale.order``.
+
+    Orders older than ``e_menu.order_archive_months`` months (0, the default,
+    disables archiving) that are either cancelled, or confirmed, fully
+    delivered and never invoiced, are copied here with their lines as JSON and
+    deleted from the live tables, so the queries on recent orders stay small.
+    Nothing references an archived order anymore: the aggregates keep their
+    figures, and the deliveries, procurement groups and stock moves lose their
+    link to it. An order that can't be archived is logged and skipped, the
+    others of its batch are archived anyway.
+    """
+    _name = "angkort.sale.order.archive"
+    _description = "Archived sale order"
+    _order = "date_order desc, id desc"
+    _log_access = False
+
+    original_id = fields.Integer(string="Order ID", required=True, readonly=True)
+    name = fields.Char(string="Order Reference", required=True, readonly=True)
+    ticket_number = fields.Integer(string="Ticket Number", readonly=True)
+    shop_id = fields.Many2one('res.partner', string="Shop", index='btree_not_null', ondelete='set null', readonly=True)
+    partner_id = fields.Many2one('res.partner', string="Customer", ondelete='cascade', readonly=True)
+    date_order = fields.Datetime(string="Order Date", readonly=True)
+    state = fields.Char(string="Status", readonly=True)
+    currency_id = fields.Many2one('res.currency', string="Currency", readonly=True)
+    amount_untaxed = fields.Monetary(string="Untaxed Amount", readonly=True)
+    amount_tax = fields.Monetary(string="Taxes", readonly=True)
+    amount_total = fields.Monetary(string="Total", readonly=True)
+    note = fields.Text(string="Note", readonly=True)
+    lines = fields.Text(string="Lines", readonly=True, help="Lines of the order, as JSON.")
+
+    _sql_constraints = [
+        ('original_id_uniq', 'unique(original_id)', 'An order is archived once.'),
+    ]
+
+    def init(self):
+        # order history of a customer, see the /my/order/history endpoint
+        tools.create_index(self._cr, 'angkort_sale_order_archive_partner_date_order_id_index', self._table,
+                           ['partner_id', 'date_order DESC', 'id DESC'])
+
+    @api.model
+    def _get_archive_months(self):
+        return int(self.env['ir.config_parameter'].sudo().get_param('e_menu.order_archive_months', 0))
+
+    @api.model
+    def _archive_orders(self, batch_size=ARCHIVE_BATCH_SIZE, auto_commit=True):
+        """Move the archivable orders out of ``sale.order``, one batch per transaction.
+
+        Orders are claimed with ``FOR UPDATE SKIP LOCKED``: an order being
+        edited is left for the next run, and only the rows of the batch are
+        locked, never the tables.
+        """
+        months = self._get_archive_months()
+        if months <= 0:
+            return
+        cutoff = fields.Datetime.now() - relativedelta(months=months)
+        # deliveries only exist with sale_stock, auto-installed next to sale and stock
+        open_pickings = SQL("""
+            AND NOT EXISTS (
+                SELECT 1 FROM stock_picking sp
+                WHERE sp.sale_id = so.id AND sp.state NOT IN ('done', 'cancel')
+            )
+        """) if 'picking_ids' in self.env['sale.order']._fields else SQL()
+        # orders that could not be archived, left out of the next batches of this run
+        failed_ids = []
+        while True:
+            self.env['sale.order'].flush_model()
+            self.env.cr.execute(SQL("""
+                SELECT so.id FROM sale_order so
+                WHERE so.date_order < %(cutoff)s
+                  AND so.id != ALL(%(failed_ids)s)
+                  AND (
+                    so.state = 'cancel'
+                    OR (
+                      so.state = 'sale'
+                      AND NOT EXISTS (
+                        SELECT 1 FROM sale_order_line sol
+                        JOIN sale_order_line_invoice_rel rel ON rel.order_line_id = sol.id
+                        WHERE sol.order_id = so.id
+                      )
+                      %(open_pickings)s
+                    )
+                  )
+                ORDER BY so.date_order, so.id
+                LIMIT %(limit)s
+                FOR UPDATE OF so SKIP LOCKED
+            """, cutoff=cutoff, failed_ids=failed_ids, open_pickings=open_pickings, limit=batch_size))
+            order_ids = [row[0] for row in self.env.cr.fetchall()]
+            if not order_ids:
+                break
+            try:
+                with self.env.cr.savepoint():
+                    self._archive(self.env['sale.order'].browse(order_ids))
+            except Exception:
+                # find the culprits one order at a time, and archive the others
+                self.env.invalidate_all()
+                for order_id in order_ids:
+                    try:
+                        with self.env.cr.savepoint():
+                            self._archive(self.env['sale.order'].browse(order_id))
+                    except Exception:
+                        _logger.exception("Could not archive the sale order %s", order_id)
+                        self.env.invalidate_all()
+                        failed_ids.append(order_id)
+            if auto_commit:
+                self.env.cr.commit()
+            if len(order_ids) < batch_size:
+                break
+
+    @api.model
+    def _get_order_references(self):
+        """Return the stored many2one fields pointing to orders or order lines, except the lines of the orders.
+
+        The orders are deleted in SQL, so these are emptied the way the ORM
+        would do it, instead of relying on the foreign keys of the database.
+        """
+        return [
+            field for model in self.env.values() if not model._abstract and model._auto
+            for field in model._fields.values()
+            if field.type == 'many2one' and field.store and field.comodel_name in ('sale.order', 'sale.order.line')
+            and not (field.model_name == 'sale.order.line' and field.name == 'order_id')
+        ]
+
+    @api.model
+    def _archive(self, orders):
+        """Copy the orders into the archive and delete them, with their lines, messages and attachments."""
+        orders.order_line.fetch(['product_id', 'name', 'product_uom_qty', 'price_unit', 'discount',
+                                 'price_subtotal', 'price_total', 'display_type'])
+        self.create([{
+            'original_id': order.id,
+            'name': order.name,
+            'ticket_number': order.ticket_number,
+            'shop_id': order.shop_id.id,
+            'partner_id': order.partner_id.id,
+            'date_order': order.date_order,
+            'state': order.state,
+            'currency_id': order.currency_id.id,
+            'amount_untaxed': order.amount_untaxed,
+            'amount_tax': order.amount_tax,
+            'amount_total': order.amount_total,
+            'note': order.note and tools.html2plaintext(order.note) or False,
+            'lines': json.dumps([{
+                'id': line.id,
+                'product_id': line.product_id.id,
+                'name': line.product_id.name,
+                'code': line.product_id.default_code or '',
+                'description': line.name,
+                'quantity': line.product_uom_qty,
+                'price_unit': line.price_unit,
+                'discount': line.discount,
+                'price_subtotal': line.price_subtotal,
+                'price_total': line.price_total,
+            } for line in order.order_line if not line.display_type]),
+        } for order in orders])
+        self.flush_model()
+
+        self.env['ir.attachment'].sudo().search([
+            ('res_model', '=', 'sale.order'), ('res_id', 'in', orders.ids),
+        ]).unlink()
+        self.env['mail.activity'].sudo().search([
+            ('res_model', '=', 'sale.order'), ('res_id', 'in', orders.ids),
+        ]).unlink()
+        self.env.flush_all()
+        # plain deletes: the ORM refuses to unlink confirmed orders, and the lines go with them (ON DELETE CASCADE);
+        # what references them is cleaned up first, deliveries, procurement groups and stock moves among others,
+        # but a 'restrict' reference makes the delete fail and the order is skipped
+        ids_by_model = {'sale.order': orders.ids, 'sale.order.line': orders.order_line.ids}
+        for field in self._get_order_references():
+            model = self.env[field.model_name]
+            if field.ondelete == 'cascade':
+                self.env.cr.execute(SQL(
+                    "DELETE FROM %s WHERE %s = ANY(%s)",
+                    SQL.identifier(model._table), SQL.identifier(field.name), ids_by_model[field.comodel_name],
+                ))
+            elif field.ondelete != 'restrict':
+                self.env.cr.execute(SQL(
+                    "UPDATE %s SET %s = NULL WHERE %s = ANY(%s)",
+                    SQL.identifier(model._table), SQL.identifier(field.name), SQL.identifier(field.name),
+                    ids_by_model[field.comodel_name],
+                ))
+        self.env.cr.execute("""
+            DELETE FROM mail_message WHERE model = 'sale.order' AND res_id = ANY(%(ids)s);
+            DELETE FROM mail_followers WHERE res_model = 'sale.order' AND res_id = ANY(%(ids)s);
+            DELETE FROM sale_order WHERE id = ANY(%(ids)s);
+        """, {'ids': orders.ids})
+        self.env.invalidate_all()
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+from collections import defaultdict
+from datetime import timedelta
+
+import pytz
+
+from odoo import fields, models, api
+
+DELTA_BATCH_SIZE = 5000
+
+
+class SalesDaily(models.Model):
+    """Confirmed sales of a shop per day and hour, in the shop's timezone.
+
+    Confirming or cancelling an order only appends rows to
+    :class:`SalesDelta`, which a cron folds into these aggregates and the
+    best sellers within seconds, so checkouts never wait on each other for
+    the row of the current hour. Dashboards read a handful of rows instead
+    of scanning orders. Use :meth:`_rebuild` to backfill or repair a period.
+    """
+    _name = "angkort.sales.daily"
+    _description = "Shop sales per day and hour"
+    _order = "date, hour"
+    _log_access = False
+
+    shop_id = fields.Many2one('res.partner', string="Shop", required=True, ondelete='cascade', readonly=True)
+    date = fields.Date(string="Date", required=True, readonly=True)
+    hour = fields.Integer(string="Hour", required=True, readonly=True)
+    order_count = fields.Integer(string="Orders", readonly=True)
+    amount_untaxed = fields.Float(string="Untaxed Revenue", readonly=True)
+    amount_total = fields.Float(string="Revenue", readonly=True)
+
+    _sql_constraints = [
+        ('shop_date_hour_uniq', 'unique(shop_id, date, hour)', 'Sales are aggregated once per shop and hour.'),
+    ]
+
+    @api.model
+    def _add_orders(self, orders, sign=1):
+        """Add (``sign=1``) or remove (``sign=-1``) confirmed orders from the aggregates, through new delta rows."""
+        orders = orders.filtered('shop_id')
+        if not orders:
+            return
+        buckets = defaultdict(lambda: [0, 0.0, 0.0])
+        product_buckets = defaultdict(lambda: [0.0, 0.0])
+        for order in orders:
+            tz = pytz.timezone(order.shop_id.tz or 'UTC')
+            local_date = pytz.utc.localize(order.date_order).astimezone(tz)
+            bucket = buckets[order.shop_id.id, local_date.date(), local_date.hour]
+            bucket[0] += sign
+            bucket[1] += sign * order.amount_untaxed
+            bucket[2] += sign * order.amount_total
+            for line in order.order_line:
+                if line.display_type or not line.product_id:
+                    continue
+                product_bucket = product_buckets[order.shop_id.id, local_date.date(), line.product_id.product_tmpl_id.id]
+                product_bucket[0] += sign * line.product_uom_qty
+                product_bucket[1] += sign * line.price_subtotal
+
+        # plain inserts: unlike an upsert of the aggregate rows, they never wait on another checkout
+        self.env['angkort.sales.delta'].create([{
+            'shop_id': shop_id,
+            'date': date,
+            'hour': hour,
+            'order_count': order_count,
+            'amount_untaxed': amount_untaxed,
+            'amount_total': amount_total,
+        } for (shop_id, date, hour), (order_count, amount_untaxed, amount_total) in buckets.items()] + [{
+            'shop_id': shop_id,
+            'date': date,
+            'product_tmpl_id': product_tmpl_id,
+            'quantity': quantity,
+            'amount_untaxed': amount_untaxed,
+        } for (shop_id, date, product_tmpl_id), (quantity, amount_untaxed) in product_buckets.items()])
+        self.env.ref('e_menu.ir_cron_fold_sales_deltas')._trigger()
+
+    @api.model
+    def _fold_deltas(self, batch_size=DELTA_BATCH_SIZE, auto_commit=True):
+        """Move the pending delta rows into the aggregates and the best sellers, one batch per transaction.
+
+        Rows are claimed with ``FOR UPDATE SKIP LOCKED`` and deleted in the
+        statement that adds them up, so a row is never counted twice.
+        """
+        self.env['angkort.sales.delta'].flush_model()
+        today = fields.Date.context_today(self)
+        while True:
+            self.env.cr.execute("""
+                WITH folded AS (
+                    DELETE FROM angkort_sales_delta
+                    WHERE id IN (
+                        SELECT id FROM angkort_sales_delta ORDER BY id LIMIT %(limit)s FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING shop_id, date, hour, product_tmpl_id, order_count, quantity, amount_untaxed, amount_total
+                ), hours AS (
+                    INSERT INTO angkort_sales_daily (shop_id, date, hour, order_count, amount_untaxed, amount_total)
+                    SELECT shop_id, date, hour, SUM(order_count), SUM(amount_untaxed), SUM(amount_total)
+                    FROM folded WHERE product_tmpl_id IS NULL
+                    GROUP BY shop_id, date, hour
+                    ON CONFLICT (shop_id, date, hour) DO UPDATE
+                    SET order_count = angkort_sales_daily.order_count + EXCLUDED.order_count,
+                        amount_untaxed = angkort_sales_daily.amount_untaxed + EXCLUDED.amount_untaxed,
+                        amount_total = angkort_sales_daily.amount_total + EXCLUDED.amount_total
+                ), products AS (
+                    INSERT INTO angkort_sales_product_daily (shop_id, date, product_tmpl_id, quantity, amount_untaxed)
+                    SELECT shop_id, date, product_tmpl_id, SUM(quantity), SUM(amount_untaxed)
+                    FROM folded WHERE product_tmpl_id IS NOT NULL
+                    GROUP BY shop_id, date, product_tmpl_id
+                    ON CONFLICT (shop_id, date, product_tmpl_id) DO UPDATE
+                    SET quantity = angkort_sales_product_daily.quantity + EXCLUDED.quantity,
+                        amount_untaxed = angkort_sales_product_daily.amount_untaxed + EXCLUDED.amount_untaxed
+                ), popularity AS (
+                    INSERT INTO angkort_product_popularity (product_tmpl_id, shop_id, qty_7d, qty_30d)
+                    SELECT product_tmpl_id, MAX(shop_id),
+                           COALESCE(SUM(quantity) FILTER (WHERE date > %(date_7d)s), 0), SUM(quantity)
+                    FROM folded WHERE product_tmpl_id IS NOT NULL AND date > %(date_30d)s
+                    GROUP BY product_tmpl_id
+                    ON CONFLICT (product_tmpl_id) DO UPDATE
+                    SET shop_id = EXCLUDED.shop_id,
+                        qty_7d = angkort_product_popularity.qty_7d + EXCLUDED.qty_7d,
+                        qty_30d = angkort_product_popularity.qty_30d + EXCLUDED.qty_30d
+                )
+                SELECT COUNT(*) FROM folded
+            """, {
+                'limit': batch_size,
+                'date_7d': today - timedelta(days=7),
+                'date_30d': today - timedelta(days=30),
+            })
+            count = self.env.cr.fetchone()[0]
+            if auto_commit:
+                self.env.cr.commit()
+            if count < batch_size:
+                break
+        self.invalidate_model()
+        self.env['angkort.sales.product.daily'].invalidate_model()
+        self.env['angkort.product.popularity'].invalidate_model()
+
+    @api.model
+    def _rebuild(self, shop_id=None, date_from=None, date_to=None):
+        """Recompute the aggregates of a period (and shop) from the confirmed orders.
+
+        Meant for backfills and repairs, e.g. from ``odoo-bin shell``::
+
+            env['angkort.sales.daily']._rebuild(date_from='2024-01-01')
+            env.cr.commit()
+
+        :param date_from: first day to rebuild, in the shops' timezones (inclusive)
+        :param date_to: last day to rebuild (inclusive)
+        """
+        self.env['sale.order'].flush_model()
+        self.env['sale.order.line'].flush_model()
+        self.env['angkort.sales.delta'].flush_model()
+        local_date = "(so.date_order AT TIME ZONE 'UTC' AT TIME ZONE COALESCE(shop.tz, 'UTC'))"
+        conditions = ["so.state = 'sale'", "so.shop_id IS NOT NULL"]
+        aggregate_conditions = []
+        params = {'shop_id': shop_id, 'date_from': date_from, 'date_to': date_to}
+        if shop_id:
+            conditions.append("so.shop_id = %(shop_id)s")
+            aggregate_conditions.append("shop_id = %(shop_id)s")
+        if date_from:
+            conditions.append(f"{local_date}::date >= %(date_from)s")
+            aggregate_conditions.append("date >= %(date_from)s")
+        if date_to:
+            conditions.append(f"{local_date}::date <= %(date_to)s")
+            aggregate_conditions.append("date <= %(date_to)s")
+        where = ' AND '.join(conditions)
+        aggregate_where = ' AND '.join(aggregate_conditions) or 'TRUE'
+
+        # the pending changes of the period are part of the orders read below
+        self.env.cr.execute(f"DELETE FROM angkort_sales_delta WHERE {aggregate_where}", params)
+        self.env.cr.execute(f"DELETE FROM angkort_sales_daily WHERE {aggregate_where}", params)
+        self.env.cr.execute(f"DELETE FROM angkort_sales_product_daily WHERE {aggregate_where}", params)
+        self.env.cr.execute(f"""
+            INSERT INTO angkort_sales_daily (shop_id, date, hour, order_count, amount_untaxed, amount_total)
+            SELECT so.shop_id, {local_date}::date, EXTRACT(hour FROM {local_date})::int,
+                   COUNT(*), SUM(so.amount_untaxed), SUM(so.amount_total)
+            FROM sale_order so
+            JOIN res_partner shop ON shop.id = so.shop_id
+            WHERE {where}
+            GROUP BY 1, 2, 3
+        """, params)
+        self.env.cr.execute(f"""
+            INSERT INTO angkort_sales_product_daily (shop_id, date, product_tmpl_id, quantity, amount_untaxed)
+            SELECT so.shop_id, {local_date}::date, pp.product_tmpl_id, SUM(sol.product_uom_qty), SUM(sol.price_subtotal)
+            FROM sale_order_line sol
+            JOIN sale_order so ON so.id = sol.order_id
+            JOIN res_partner shop ON shop.id = so.shop_id
+            JOIN product_product pp ON pp.id = sol.product_id
+            WHERE {where} AND sol.display_type IS NULL
+            GROUP BY 1, 2, 3
+        """, params)
+        self.invalidate_model()
+        self.env['angkort.sales.product.daily'].invalidate_model()
+
+
+class SalesProductDaily(models.Model):
+    """Confirmed sales of every product of a shop per day, maintained with :class:`SalesDaily`."""
+    _name = "angkort.sales.product.daily"
+    _description = "Shop product sales per day"
+    _order = "date, product_tmpl_id"
+    _log_access = False
+
+    shop_id = fields.Many2one('res.partner', string="Shop", required=True, ondelete='cascade', readonly=True)
+    date = fields.Date(string="Date", required=True, readonly=True)
+    product_tmpl_id = fields.Many2one('product.template', string="Product", required=True, ondelete='cascade',
+                                      readonly=True)
+    quantity = fields.Float(string="Quantity", readonly=True)
+    amount_untaxed = fields.Float(string="Untaxed Revenue", readonly=True)
+
+    _sql_constraints = [
+        ('shop_date_product_uniq', 'unique(shop_id, date, product_tmpl_id)',
+         'Sales are aggregated once per shop, day and product.'),
+    ]
+
+
+class SalesDelta(models.Model):
+    """Change of the sales aggregates not folded into them yet, see :meth:`SalesDaily._fold_deltas`.
+
+    Rows without product change :class:`SalesDaily`, rows with a product
+    change :class:`SalesProductDaily` and the best sellers.
+    """
+    _name = "angkort.sales.delta"
+    _description = "Pending change of the shop sales"
+    _order = "id"
+    _log_access = False
+
+    shop_id = fields.Many2one('res.partner', string="Shop", required=True, ondelete='cascade', readonly=True)
+    date = fields.Date(string="Date", required=True, readonly=True)
+    hour = fields.Integer(string="Hour", readonly=True)
+    product_tmpl_id = fields.Many2one('product.template', string="Product", ondelete='cascade', readonly=True)
+    order_count = fields.Integer(string="Orders", readonly=True)
+    quantity = fields.Float(string="Quantity", readonly=True)
+    amount_untaxed = fields.Float(string="Untaxed Revenue", readonly=True)
+    amount_total = fields.Float(string="Revenue", readonly=True)
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from odoo import models, api
+
+# Quant fields changing the free quantity of a product
+QUANT_AVAILABILITY_FIELDS = {'quantity', 'reserved_quantity', 'location_id', 'product_id'}
+
+
+class StockQuant(models.Model):
+    _inherit = "stock.quant"
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        quants = super().create(vals_list)
+        self.env['angkort.product.availability'].sudo()._refresh_later(quants.product_id.product_tmpl_id.ids)
+        return quants
+
+    def write(self, vals):
+        res = super().write(vals)
+        if QUANT_AVAILABILITY_FIELDS.intersection(vals):
+            self.env['angkort.product.availability'].sudo()._refresh_later(self.product_id.product_tmpl_id.ids)
+        return res
+
+    def unlink(self):
+        product_tmpl_ids = self.product_id.product_tmpl_id.ids
+        res = super().unlink()
+        self.env['angkort.product.availability'].sudo()._refresh_later(product_tmpl_ids)
+        return res
+
+
+class StockMove(models.Model):
+    _inherit = "stock.move"
+
+    def write(self, vals):
+        res = super().write(vals)
+        # reservations and validations may update quants outside of the ORM
+        if 'state' in vals:
+            self.env['angkort.product.availability'].sudo()._refresh_later(self.product_id.product_tmpl_id.ids)
+        return res
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from collections import defaultdict
+
+from odoo import models, api
+
+
+class AngkortStockAvailability(models.AbstractModel):
+    _name = "angkort.stock.availability"
+    _description = "Shop stock availability"
+
+    @api.model
+    def _get_available_qty(self, domain_sql, params):
+        """Return ``{product_tmpl_id: quantity}`` on hand and not reserved in internal locations, in one grouped query."""
+        self.env['stock.quant'].flush_model(['product_id', 'location_id', 'quantity', 'reserved_quantity'])
+        self.env['product.product'].flush_model(['product_tmpl_id'])
+        self.env.cr.execute(f"""
+            SELECT pp.product_tmpl_id, SUM(sq.quantity - sq.reserved_quantity)
+            FROM stock_quant sq
+            JOIN stock_location sl ON sl.id = sq.location_id
+            JOIN product_product pp ON pp.id = sq.product_id
+            JOIN product_template pt ON pt.id = pp.product_tmpl_id
+            WHERE sl.usage = 'internal' AND {domain_sql}
+            GROUP BY pp.product_tmpl_id
+        """, params)
+        return defaultdict(float, self.env.cr.fetchall())
+
+    @api.model
+    def _get_products_qty(self, product_tmpl_ids):
+        """Return the free quantity of the given product templates."""
+        if not product_tmpl_ids:
+            return defaultdict(float)
+        return self._get_available_qty('pt.id = ANY(%s)', [list(product_tmpl_ids)])
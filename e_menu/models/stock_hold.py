@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+
+from psycopg2.errors import SerializationFailure
+
+from odoo import fields, models, api
+
+DEFAULT_HOLD_MINUTES = 10
+RELEASE_BATCH_SIZE = 1000
+CLAIM_ATTEMPTS = 3
+
+
+class StockHold(models.Model):
+    """One unit of free stock of a product.
+
+    The table holds one row per unit of free quantity of every storable menu
+    product. A checkout claims rows for the quantities of its cart, skipping
+    rows being claimed by concurrent checkouts (``FOR UPDATE SKIP LOCKED``),
+    so customers ordering the same dish never wait on each other. Rows are
+    picked in random order, so concurrent checkouts rarely pick the same
+    ones. A claim
+    expires after ``e_menu.stock_hold_ttl`` minutes unless an order is placed
+    with it; the rows of an order are removed when it is confirmed, as its
+    delivery then reserves the stock, and released when it is cancelled.
+    """
+    _name = "angkort.stock.hold"
+    _description = "Stock hold"
+    _log_access = False
+
+    product_tmpl_id = fields.Many2one('product.template', string="Product", required=True, index=True,
+                                      ondelete='cascade', readonly=True)
+    holder = fields.Char(string="Hold Token", index='btree_not_null', readonly=True)
+    user_id = fields.Many2one('res.users', string="Customer", ondelete='set null', readonly=True)
+    expires_at = fields.Datetime(string="Expires At", index='btree_not_null', readonly=True)
+    order_id = fields.Many2one('sale.order', string="Order", index='btree_not_null', ondelete='set null',
+                               readonly=True)
+
+    @api.model
+    def _get_ttl(self):
+        ttl = self.env['ir.config_parameter'].sudo().get_param('e_menu.stock_hold_ttl', DEFAULT_HOLD_MINUTES)
+        return timedelta(minutes=int(ttl))
+
+    @api.model
+    def _sync_units(self, products):
+        """Make the number of rows of each storable product match its free quantity.
+
+        Counts are compared first with one grouped query; only products whose
+        stock changed lock their :class:`StockHoldVersion` row and add or
+        remove unclaimed rows, so regular checkouts do not lock anything here.
+        """
+        products = products.filtered('is_storable')
+        if not products:
+            return
+        free_qty = self.env['angkort.stock.availability']._get_products_qty(products.ids)
+        self.env.cr.execute("""
+            SELECT product_tmpl_id, COUNT(*) FROM angkort_stock_hold
+            WHERE product_tmpl_id = ANY(%s)
+            GROUP BY product_tmpl_id
+        """, [products.ids])
+        counts = dict(self.env.cr.fetchall())
+        for product in products:
+            target = max(int(free_qty[product.id]), 0)
+            if counts.get(product.id, 0) == target:
+                continue
+            # Bumping the version row serializes the syncs of a product. A sync that waited on it
+            # for another one fails with a serialization error instead of counting units from a
+            # snapshot older than that sync, and the request is retried with a fresh snapshot.
+            self.env.cr.execute("""
+                INSERT INTO angkort_stock_hold_version (product_tmpl_id, version)
+                VALUES (%s, 1)
+                ON CONFLICT (product_tmpl_id) DO UPDATE
+                SET version = angkort_stock_hold_version.version + 1
+            """, [product.id])
+            self.env.cr.execute("SELECT COUNT(*) FROM angkort_stock_hold WHERE product_tmpl_id = %s", [product.id])
+            count = self.env.cr.fetchone()[0]
+            if count < target:
+                self.env.cr.execute("""
+                    INSERT INTO angkort_stock_hold (product_tmpl_id)
+                    SELECT %s FROM generate_series(1, %s)
+                """, [product.id, target - count])
+            elif count > target:
+                # only free or expired units can go, a claimed unit is still promised to a customer
+                self.env.cr.execute("""
+                    DELETE FROM angkort_stock_hold
+                    WHERE id IN (
+                        SELECT id FROM angkort_stock_hold
+                        WHERE product_tmpl_id = %s AND order_id IS NULL
+                          AND (expires_at IS NULL OR expires_at < %s)
+                        LIMIT %s
+                        FOR UPDATE SKIP LOCKED
+                    )
+                """, [product.id, fields.Datetime.now(), count - target])
+        self.env['angkort.stock.hold.version'].invalidate_model()
+
+    @api.model
+    def _claim(self, quantities, holder=None):
+        """Claim units for a cart.
+
+        :param quantities: ``{product_tmpl_id: quantity}`` of storable products
+        :param holder: token of a previous claim of the customer, whose units are released first
+        :return: ``(holder, expires_at, missing)`` where ``missing`` maps the
+                 products that could not be fully claimed to the quantity
+                 that was available; nothing is claimed when it is not empty
+        """
+        self.flush_model()
+        if holder:
+            self._release(holder)
+        holder = uuid.uuid4().hex
+        now = fields.Datetime.now()
+        expires_at = now + self._get_ttl()
+        missing = {}
+        with self.env.cr.savepoint(flush=False) as savepoint:
+            for product_tmpl_id, quantity in quantities.items():
+                if quantity <= 0:
+                    continue
+                claimed = self._claim_units(product_tmpl_id, quantity, holder, expires_at, now)
+                if claimed < quantity:
+                    missing[product_tmpl_id] = claimed
+            if missing:
+                savepoint.rollback()
+        self.invalidate_model()
+        return holder, expires_at, missing
+
+    @api.model
+    def _claim_units(self, product_tmpl_id, quantity, holder, expires_at, now):
+        """Claim up to ``quantity`` free units of a product and return how many were claimed.
+
+        Under REPEATABLE READ, picking a unit claimed by a transaction that
+        committed after ours started raises a serialization failure. The
+        pick is then tried again with other random units; only when every
+        attempt fails is the error raised, for the whole transaction to be
+        retried with a fresh snapshot.
+        """
+        for attempt in range(CLAIM_ATTEMPTS):
+            try:
+                with self.env.cr.savepoint(flush=False):
+                    self.env.cr.execute("""
+                        UPDATE angkort_stock_hold
+                        SET holder = %s, user_id = %s, expires_at = %s
+                        WHERE id IN (
+                            SELECT id FROM angkort_stock_hold
+                            WHERE product_tmpl_id = %s AND order_id IS NULL
+                              AND (expires_at IS NULL OR expires_at < %s)
+                            ORDER BY random()
+                            LIMIT %s
+                            FOR UPDATE SKIP LOCKED
+                        )
+                    """, [holder, self.env.uid, expires_at, product_tmpl_id, now, quantity],
+                        log_exceptions=False)
+                    return self.env.cr.rowcount
+            except SerializationFailure:
+                if attempt == CLAIM_ATTEMPTS - 1:
+                    raise
+
+    @api.model
+    def _hold_cart(self, cart, holder=None):
+        """Claim the units of the storable products of a priced cart.
+
+        :param cart: cart priced by ``angkort.price.table._price_cart``, without invalid lines
+        :param holder: token of a previous claim of the customer, whose units are released first
+        :return: ``(holder, expires_at, missing)`` where ``missing`` lists the
+                 lines that cannot be held with the available quantity
+        """
+        products = self.env['product.template'].browse({line['product_tmpl_id'] for line in cart['lines']})
+        storable_ids = set(products.filtered('is_storable').ids)
+        quantities = defaultdict(int)
+        for line in cart['lines']:
+            if line['product_tmpl_id'] in storable_ids:
+                quantities[line['product_tmpl_id']] += line['quantity']
+        self._sync_units(products)
+        holder, expires_at, missing = self._claim(quantities, holder)
+        return holder, expires_at, [{
+            'product_id': line['product_id'],
+            'name': line['name'],
+            'quantity': line['quantity'],
+            'available': missing[line['product_tmpl_id']],
+        } for line in cart['lines'] if line['product_tmpl_id'] in missing]
+
+    @api.model
+    def _attach_to_order(self, holder, order):
+        """Keep the units claimed with ``holder`` for ``order`` until it is confirmed or cancelled."""
+        self.flush_model()
+        self.env.cr.execute("""
+            UPDATE angkort_stock_hold SET order_id = %s, expires_at = NULL
+            WHERE holder = %s AND order_id IS NULL
+        """, [order.id, holder])
+        self.invalidate_model()
+
+    @api.model
+    def _release(self, holder):
+        """Release the units claimed with ``holder`` that are not tied to an order yet."""
+        self.flush_model()
+        self.env.cr.execute("""
+            UPDATE angkort_stock_hold SET holder = NULL, user_id = NULL, expires_at = NULL
+            WHERE holder = %s AND order_id IS NULL
+        """, [holder])
+        self.invalidate_model()
+
+    @api.model
+    def _release_expired_holds(self, auto_commit=True):
+        """Release expired claims in batches, committing after each one so checkouts are never blocked for long."""
+        while True:
+            self.env.cr.execute("""
+                UPDATE angkort_stock_hold SET holder = NULL, user_id = NULL, expires_at = NULL
+                WHERE id IN (
+                    SELECT id FROM angkort_stock_hold
+                    WHERE order_id IS NULL AND expires_at < %s
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+            """, [fields.Datetime.now(), RELEASE_BATCH_SIZE])
+            released = self.env.cr.rowcount
+            if auto_commit:
+                self.env.cr.commit()
+            if released < RELEASE_BATCH_SIZE:
+                break
+
+
+class StockHoldVersion(models.Model):
+    """Version of the unit rows of a product, bumped by every :meth:`StockHold._sync_units` that changes them."""
+    _name = "angkort.stock.hold.version"
+    _description = "Stock hold version"
+    _log_access = False
+
+    product_tmpl_id = fields.Many2one('product.template', string="Product", required=True, ondelete='cascade',
+                                      readonly=True)
+    version = fields.Integer(string="Version", readonly=True)
+
+    _sql_constraints = [
+        ('product_tmpl_id_uniq', 'unique(product_tmpl_id)', 'A product has a single stock hold version.'),
+    ]
@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*-
+
+from . import test_price_table_benchmark
+from . import test_order_create_benchmark
+from . import test_stock_hold_concurrency
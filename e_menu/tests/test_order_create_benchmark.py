@@ -0,0 +1,107 @@
+import logging
+import time
+
+from odoo import Command
+from odoo.tests.common import TransactionCase, tagged
+
+_logger = logging.getLogger(__name__)
+
+MENU_SIZE = 50
+ORDER_SIZE = 5
+ORDERS = 100
+
+
+@tagged('post_install', '-at_install', '-standard', 'angkort_benchmark')
+class TestOrderCreateBenchmark(TransactionCase):
+    """Compare the regular creation of menu orders with the fast path.
+
+    Run with ``--test-tags angkort_benchmark``.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.shop = cls.env['res.partner'].create({'name': 'Benchmark Shop', 'type': 'store'})
+        cls.customer = cls.env['res.partner'].create({'name': 'Benchmark Customer'})
+        cls.products = cls.env['product.product'].create([{
+            'name': f'Dish {index}',
+            'list_price': 1.0 + index % 20,
+            'shop_id': cls.shop.id,
+        } for index in range(MENU_SIZE)])
+
+    def _order_lines(self, index):
+        return [Command.create({
+            'product_id': self.products[(index + offset) % MENU_SIZE].id,
+            'product_uom_qty': 1 + offset % 3,
+            'price_unit': self.products[(index + offset) % MENU_SIZE].list_price,
+        }) for offset in range(ORDER_SIZE)]
+
+    def _create_regular(self, index):
+        return self.env['sale.order'].create({
+            'partner_id': self.customer.id,
+            'shop_id': self.shop.id,
+            'order_line': self._order_lines(index),
+        })
+
+    def _create_fast(self, index):
+        return self.env['sale.order']._angkort_fast_create(self.shop.id, self.customer, self._order_lines(index))
+
+    def _count_queries(self, func, *args):
+        start = self.cr.sql_log_count
+        func(*args)
+        self.env.flush_all()
+        return self.cr.sql_log_count - start
+
+    def test_order_create_benchmark(self):
+        regular, fast = self._create_regular(0), self._create_fast(0)
+        self.assertAlmostEqual(regular.amount_total, fast.amount_total)
+        self.assertEqual(regular.order_line.tax_id, fast.order_line.tax_id)
+        self.env.flush_all()
+
+        # the fast path must need fewer queries than the regular creation of the same order
+        regular_queries = self._count_queries(self._create_regular, 1)
+        with self.assertQueryCount(regular_queries - 1):
+            self._create_fast(1)
+            self.env.flush_all()
+
+        start = time.perf_counter()
+        for index in range(ORDERS):
+            self._create_regular(index)
+            self.env.flush_all()
+        regular_rate = ORDERS / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for index in range(ORDERS):
+            self._create_fast(index)
+            self.env.flush_all()
+        fast_rate = ORDERS / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        self.env['sale.order']._angkort_process_deferred(auto_commit=False)
+        deferred_duration = time.perf_counter() - start
+
+        _logger.info(
+            "Creating %s-line menu orders: regular %.1f orders/s (%s queries), fast path %.1f orders/s "
+            "(deferred processing of %s orders: %.1f ms)",
+            ORDER_SIZE, regular_rate, regular_queries, fast_rate, ORDERS + 2, deferred_duration * 1000,
+        )
+        self.assertIn(self.customer, fast.message_partner_ids)
+
+    def test_fast_create_fiscal_position(self):
+        """Customers whose fiscal position is detected from their address keep the regular taxes."""
+        tax = self.env['account.tax'].create({'name': 'Benchmark Tax', 'amount': 10.0})
+        mapped_tax = self.env['account.tax'].create({'name': 'Benchmark Mapped Tax', 'amount': 5.0})
+        self.products.taxes_id = tax
+        country = self.env.ref('base.be')
+        self.env['account.fiscal.position'].create({
+            'name': 'Benchmark Position',
+            'auto_apply': True,
+            'country_id': country.id,
+            'tax_ids': [Command.create({'tax_src_id': tax.id, 'tax_dest_id': mapped_tax.id})],
+        })
+        self.customer.country_id = country
+        self.assertFalse(self.customer.property_account_position_id)
+
+        fast = self._create_fast(0)
+        self.assertTrue(fast.fiscal_position_id)
+        self.assertEqual(fast.order_line.tax_id, mapped_tax)
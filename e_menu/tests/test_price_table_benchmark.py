@@ -0,0 +1,109 @@
+import logging
+import random
+import time
+
+from odoo import Command
+from odoo.tests.common import TransactionCase, tagged
+
+_logger = logging.getLogger(__name__)
+
+MENU_SIZE = 1000
+CART_SIZE = 10
+ROUNDS = 200
+
+
+@tagged('post_install', '-at_install', '-standard', 'angkort_benchmark')
+class TestPriceTableBenchmark(TransactionCase):
+    """Compare cart pricing through the ORM with the compiled price table.
+
+    Run with ``--test-tags angkort_benchmark``.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.shop = cls.env['res.partner'].with_context(create_company=True).create([{'name': 'Benchmark Shop'}])
+        cls.attribute = cls.env['product.attribute'].create({
+            'name': 'Size',
+            'display_type': 'radio',
+            'create_variant': 'no_variant',
+            'shop_id': cls.shop.id,
+            'value_ids': [Command.create({'name': name, 'default_extra_price': extra})
+                          for name, extra in (('Small', 0.0), ('Medium', 0.5), ('Large', 1.0))],
+        })
+        cls.templates = cls.env['product.template'].with_context(tracking_disable=True).create([{
+            'name': f'Dish {index}',
+            'list_price': 1.0 + index % 20,
+            'shop_id': cls.shop.id,
+            'attribute_line_ids': [Command.create({
+                'attribute_id': cls.attribute.id,
+                'value_ids': [Command.set(cls.attribute.value_ids.ids)],
+            })],
+        } for index in range(MENU_SIZE)])
+        randomizer = random.Random(42)
+        cls.cart = [{
+            'product_id': randomizer.choice(cls.templates.product_variant_ids).id,
+            'quantity': randomizer.randint(1, 3),
+            'variants': [{'attribute_id': cls.attribute.id, 'value_id': randomizer.choice(cls.attribute.value_ids).id}],
+        } for _index in range(CART_SIZE)]
+
+    def _price_cart_with_orm(self, lines):
+        """Price a cart the way calculate-price did before the price table: ORM reads per line and variant."""
+        total = 0.0
+        for line in lines:
+            product = self.env['product.product'].search([
+                ('id', '=', line['product_id']),
+                ('shop_id', '=', self.shop.id),
+            ], limit=1)
+            unit_price = product.list_price
+            for variant in line['variants']:
+                attribute = self.env['product.attribute'].browse(variant['attribute_id'])
+                value = self.env['product.attribute.value'].browse(variant['value_id'])
+                if not attribute.exists() or not value.exists():
+                    continue
+                ptav = product.product_tmpl_id.attribute_line_ids.product_template_value_ids.filtered(
+                    lambda ptav: ptav.product_attribute_value_id == value)
+                unit_price += ptav.price_extra if ptav else value.default_extra_price
+            total += unit_price * line['quantity']
+        return total
+
+    def _price_cart_with_table(self, lines):
+        table = self.env['angkort.price.table']._get_table(self.shop.id)
+        return sum(line['total'] for line in table.price_lines(lines))
+
+    def test_cart_pricing_benchmark(self):
+        self.assertAlmostEqual(self._price_cart_with_orm(self.cart), self._price_cart_with_table(self.cart))
+
+        start = self.cr.sql_log_count
+        self.env.invalidate_all()
+        self._price_cart_with_orm(self.cart)
+        orm_queries = self.cr.sql_log_count - start
+
+        # a cached table only costs the lookup of the menu version of the shop
+        with self.assertQueryCount(1):
+            self._price_cart_with_table(self.cart)
+
+        start = time.perf_counter()
+        for _round in range(ROUNDS):
+            self.env.invalidate_all()
+            self._price_cart_with_orm(self.cart)
+        orm_duration = (time.perf_counter() - start) / ROUNDS
+
+        # building the table reads each model once, whatever the size of the menu
+        self.env['res.partner']._angkort_bump_menu_version(self.shop.ids)
+        start = time.perf_counter()
+        with self.assertQueryCount(orm_queries - 1):
+            self._price_cart_with_table(self.cart)
+        build_duration = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _round in range(ROUNDS):
+            self._price_cart_with_table(self.cart)
+        table_duration = (time.perf_counter() - start) / ROUNDS
+
+        _logger.info(
+            "Pricing a %s-line cart on a %s-item menu: ORM %.3f ms (%s queries), price table %.3f ms "
+            "(table build %.1f ms, %.0fx faster per cart)",
+            CART_SIZE, MENU_SIZE, orm_duration * 1000, orm_queries, table_duration * 1000, build_duration * 1000,
+            orm_duration / table_duration if table_duration else float('inf'),
+        )
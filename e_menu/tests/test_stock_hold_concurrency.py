@@ -0,0 +1,119 @@
+import threading
+from contextlib import contextmanager
+
+from psycopg2.errors import SerializationFailure
+
+from odoo import api, SUPERUSER_ID
+from odoo.modules.registry import Registry
+from odoo.tests.common import BaseCase, get_db_name, tagged
+
+FREE_QTY = 20
+CLAIMERS = 10
+CLAIM_QTY = 3
+REQUEST_TRIES = 5
+
+
+@tagged('post_install', '-at_install', '-standard', 'angkort_concurrency')
+class TestStockHoldConcurrency(BaseCase):
+    """Syncs and claims of the stock units of a product running in several transactions at once.
+
+    Uses real cursors and commits, so it is not part of the standard run;
+    committed data is removed at the end of the test.
+    """
+
+    @contextmanager
+    def environment(self):
+        with Registry(get_db_name()).cursor() as cr:
+            yield api.Environment(cr, SUPERUSER_ID, {})
+
+    def setUp(self):
+        super().setUp()
+        with self.environment() as env:
+            shop = env['res.partner'].create({'name': 'Concurrency Shop', 'type': 'store'})
+            product = env['product.template'].create({
+                'name': 'Concurrency Dish',
+                'is_storable': True,
+                'shop_id': shop.id,
+            })
+            env['stock.quant']._update_available_quantity(
+                product.product_variant_id, env.ref('stock.stock_location_stock'), FREE_QTY)
+            self.shop_id, self.product_id = shop.id, product.id
+        self.addCleanup(self._cleanup)
+
+    def _cleanup(self):
+        with self.environment() as env:
+            product = env['product.template'].browse(self.product_id)
+            env['stock.quant'].search([('product_id', 'in', product.product_variant_ids.ids)]).sudo().unlink()
+            product.unlink()
+            env['res.partner'].browse(self.shop_id).unlink()
+
+    def _count_units(self, env):
+        env.cr.execute("SELECT COUNT(*) FROM angkort_stock_hold WHERE product_tmpl_id = %s", [self.product_id])
+        return env.cr.fetchone()[0]
+
+    def test_concurrent_syncs_do_not_oversell(self):
+        with self.environment() as env1, self.environment() as env2:
+            product1 = env1['product.template'].browse(self.product_id)
+            product2 = env2['product.template'].browse(self.product_id)
+            # both transactions take their snapshot before either syncs
+            self.assertEqual(self._count_units(env1), 0)
+            self.assertEqual(self._count_units(env2), 0)
+
+            env1['angkort.stock.hold']._sync_units(product1)
+            env1.cr.commit()
+
+            # the second sync still sees no unit in its snapshot, it must not add FREE_QTY more
+            with self.assertRaises(SerializationFailure):
+                env2['angkort.stock.hold']._sync_units(product2)
+            env2.cr.rollback()
+
+            # retried with a fresh snapshot, as the request would be
+            env2['angkort.stock.hold']._sync_units(product2)
+            env2.cr.commit()
+
+        with self.environment() as env:
+            self.assertEqual(self._count_units(env), FREE_QTY)
+
+    def test_concurrent_claims_do_not_oversell(self):
+        with self.environment() as env:
+            env['angkort.stock.hold']._sync_units(env['product.template'].browse(self.product_id))
+        barrier = threading.Barrier(CLAIMERS)
+        claimed, errors = [], []
+
+        def checkout():
+            try:
+                for attempt in range(REQUEST_TRIES):
+                    with self.environment() as env:
+                        # take the snapshot before any claimer commits, at least on the first try
+                        self._count_units(env)
+                        if not attempt:
+                            barrier.wait()
+                        try:
+                            _holder, _expires_at, missing = env['angkort.stock.hold']._claim(
+                                {self.product_id: CLAIM_QTY})
+                        except SerializationFailure:
+                            # retried with a fresh snapshot, as the request would be
+                            env.cr.rollback()
+                            continue
+                        if not missing:
+                            claimed.append(CLAIM_QTY)
+                        return
+                errors.append("claim still conflicting after %s tries" % REQUEST_TRIES)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=checkout) for _i in range(CLAIMERS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertFalse(errors)
+        self.assertLessEqual(sum(claimed), FREE_QTY)
+        with self.environment() as env:
+            env.cr.execute("""
+                SELECT COUNT(*) FROM angkort_stock_hold
+                WHERE product_tmpl_id = %s AND holder IS NOT NULL
+            """, [self.product_id])
+            self.assertEqual(env.cr.fetchone()[0], sum(claimed))
+            self.assertEqual(self._count_units(env), FREE_QTY)